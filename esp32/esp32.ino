@@ -15,6 +15,21 @@ const char* TIMEZONE = "CET-1CEST,M3.5.0,M10.5.0/3";
 const int BACKUP_CHECK_HOURS = 3;
 const int MANUAL_UPDATE_PIN = 0;
 
+// Download the server-quantized frame (/calendar.epd, ~96KB) instead of the
+// 24-bit BMP that has to be dithered here on every page pass
+const bool USE_PACKED_FRAME = true;
+// Fetch the packed frame PackBits-compressed (/calendar.rle, usually <20KB)
+const bool USE_COMPRESSED_FRAME = true;
+// When only part of the frame changed, fetch just the changed rectangles
+// (/calendar.diff) and refresh them in partial windows
+const bool USE_FRAME_DIFF = true;
+// A partial refresh on this 3-colour panel is as slow as a full one, so the
+// diff is fetched as a single rectangle and refreshed once; when it covers
+// more than this share of the screen the full frame is cheaper to fetch
+const float FRAME_DIFF_MAX_AREA = 0.6;
+// Times an interrupted frame download is resumed (HTTP Range) before giving up
+const int DOWNLOAD_RESUME_ATTEMPTS = 3;
+
 // ESP32-S3 Display pins
 const int PIN_CS   = 10;
 const int PIN_DC   = 13;
@@ -37,6 +52,8 @@ int16_t* errorBuffer = nullptr;
 RTC_DATA_ATTR int bootCount = 0;
 RTC_DATA_ATTR time_t lastUpdate = 0;
 RTC_DATA_ATTR bool firstBoot = true;
+RTC_DATA_ATTR char lastFrameHash[65] = "";  // frame_hash of the frame on screen
+RTC_DATA_ATTR uint32_t serverSleepSeconds = 0;  // sleep_seconds from the last /info, 0 = unknown
 
 GxEPD2_3C<GxEPD2_750c_Z08, GxEPD2_750c_Z08::HEIGHT / 8> display(GxEPD2_750c_Z08(PIN_CS, PIN_DC, PIN_RST, PIN_BUSY));
 
@@ -44,6 +61,11 @@ GxEPD2_3C<GxEPD2_750c_Z08, GxEPD2_750c_Z08::HEIGHT / 8> display(GxEPD2_750c_Z08(
 void showError(const char* message);
 void goToSleep();
 bool downloadAndDisplayCalendar();
+bool drawPackedFrame(uint8_t* buffer, size_t size);
+bool unpackBitsRow(const uint8_t*& src, const uint8_t* srcEnd, uint8_t* dst, size_t rowBytes);
+bool downloadAndDrawDiff(const char* frameHash);
+uint32_t readFrameBytes(HTTPClient& http, uint8_t* buffer, uint32_t offset, uint32_t total);
+bool drawFrameDiff(uint8_t* buffer, size_t size);
 
 // BMP Header structures
 #pragma pack(push, 1)
@@ -68,6 +90,16 @@ struct BMPInfoHeader {
   uint32_t colorsUsed;
   uint32_t colorsImportant;
 };
+
+// Header of the packed frame served at /calendar.epd
+struct PackedFrameHeader {
+  char magic[4];      // "EPD3"
+  uint16_t width;
+  uint16_t height;
+  uint8_t planes;     // 2: black plane, then red plane
+  uint8_t encoding;   // 0 = raw
+  uint16_t reserved;
+};
 #pragma pack(pop)
 
 // Color distance function for 3-color e-ink
@@ -163,6 +195,7 @@ void setup() {
       WiFi.mode(WIFI_OFF);
       delay(1000);
     } else {
+      serverSleepSeconds = 0;  // Fall back to the fixed schedule
       showError("WiFi Failed");
     }
   } else {
@@ -184,6 +217,9 @@ void loop() {}
 bool shouldCheckForUpdate() {
   if (firstBoot) return true;
   
+  // The server told us when to wake up, so this wake-up is the planned check
+  if (serverSleepSeconds > 0) return true;
+  
   time_t now = time(nullptr);
   if (now < 1000000) return true;
   
@@ -253,6 +289,7 @@ bool downloadAndDisplayCalendar() {
   
   if (httpCode != 200) {
     Serial.printf("Info request failed: %d\n", httpCode);
+    serverSleepSeconds = 0;
     http.end();
     showError("Server Error");
     return false;
@@ -263,15 +300,19 @@ bool downloadAndDisplayCalendar() {
   
   Serial.printf("Server info: %s\n", payload.c_str());
   
-  DynamicJsonDocument doc(512);
+  DynamicJsonDocument doc(2048);
   DeserializationError error = deserializeJson(doc, payload);
   
   if (error) {
     Serial.printf("JSON parse failed: %s\n", error.c_str());
+    serverSleepSeconds = 0;
     showError("JSON Error");
     return false;
   }
   
+  // Sleep until the server expects the next change (missing on old servers)
+  serverSleepSeconds = doc["sleep_seconds"] | 0;
+  
   bool calendarAvailable = doc["calendar_available"];
   
   if (!calendarAvailable) {
@@ -280,14 +321,36 @@ bool downloadAndDisplayCalendar() {
     return false;
   }
   
+  // Skip the download entirely when the server still has the frame we show
+  const char* frameHash = doc["frame_hash"] | "";
+  if (!firstBoot && frameHash[0] != '\0' && strcmp(frameHash, lastFrameHash) == 0) {
+    Serial.printf("Frame unchanged (%s), skipping download\n", frameHash);
+    return true;
+  }
+  
+  // Try the partial update first; any failure falls back to the full frame
+  if (USE_FRAME_DIFF && USE_PACKED_FRAME && !firstBoot && lastFrameHash[0] != '\0' && frameHash[0] != '\0') {
+    if (downloadAndDrawDiff(frameHash)) {
+      strlcpy(lastFrameHash, frameHash, sizeof(lastFrameHash));
+      return true;
+    }
+    Serial.println("Partial update not possible, downloading full frame");
+  }
+  
   Serial.printf("Free PSRAM before download: %u bytes\n", ESP.getFreePsram());
   Serial.printf("Free heap before download: %u bytes\n", ESP.getFreeHeap());
   
-  // Download BMP file
-  http.begin(String(SERVER_URL) + "/calendar.png");
+  // Download packed frame or BMP file, from the URL of this frame version
+  // when the server has one: it never changes, so a download can be resumed.
+  // frame_urls are relative to SERVER_URL, which may point at a profile.
+  const char* framePath = USE_PACKED_FRAME ? (USE_COMPRESSED_FRAME ? "/calendar.rle" : "/calendar.epd") : "/calendar.png";
+  String frameUrl = String(SERVER_URL) + (doc["frame_urls"][framePath] | framePath);
+  http.begin(frameUrl);
   http.setTimeout(120000);
+  const char* headerKeys[] = {"ETag"};
+  http.collectHeaders(headerKeys, 1);
   
-  Serial.println("Requesting calendar image (BMP format)...");
+  Serial.printf("Requesting calendar image (%s)...\n", framePath);
   httpCode = http.GET();
   
   if (httpCode != 200) {
@@ -333,41 +396,37 @@ bool downloadAndDisplayCalendar() {
   Serial.printf("Allocated buffers successfully\n");
   
   // Read image data
-  WiFiClient* stream = http.getStreamPtr();
-  uint32_t bytesRead = 0;
-  uint32_t lastProgress = 0;
-  
   Serial.println("Downloading BMP image...");
-  unsigned long downloadStart = millis();
+  // Resumes send it as If-Range, so the rest can only come from this same file
+  String frameETag = http.header("ETag");
+  uint32_t bytesRead = readFrameBytes(http, imageBuffer, 0, fileSize);
+  http.end();
   
-  while (http.connected() && bytesRead < fileSize) {
-    if (millis() - downloadStart > 120000) {
-      Serial.println("Download timeout!");
+  // Resume an interrupted download from the last byte received
+  for (int attempt = 1; bytesRead < fileSize && attempt <= DOWNLOAD_RESUME_ATTEMPTS; attempt++) {
+    Serial.printf("Resuming download at byte %u (attempt %d)\n", bytesRead, attempt);
+    if (WiFi.status() != WL_CONNECTED && !connectToWiFi()) {
       break;
     }
     
-    size_t available = stream->available();
-    if (available) {
-      size_t toRead = min(available, (size_t)(fileSize - bytesRead));
-      size_t actualRead = stream->readBytes(imageBuffer + bytesRead, toRead);
-      
-      if (actualRead > 0) {
-        bytesRead += actualRead;
-        
-        if (bytesRead - lastProgress >= 50000 || bytesRead == fileSize) {
-          Serial.printf("Downloaded: %u / %d bytes (%.1f%%)\n", 
-                        bytesRead, fileSize, (bytesRead * 100.0) / fileSize);
-          lastProgress = bytesRead;
-        }
-      }
-    } else {
-      delay(10);
+    http.begin(frameUrl);
+    http.setTimeout(120000);
+    http.addHeader("Range", "bytes=" + String(bytesRead) + "-");
+    if (frameETag.length() > 0) {
+      http.addHeader("If-Range", frameETag);
     }
-    yield();
+    httpCode = http.GET();
+    
+    // Anything but 206 means the server can't continue this frame
+    if (httpCode != 206) {
+      Serial.printf("Resume failed: %d\n", httpCode);
+      http.end();
+      break;
+    }
+    bytesRead = readFrameBytes(http, imageBuffer, bytesRead, fileSize);
+    http.end();
   }
   
-  http.end();
-  
   if (bytesRead < fileSize) {
     Serial.printf("Incomplete download\n");
     free(imageBuffer);
@@ -378,6 +437,18 @@ bool downloadAndDisplayCalendar() {
     return false;
   }
   
+  if (USE_PACKED_FRAME) {
+    bool displayed = drawPackedFrame(imageBuffer, bytesRead);
+    free(imageBuffer);
+    free(errorBuffer);
+    imageBuffer = nullptr;
+    errorBuffer = nullptr;
+    if (displayed) {
+      strlcpy(lastFrameHash, frameHash, sizeof(lastFrameHash));
+    }
+    return displayed;
+  }
+  
   // Parse BMP header
   Serial.println("\n=== BMP File Analysis ===");
   
@@ -505,6 +576,8 @@ bool downloadAndDisplayCalendar() {
   imageBuffer = nullptr;
   errorBuffer = nullptr;
   
+  strlcpy(lastFrameHash, frameHash, sizeof(lastFrameHash));
+  
   Serial.printf("Free PSRAM after cleanup: %u bytes\n", ESP.getFreePsram());
   Serial.printf("Free heap after cleanup: %u bytes\n", ESP.getFreeHeap());
   
@@ -512,6 +585,268 @@ bool downloadAndDisplayCalendar() {
   return true;
 }
 
+bool drawPackedFrame(uint8_t* buffer, size_t size) {
+  // The server already quantized and dithered the frame; just blit both planes
+  PackedFrameHeader* header = (PackedFrameHeader*)buffer;
+  size_t planeSize = ((DISPLAY_WIDTH + 7) / 8) * DISPLAY_HEIGHT;
+  
+  if (size < sizeof(PackedFrameHeader) || memcmp(header->magic, "EPD3", 4) != 0) {
+    Serial.println("ERROR: Not a packed frame!");
+    showError("Invalid Frame");
+    return false;
+  }
+  
+  if (header->width != DISPLAY_WIDTH || header->height != DISPLAY_HEIGHT || header->encoding > 1 ||
+      (header->encoding == 0 && size < sizeof(PackedFrameHeader) + 2 * planeSize)) {
+    Serial.printf("ERROR: Unsupported frame %dx%d, encoding %d\n", header->width, header->height, header->encoding);
+    showError("Wrong Format");
+    return false;
+  }
+  
+  const uint8_t* blackPlane = buffer + sizeof(PackedFrameHeader);
+  uint8_t* planes = nullptr;
+  
+  if (header->encoding == 1) {
+    // PackBits per row: decode both planes in one pass
+    planes = (uint8_t*)ps_malloc(2 * planeSize);
+    if (!planes) {
+      Serial.println("Failed to allocate plane buffer");
+      showError("Memory Error");
+      return false;
+    }
+    
+    const uint8_t* src = blackPlane;
+    const uint8_t* srcEnd = buffer + size;
+    size_t rowBytes = (DISPLAY_WIDTH + 7) / 8;
+    for (int row = 0; row < 2 * DISPLAY_HEIGHT; row++) {
+      if (!unpackBitsRow(src, srcEnd, planes + row * rowBytes, rowBytes)) {
+        Serial.printf("ERROR: Corrupt compressed frame at row %d\n", row);
+        free(planes);
+        showError("Corrupt Frame");
+        return false;
+      }
+    }
+    blackPlane = planes;
+  }
+  
+  const uint8_t* redPlane = blackPlane + planeSize;
+  
+  Serial.println("Initializing display...");
+  display.init(115200, true, 2);
+  display.setFullWindow();
+  display.firstPage();
+  
+  Serial.println("Drawing packed frame...");
+  do {
+    display.fillScreen(GxEPD_WHITE);
+    display.drawBitmap(0, 0, blackPlane, DISPLAY_WIDTH, DISPLAY_HEIGHT, GxEPD_BLACK);
+    display.drawBitmap(0, 0, redPlane, DISPLAY_WIDTH, DISPLAY_HEIGHT, GxEPD_RED);
+  } while (display.nextPage());
+  
+  if (planes) {
+    free(planes);
+  }
+  
+  Serial.println("Display refresh complete!");
+  return true;
+}
+
+// Read the response body into buffer from offset until total bytes are there,
+// the connection drops or the timeout passes. Returns the bytes now in buffer.
+uint32_t readFrameBytes(HTTPClient& http, uint8_t* buffer, uint32_t offset, uint32_t total) {
+  WiFiClient* stream = http.getStreamPtr();
+  uint32_t bytesRead = offset;
+  uint32_t lastProgress = offset;
+  unsigned long downloadStart = millis();
+  
+  while (http.connected() && bytesRead < total) {
+    if (millis() - downloadStart > 120000) {
+      Serial.println("Download timeout!");
+      break;
+    }
+    
+    size_t available = stream->available();
+    if (available) {
+      size_t toRead = min(available, (size_t)(total - bytesRead));
+      size_t actualRead = stream->readBytes(buffer + bytesRead, toRead);
+      
+      if (actualRead > 0) {
+        bytesRead += actualRead;
+        
+        if (bytesRead - lastProgress >= 50000 || bytesRead == total) {
+          Serial.printf("Downloaded: %u / %u bytes (%.1f%%)\n", 
+                        bytesRead, total, (bytesRead * 100.0) / total);
+          lastProgress = bytesRead;
+        }
+      }
+    } else {
+      delay(10);
+    }
+    yield();
+  }
+  
+  return bytesRead;
+}
+
+bool downloadAndDrawDiff(const char* frameHash) {
+  HTTPClient http;
+  http.setTimeout(30000);
+  http.begin(String(SERVER_URL) + "/calendar.diff?rects=1&from=" + lastFrameHash);
+  
+  Serial.printf("Requesting frame diff from %s...\n", lastFrameHash);
+  int httpCode = http.GET();
+  int fileSize = http.getSize();
+  
+  if (httpCode != 200 || fileSize <= 0 || fileSize > MAX_IMAGE_SIZE) {
+    Serial.printf("Diff request failed: %d (%d bytes)\n", httpCode, fileSize);
+    http.end();
+    return false;
+  }
+  
+  uint8_t* buffer = (uint8_t*)ps_malloc(fileSize);
+  if (!buffer) {
+    Serial.println("Failed to allocate diff buffer");
+    http.end();
+    return false;
+  }
+  
+  WiFiClient* stream = http.getStreamPtr();
+  size_t bytesRead = 0;
+  unsigned long downloadStart = millis();
+  while (http.connected() && bytesRead < fileSize && millis() - downloadStart < 30000) {
+    size_t available = stream->available();
+    if (available) {
+      bytesRead += stream->readBytes(buffer + bytesRead, min(available, (size_t)(fileSize - bytesRead)));
+    } else {
+      delay(10);
+    }
+    yield();
+  }
+  http.end();
+  
+  Serial.printf("Downloaded diff: %u / %d bytes\n", bytesRead, fileSize);
+  bool displayed = bytesRead == fileSize && drawFrameDiff(buffer, bytesRead);
+  free(buffer);
+  return displayed;
+}
+
+bool drawFrameDiff(uint8_t* buffer, size_t size) {
+  // Header: "EPDD", width, height, rectangle count, encoding, reserved
+  if (size < 12 || memcmp(buffer, "EPDD", 4) != 0) {
+    Serial.println("ERROR: Not a frame diff!");
+    return false;
+  }
+  uint16_t width = buffer[4] | (buffer[5] << 8);
+  uint16_t height = buffer[6] | (buffer[7] << 8);
+  uint16_t count = buffer[8] | (buffer[9] << 8);
+  if (width != DISPLAY_WIDTH || height != DISPLAY_HEIGHT || buffer[10] != 1) {
+    Serial.printf("ERROR: Unsupported diff %dx%d, encoding %d\n", width, height, buffer[10]);
+    return false;
+  }
+  
+  // One rectangle, refreshed in one pass (see FRAME_DIFF_MAX_AREA); with
+  // several, the pixels between them are unknown here
+  if (count != 1) {
+    Serial.printf("Diff has %d rectangles, fetching the full frame\n", count);
+    return false;
+  }
+  
+  // Decode every rectangle before touching the display, so a corrupt diff
+  // leaves the screen alone and the full frame is fetched instead
+  const uint8_t* src = buffer + 12;
+  const uint8_t* srcEnd = buffer + size;
+  const size_t planesSize = 2 * ((DISPLAY_WIDTH + 7) / 8) * DISPLAY_HEIGHT;
+  uint8_t* planes = (uint8_t*)ps_malloc(planesSize);
+  if (!planes) {
+    Serial.println("Failed to allocate plane buffer");
+    return false;
+  }
+  
+  struct Rect { uint16_t x, y, w, h; uint8_t* black; uint8_t* red; };
+  Rect rects[1];
+  uint8_t* dst = planes;
+  
+  for (int i = 0; i < count; i++) {
+    if (src + 8 > srcEnd) {
+      free(planes);
+      return false;
+    }
+    Rect& rect = rects[i];
+    rect.x = src[0] | (src[1] << 8);
+    rect.y = src[2] | (src[3] << 8);
+    rect.w = src[4] | (src[5] << 8);
+    rect.h = src[6] | (src[7] << 8);
+    src += 8;
+    if (rect.x % 8 || rect.w % 8 || rect.x + rect.w > DISPLAY_WIDTH || rect.y + rect.h > DISPLAY_HEIGHT) {
+      Serial.printf("ERROR: Bad diff rectangle %d,%d %dx%d\n", rect.x, rect.y, rect.w, rect.h);
+      free(planes);
+      return false;
+    }
+    
+    size_t rowBytes = rect.w / 8;
+    if ((float)rect.w * rect.h > FRAME_DIFF_MAX_AREA * DISPLAY_WIDTH * DISPLAY_HEIGHT) {
+      Serial.printf("Diff covers %dx%d, fetching the full frame\n", rect.w, rect.h);
+      free(planes);
+      return false;
+    }
+    // Both planes of this rectangle must fit behind the ones decoded so far
+    if (2 * rowBytes * rect.h > planesSize - (dst - planes)) {
+      Serial.printf("ERROR: Diff rectangles exceed the frame in rectangle %d\n", i);
+      free(planes);
+      return false;
+    }
+    rect.black = dst;
+    rect.red = dst + rowBytes * rect.h;
+    for (int row = 0; row < 2 * rect.h; row++) {
+      if (!unpackBitsRow(src, srcEnd, dst, rowBytes)) {
+        Serial.printf("ERROR: Corrupt frame diff in rectangle %d\n", i);
+        free(planes);
+        return false;
+      }
+      dst += rowBytes;
+    }
+  }
+  
+  Rect& rect = rects[0];
+  Serial.printf("Drawing changed rectangle %d,%d %dx%d...\n", rect.x, rect.y, rect.w, rect.h);
+  display.init(115200, false, 2);
+  display.setPartialWindow(rect.x, rect.y, rect.w, rect.h);
+  display.firstPage();
+  do {
+    display.fillScreen(GxEPD_WHITE);
+    display.drawBitmap(rect.x, rect.y, rect.black, rect.w, rect.h, GxEPD_BLACK);
+    display.drawBitmap(rect.x, rect.y, rect.red, rect.w, rect.h, GxEPD_RED);
+  } while (display.nextPage());
+  
+  free(planes);
+  Serial.println("Partial refresh complete!");
+  return true;
+}
+
+bool unpackBitsRow(const uint8_t*& src, const uint8_t* srcEnd, uint8_t* dst, size_t rowBytes) {
+  size_t written = 0;
+  while (written < rowBytes) {
+    if (src >= srcEnd) return false;
+    int8_t control = (int8_t)*src++;
+    
+    if (control >= 0) {
+      // Copy the next control + 1 bytes
+      size_t count = control + 1;
+      if (written + count > rowBytes || src + count > srcEnd) return false;
+      memcpy(dst + written, src, count);
+      src += count;
+      written += count;
+    } else if (control != -128) {
+      // Repeat the next byte 1 - control times
+      size_t count = 1 - control;
+      if (written + count > rowBytes || src >= srcEnd) return false;
+      memset(dst + written, *src++, count);
+      written += count;
+    }
+  }
+  return true;
+}
+
 void showError(const char* message) {
   Serial.printf("Displaying error: %s\n", message);
   
@@ -564,6 +899,11 @@ void goToSleep() {
 }
 
 uint64_t getNextWakeupInterval() {
+  // Prefer the server's hint: it knows when the next render and events are
+  if (serverSleepSeconds > 0) {
+    return max((uint64_t)serverSleepSeconds, (uint64_t)60);
+  }
+  
   time_t now = time(nullptr);
   
   // If time not synced, use backup interval
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Offline render benchmark
+
+Runs generate_illustrated_calendar() with every external service replaced:
+Open-Meteo, OpenRouter and ImageRouter by a local stand-in HTTP server, and
+Google Calendar by an injected fake client (the real one needs Google's
+OAuth token endpoint). Each stand-in has a configurable latency and list of
+failing models, so fallback chains can be measured too.
+
+Every scenario runs in its own temporary directory, so its first run is
+cold (no image cache, fact pool, weather cache or event store) and later
+runs are warm. Per run the end-to-end time and the time of every render
+stage are recorded. One extra run measures the peak memory with tracemalloc,
+which sees Python and NumPy allocations but not Pillow's image buffers, so
+the process's maximum RSS is recorded as well. Results are written as JSON
+and can be compared with an earlier results file:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+"""
+import os
+import io
+import re
+import sys
+import json
+import time
+import shutil
+import random
+import resource
+import argparse
+import datetime
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from PIL import Image, ImageDraw
+
+import main
+import calendar_api
+import weather_handler
+import llm_handler
+import image_generator
+import image_cache
+import static_layer
+import fact_pool
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+
+LLM_MODELS = [
+    "google/gemma-3-27b-it:free",
+    "meta-llama/llama-3.2-3b-instruct:free",
+    "microsoft/phi-3-mini-128k-instruct:free"
+]
+IMAGE_MODELS = [
+    "google/gemini-2.0-flash-exp",
+    "HiDream-ai/HiDream-I1-Dev"
+]
+
+# Latencies in seconds and failing models; each scenario overrides some of them
+DEFAULT_SCENARIO = {
+    'calendars': 1,
+    'events_per_day': 2,
+    'title_words': 4,
+    'fact_words': 25,
+    'calendar_latency': 0.05,
+    'weather_latency': 0.05,
+    'llm_latency': 0.2,
+    'image_latency': 0.3,
+    'failing_llm_models': [],
+    'failing_image_models': [],
+    # Panel size and days shown
+    'width': 800,
+    'height': 480,
+    'days': main.DAYS_TO_SHOW,
+}
+
+SCENARIOS = {
+    'calendars_1': {},
+    'calendars_10': {'calendars': 10},
+    'calendars_50': {'calendars': 50},
+    'long_titles': {'calendars': 3, 'title_words': 40, 'fact_words': 300},
+    'llm_fallback': {'failing_llm_models': LLM_MODELS[:2]},
+    'llm_all_fail': {'failing_llm_models': LLM_MODELS},
+    'image_fallback': {'failing_image_models': IMAGE_MODELS[:1]},
+    'image_all_fail': {'failing_image_models': IMAGE_MODELS},
+    # Smallest panel height the layout serves, with narrow columns
+    'small_panel': {'width': 400, 'height': main.MIN_PANEL_HEIGHT, 'days': 2},
+    'slow_services': {
+        'calendar_latency': 0.5, 'weather_latency': 0.5, 'llm_latency': 1.0, 'image_latency': 1.5
+    },
+}
+
+WORDS = [
+    "fodbold", "træning", "tandlæge", "forældremøde", "svømning", "fødselsdag",
+    "bibliotek", "Ærøskøbing", "madpakke", "legeaftale", "skolefoto", "gymnastik"
+]
+
+class StandInServer:
+    """Local HTTP server answering like Open-Meteo, OpenRouter and ImageRouter"""
+
+    def __init__(self):
+        self.config = dict(DEFAULT_SCENARIO)
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._image = self._make_image()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    @staticmethod
+    def _make_image():
+        image = Image.new('RGB', (512, 512), 'white')
+        draw = ImageDraw.Draw(image)
+        draw.ellipse((96, 96, 416, 416), outline='black', width=12)
+        draw.ellipse((200, 220, 312, 300), fill='red')
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def _fact(self):
+        words = [random.choice(WORDS) for _ in range(self.config['fact_words'])]
+        return ' '.join(words).capitalize() + '.'
+
+    def fact_answer(self, prompt):
+        """A single fact, or the JSON batch the fact pool asks for"""
+        if '"generic"' not in prompt:
+            return self._fact()
+        dates = re.findall(r'^- (\d{4}-\d{2}-\d{2}):', prompt, re.MULTILINE)
+        generic = re.search(r'Skriv derudover (\d+) generelle', prompt)
+        return json.dumps({
+            'days': [{'date': date, 'fact': self._fact()} for date in dates],
+            'generic': [self._fact() for _ in range(int(generic.group(1)) if generic else 0)],
+        }, ensure_ascii=False)
+
+    def count(self, name):
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type='application/json'):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json_body(self):
+                length = int(self.headers.get('Content-Length', 0))
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/weather':
+                    server.count('weather')
+                    time.sleep(server.config['weather_latency'])
+                    days = int(parse_qs(url.query).get('forecast_days', ['4'])[0])
+                    today = datetime.date.today()
+                    self._send(200, {'daily': {
+                        'time': [(today + datetime.timedelta(days=i)).isoformat() for i in range(days)],
+                        'weathercode': [[0, 2, 3, 61, 71, 95, 80][i % 7] for i in range(days)],
+                        'temperature_2m_min': [2.4 + i for i in range(days)],
+                        'temperature_2m_max': [11.6 + i for i in range(days)],
+                    }})
+                elif url.path == '/image.png':
+                    server.count('image_download')
+                    self._send(200, server._image, 'image/png')
+                else:
+                    self._send(404, {'error': 'not found'})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                body = self._json_body()
+                model = body.get('model')
+                if url.path == '/llm':
+                    server.count('llm')
+                    time.sleep(server.config['llm_latency'])
+                    if model in server.config['failing_llm_models']:
+                        self._send(503, {'error': f'{model} unavailable'})
+                        return
+                    prompt = ' '.join(message.get('content', '') for message in body.get('messages', []))
+                    self._send(200, {'choices': [{'message': {'content': server.fact_answer(prompt)}}]})
+                elif url.path == '/images':
+                    server.count('image')
+                    time.sleep(server.config['image_latency'])
+                    if model in server.config['failing_image_models']:
+                        self._send(503, {'error': f'{model} unavailable'})
+                        return
+                    self._send(200, {'data': [{'url': f"{server.url}/image.png"}]})
+                else:
+                    self._send(404, {'error': 'not found'})
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+class FakeCredentials:
+    token = "benchmark"
+    expiry = None
+
+class FakeCalendarService:
+    """Stands in for the Google Calendar client: events().list(...).execute()"""
+
+    def __init__(self, config):
+        self.config = config
+
+    def events(self):
+        return self
+
+    def list(self, **params):
+        return FakeRequest(self.config, params)
+
+class FakeRequest:
+    def __init__(self, config, params):
+        self.config = config
+        self.params = params
+
+    def execute(self, http=None):
+        time.sleep(self.config['calendar_latency'])
+        if self.params.get('syncToken'):
+            # Nothing changed since the last sync
+            return {'items': [], 'nextSyncToken': self.params['syncToken']}
+
+        calendar_id = self.params['calendarId']
+        rng = random.Random(calendar_id)
+        today = datetime.date.today()
+        items = []
+        for day in range(4):
+            for n in range(self.config['events_per_day']):
+                start = datetime.datetime.combine(
+                    today + datetime.timedelta(days=day), datetime.time(8 + 2 * n, 30)
+                )
+                items.append({
+                    'id': f"{calendar_id}-{day}-{n}",
+                    'status': 'confirmed',
+                    'summary': ' '.join(rng.choice(WORDS) for _ in range(self.config['title_words'])),
+                    'start': {'dateTime': start.isoformat() + 'Z'},
+                    'end': {'dateTime': (start + datetime.timedelta(hours=1)).isoformat() + 'Z'},
+                })
+        return {'items': items, 'nextSyncToken': f"{calendar_id}-token"}
+
+def install_fakes(server, config):
+    """Point every module at the stand-ins"""
+    weather_handler.WEATHER_API_URL = f"{server.url}/weather"
+    llm_handler.OPENROUTER_API_URL = f"{server.url}/llm"
+    image_generator.IMAGEROUTER_API_URL = f"{server.url}/images"
+    os.environ['OPENROUTER_API_KEY'] = 'benchmark'
+    os.environ['IMAGEROUTER_API_KEY'] = 'benchmark'
+
+    service = FakeCalendarService(config)
+    calendar_api.get_calendar_client = lambda credentials_path: (service, FakeCredentials())
+    calendar_api._authorized_http = lambda credentials: None
+
+    for key in [key for key in os.environ if key.startswith('CALENDAR_') and key.endswith(('_ID', '_NAME', '_SYMBOL'))]:
+        del os.environ[key]
+    for i in range(1, config['calendars'] + 1):
+        os.environ[f'CALENDAR_{i}_ID'] = f"calendar-{i}@benchmark"
+        os.environ[f'CALENDAR_{i}_NAME'] = f"Calendar {i}"
+        os.environ[f'CALENDAR_{i}_SYMBOL'] = "●■▲◆"[i % 4]
+    os.environ.pop('EMAIL', None)
+
+def reset_process_caches():
+    """Forget in-memory state that belongs to the previous working directory"""
+    image_cache._image_cache = None
+    static_layer._static_layers = None
+    weather_handler._cache = None
+
+def wait_for_background_work(timeout=30):
+    """Let the fact pool top-up finish before the working directory changes"""
+    deadline = time.monotonic() + timeout
+    while fact_pool._top_up_running and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+def render_once(config, trace_memory=False, verbose=False):
+    """One render at the scenario's panel size; returns its measurements"""
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        context = main.generate_illustrated_calendar('output/illustrated_calendar.png', config['width'],
+                                                     config['height'], config['days'])
+    seconds = time.perf_counter() - started
+    with Image.open(os.path.join('output', 'illustrated_calendar.bmp')) as frame:
+        if frame.size != (config['width'], config['height']):
+            raise RuntimeError(f"Rendered a {frame.size} frame, expected {config['width']}x{config['height']}")
+
+    result = {'seconds': round(seconds, 4), 'stages': dict(context.stage_timings)}
+    if trace_memory:
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # ru_maxrss is in kilobytes on Linux
+        result['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    wait_for_background_work()
+    return result
+
+def output_sizes():
+    sizes = {}
+    for name in ('illustrated_calendar.bmp', 'illustrated_calendar.epd', 'illustrated_calendar.rle'):
+        path = os.path.join('output', name)
+        if os.path.exists(path):
+            sizes[name] = os.path.getsize(path)
+    return sizes
+
+def run_scenario(server, name, overrides, runs, verbose=False):
+    config = dict(DEFAULT_SCENARIO, **overrides)
+    server.config = config
+    server.requests = {}
+    install_fakes(server, config)
+    reset_process_caches()
+    main.check_layout(config['width'], config['height'], config['days'])
+
+    original_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix=f"benchmark-{name}-")
+    try:
+        os.chdir(work_dir)
+        os.symlink(ASSETS_DIR, 'assets')
+        os.environ['GOOGLE_CREDENTIALS_PATH'] = os.path.join(work_dir, 'credentials.json')
+        with open(os.environ['GOOGLE_CREDENTIALS_PATH'], 'w') as f:
+            f.write('{}')
+
+        measured = []
+        for _ in range(max(1, runs)):
+            llm_before = server.requests.get('llm', 0)
+            run = render_once(config, verbose=verbose)
+            # Including the fact pool top-up it started in the background
+            run['llm_requests'] = server.requests.get('llm', 0) - llm_before
+            measured.append(run)
+        memory = render_once(config, trace_memory=True, verbose=verbose)
+
+        warm = measured[1:] or measured
+        stages = sorted({stage for run in warm for stage in run['stages']})
+        return {
+            'config': config,
+            'cold': measured[0],
+            'warm': {
+                'runs': len(warm),
+                'median_seconds': round(statistics.median(run['seconds'] for run in warm), 4),
+                # Zero: renders never ask the LLM, and failed pool top-ups back off
+                'llm_requests': sum(run['llm_requests'] for run in warm),
+                'stages': {
+                    stage: round(statistics.median(run['stages'].get(stage, 0) for run in warm), 4)
+                    for stage in stages
+                },
+            },
+            'peak_memory_bytes': memory['peak_memory_bytes'],
+            'max_rss_bytes': memory['max_rss_bytes'],
+            'output_bytes': output_sizes(),
+            'requests': dict(server.requests),
+        }
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+def print_summary(results, baseline=None):
+    print(f"{'scenario':<16} {'cold s':>8} {'warm s':>8} {'warm llm':>8} {'peak MB':>8} {'rle KB':>7}  change")
+    for name, result in results['scenarios'].items():
+        change = ""
+        if baseline and name in baseline.get('scenarios', {}):
+            before = baseline['scenarios'][name]['warm']['median_seconds']
+            after = result['warm']['median_seconds']
+            if before:
+                change = f"{(after - before) / before * 100:+.1f}% warm"
+        print(
+            f"{name:<16} {result['cold']['seconds']:>8.3f} {result['warm']['median_seconds']:>8.3f} "
+            f"{result['warm'].get('llm_requests', 0):>8} "
+            f"{result['peak_memory_bytes'] / 1e6:>8.1f} "
+            f"{result['output_bytes'].get('illustrated_calendar.rle', 0) / 1024:>7.1f}  {change}"
+        )
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark calendar rendering against local stand-ins")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument('--runs', type=int, default=3, help="timed runs per scenario (first is cold)")
+    parser.add_argument('--output', default='benchmark_results.json', help="where to write the JSON results")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    parser.add_argument('--verbose', action='store_true', help="show the render's own output")
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    server = StandInServer().start()
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': args.runs,
+        'scenarios': {},
+    }
+    try:
+        for name in args.scenario or SCENARIOS:
+            print(f"Running scenario {name}...", file=sys.stderr)
+            results['scenarios'][name] = run_scenario(server, name, SCENARIOS[name], args.runs, args.verbose)
+    finally:
+        server.stop()
+
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_summary(results, baseline)
+    print(f"Results written to {output_path}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -2,105 +2,237 @@
 Google Calendar API handling
 """
 import os
+import time
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
+import google_auth_httplib2
 from googleapiclient.discovery import build
 from google.oauth2 import service_account
 from calendar_config import load_calendar_config
+from calendar_sync import EventStore, sync_calendar
 
-def fetch_calendar_events():
-    """Fetches events from multiple Google Calendars for the next 4 days."""
+# Maximum number of calendars fetched at the same time (1 = one after another)
+FETCH_WORKERS = int(os.getenv('CALENDAR_FETCH_WORKERS', '8'))
+# Socket timeout in seconds for each calendar's request
+FETCH_TIMEOUT = float(os.getenv('CALENDAR_FETCH_TIMEOUT', '10'))
+# Keep a local event store in sync instead of listing the full window every time
+INCREMENTAL_SYNC = os.getenv('CALENDAR_INCREMENTAL_SYNC', 'true').lower() == 'true'
+# Refresh the OAuth access token when it expires within this many seconds
+TOKEN_REFRESH_MARGIN = 300
+
+# Process-wide Calendar client, rebuilt only when the credentials file changes
+_client_lock = threading.Lock()
+_client_cache = {}
+
+def get_calendar_client(credentials_path):
+    """Return a cached (service, credentials) pair for the credentials file.
+
+    The service is built from the discovery document bundled with
+    google-api-python-client, so building it needs no network I/O. The access
+    token is only refreshed when it is missing or close to expiry.
+    """
+    stat = os.stat(credentials_path)
+    fingerprint = (os.path.abspath(credentials_path), stat.st_mtime_ns, stat.st_size)
+
+    with _client_lock:
+        if _client_cache.get('fingerprint') != fingerprint:
+            print(f"Loading Google credentials from: {credentials_path}")
+            credentials = service_account.Credentials.from_service_account_file(
+                credentials_path,
+                scopes=['https://www.googleapis.com/auth/calendar.readonly']
+            )
+            service = build(
+                'calendar', 'v3', credentials=credentials,
+                static_discovery=True, cache_discovery=False
+            )
+            _client_cache.clear()
+            _client_cache.update(fingerprint=fingerprint, credentials=credentials, service=service)
+
+        credentials = _client_cache['credentials']
+        _refresh_token_if_needed(credentials)
+        return _client_cache['service'], credentials
+
+def _refresh_token_if_needed(credentials):
+    """Refresh the access token once, up front, instead of in every fetch thread"""
+    expiry = getattr(credentials, 'expiry', None)
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    if credentials.token and expiry and expiry - now > datetime.timedelta(seconds=TOKEN_REFRESH_MARGIN):
+        return
+
+    try:
+        credentials.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=FETCH_TIMEOUT)))
+    except Exception as e:
+        # The per-calendar requests will retry and fall back on their own
+        print(f"Error refreshing Google access token: {e}")
+
+def _authorized_http(credentials):
+    """Create a new authorized HTTP connection with the fetch timeout"""
+    # httplib2 connections are not thread safe, so every calendar gets its own
+    # one - which also gives each calendar its own timeout
+    return google_auth_httplib2.AuthorizedHttp(
+        credentials, http=httplib2.Http(timeout=FETCH_TIMEOUT)
+    )
+
+def _list_calendar_events(service, credentials, calendar_id, time_min, time_max):
+    """Fetch the raw event items of one calendar on its own HTTP connection"""
+    http = _authorized_http(credentials)
+    events_result = service.events().list(
+        calendarId=calendar_id,
+        maxResults=20,
+        singleEvents=True,
+        orderBy='startTime',
+        timeMin=time_min,
+        timeMax=time_max,
+        timeZone='Europe/Copenhagen'
+    ).execute(http=http)
+
+    return events_result.get('items', [])
+
+def _fetch_calendar(service, credentials, calendar_id, config, first_date, last_date, store):
+    """Fetch one calendar, returning its items and timing without raising"""
+    print(f"Fetching events from calendar: {config['name']} ({calendar_id})")
+    started = time.monotonic()
+    mode = "incremental" if store else "list"
+    try:
+        if store:
+            mode = sync_calendar(service, _authorized_http(credentials), calendar_id, store, last_date)
+            items = store.events_between(calendar_id, first_date, last_date)
+        else:
+            items = _list_calendar_events(
+                service, credentials, calendar_id,
+                first_date.isoformat() + 'T00:00:00Z',
+                last_date.isoformat() + 'T23:59:59Z'
+            )
+        error = None
+    except Exception as e:
+        print(f"Error fetching events from calendar {calendar_id}: {e}")
+        items = []
+        error = str(e)
+
+        # Keep rendering from the local copy while the API is unreachable
+        if store:
+            try:
+                if store.has_calendar(calendar_id):
+                    items = store.events_between(calendar_id, first_date, last_date)
+                    mode = "stale"
+                    print(f"Using {len(items)} stored events for calendar {calendar_id}")
+            except Exception as store_error:
+                print(f"Error reading stored events for calendar {calendar_id}: {store_error}")
+
+    timing = {
+        'name': config['name'],
+        'seconds': round(time.monotonic() - started, 3),
+        'events': len(items),
+        'mode': mode,
+        'error': error
+    }
+    return items, timing
+
+def _add_events(organized_events, events, calendar_id, config):
+    """Put the raw event items of one calendar into the date buckets"""
+    for event in events:
+        start = event['start'].get('dateTime', event['start'].get('date'))
+
+        # Check if we have a full datetime or just a date
+        if 'T' in start:
+            # It's a datetime - parse it
+            event_date = datetime.datetime.fromisoformat(start.replace('Z', '+00:00')).date()
+            event_time = datetime.datetime.fromisoformat(start.replace('Z', '+00:00')).strftime("%H:%M")
+        else:
+            # It's just a date
+            event_date = datetime.date.fromisoformat(start)
+            event_time = "All day"
+
+        # If the event is within our date range, add it to the organized events
+        if event_date in organized_events:
+            organized_events[event_date].append({
+                'time': event_time,
+                'summary': event['summary'],
+                'description': event.get('description', ''),
+                'calendar_symbol': config['symbol'],
+                'calendar_name': config['name'],
+                'calendar_id': calendar_id
+            })
+
+def fetch_calendar_events_with_timings(days=4):
+    """Fetches events from multiple Google Calendars for the next few days (today included).
+
+    The calendars are fetched concurrently on a bounded thread pool. A failing
+    or slow calendar only loses its own events. With CALENDAR_INCREMENTAL_SYNC
+    each calendar is synced into the local event store and read back from it,
+    so a failing calendar falls back to its last stored events. Returns a
+    tuple of the date-bucketed events and a dict with the timing of each
+    calendar.
+    """
     try:
         # Path to your service account credentials file
         credentials_path = os.getenv('GOOGLE_CREDENTIALS_PATH', 'credentials/kalender.json')
-        
+
         if not os.path.exists(credentials_path):
             print(f"Google credentials file not found at: {credentials_path}")
-            return {}
-        
-        # Create a service account credentials object
-        credentials = service_account.Credentials.from_service_account_file(
-            credentials_path,
-            scopes=['https://www.googleapis.com/auth/calendar.readonly']
-        )
-        
-        # Build the Google Calendar API service
-        service = build('calendar', 'v3', credentials=credentials)
-        
+            return {}, {}
+
+        # Reuse the credentials and the built Google Calendar API service
+        service, credentials = get_calendar_client(credentials_path)
+
         # Load calendar configuration
         calendar_config = load_calendar_config()
-        
+
         if not calendar_config:
             print("No calendars configured")
-            return {}
-        
-        # Set time_min to today's date at 00:00:00
+            return {}, {}
+
+        # Fetch from today's date up to days - 1 days from today
         today = datetime.date.today()
-        time_min = today.isoformat() + 'T00:00:00Z'
-        
-        # Set time_max to the date 3 days from today (4 days total) at 23:59:59
-        future_date = today + datetime.timedelta(days=3)
-        time_max = future_date.isoformat() + 'T23:59:59Z'
-        
+        future_date = today + datetime.timedelta(days=days - 1)
+
+        store = None
+        if INCREMENTAL_SYNC:
+            try:
+                store = EventStore()
+                store.prune(today - datetime.timedelta(days=1))
+            except Exception as e:
+                print(f"Event store unavailable, fetching without it: {e}")
+                store = None
+
         # Organize events by date
         organized_events = {
-            today + datetime.timedelta(days=i): [] for i in range(4)
+            today + datetime.timedelta(days=i): [] for i in range(days)
         }
-        
-        # Fetch events from each configured calendar
-        for calendar_id, config in calendar_config.items():
-            try:
-                print(f"Fetching events from calendar: {config['name']} ({calendar_id})")
-                
-                events_result = service.events().list(
-                    calendarId=calendar_id,
-                    maxResults=20,
-                    singleEvents=True,
-                    orderBy='startTime',
-                    timeMin=time_min,
-                    timeMax=time_max,
-                    timeZone='Europe/Copenhagen'
-                ).execute()
-                
-                events = events_result.get('items', [])
-                
-                for event in events:
-                    start = event['start'].get('dateTime', event['start'].get('date'))
-                    
-                    # Check if we have a full datetime or just a date
-                    if 'T' in start:
-                        # It's a datetime - parse it
-                        event_date = datetime.datetime.fromisoformat(start.replace('Z', '+00:00')).date()
-                        event_time = datetime.datetime.fromisoformat(start.replace('Z', '+00:00')).strftime("%H:%M")
-                    else:
-                        # It's just a date
-                        event_date = datetime.date.fromisoformat(start)
-                        event_time = "All day"
-                    
-                    # If the event is within our date range, add it to the organized events
-                    for date in organized_events.keys():
-                        if event_date == date:
-                            organized_events[date].append({
-                                'time': event_time,
-                                'summary': event['summary'],
-                                'description': event.get('description', ''),
-                                'calendar_symbol': config['symbol'],
-                                'calendar_name': config['name'],
-                                'calendar_id': calendar_id
-                            })
-                            
-            except Exception as e:
-                print(f"Error fetching events from calendar {calendar_id}: {e}")
-                continue
-        
+
+        # Fetch all configured calendars at the same time
+        workers = max(1, min(FETCH_WORKERS, len(calendar_config)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                calendar_id: executor.submit(
+                    _fetch_calendar, service, credentials, calendar_id, config,
+                    today, future_date, store
+                )
+                for calendar_id, config in calendar_config.items()
+            }
+
+            # Merge in configuration order so the result doesn't depend on timing
+            timings = {}
+            for calendar_id, config in calendar_config.items():
+                items, timings[calendar_id] = futures[calendar_id].result()
+                _add_events(organized_events, items, calendar_id, config)
+
         # Sort events by time within each day
         for date in organized_events:
             organized_events[date].sort(key=lambda x: (
                 x['time'] == "All day",  # All day events last
                 x['time'] if x['time'] != "All day" else "23:59"
             ))
-        
-        return organized_events
-        
+
+        return organized_events, timings
+
     except Exception as e:
         print(f"Error fetching calendar events: {e}")
-        return {}
\ No newline at end of file
+        return {}, {}
+
+def fetch_calendar_events():
+    """Fetches events from multiple Google Calendars for the next 4 days."""
+    organized_events, _ = fetch_calendar_events_with_timings()
+    return organized_events
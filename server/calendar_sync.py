@@ -0,0 +1,193 @@
+"""
+Incremental Google Calendar sync with a persistent local event store
+"""
+import os
+import json
+import math
+import sqlite3
+import datetime
+from googleapiclient.errors import HttpError
+
+EVENT_STORE_PATH = os.getenv('CALENDAR_STORE_PATH', 'output/calendar_store.sqlite')
+# Force a full resync this often, even when the sync token is still valid
+FULL_SYNC_HOURS = float(os.getenv('CALENDAR_FULL_SYNC_HOURS', '24'))
+# Days synced past the last shown day, so events that move into view before
+# the next full sync are already stored (incremental syncs only report changes)
+SYNC_MARGIN_DAYS = math.ceil(FULL_SYNC_HOURS / 24) + 1
+
+class EventStore:
+    """SQLite copy of the synced calendars. Every call opens its own
+    connection, so one store can be shared by the fetch threads."""
+
+    def __init__(self, path=EVENT_STORE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    calendar_id TEXT NOT NULL,
+                    event_id TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    start TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (calendar_id, event_id)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS events_by_date ON events (calendar_id, start_date)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    calendar_id TEXT PRIMARY KEY,
+                    sync_token TEXT,
+                    full_sync_at TEXT NOT NULL,
+                    synced_at TEXT NOT NULL,
+                    synced_until TEXT
+                )
+            """)
+            try:
+                # Stores created before the sync window was bounded
+                conn.execute("ALTER TABLE sync_state ADD COLUMN synced_until TEXT")
+            except sqlite3.OperationalError:
+                pass
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_sync_state(self, calendar_id):
+        """Return (sync_token, last full sync datetime, last synced date) or (None, None, None)"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT sync_token, full_sync_at, synced_until FROM sync_state WHERE calendar_id = ?",
+                (calendar_id,)
+            ).fetchone()
+        if not row:
+            return None, None, None
+        synced_until = datetime.date.fromisoformat(row[2]) if row[2] else None
+        return row[0], datetime.datetime.fromisoformat(row[1]), synced_until
+
+    def has_calendar(self, calendar_id):
+        """True if the calendar has been synced at least once"""
+        return self.get_sync_state(calendar_id)[1] is not None
+
+    def replace_calendar(self, calendar_id, items, sync_token, synced_until=None):
+        """Store the result of a full sync of the dates up to synced_until, dropping everything known before"""
+        now = datetime.datetime.now().isoformat()
+        until = synced_until.isoformat() if synced_until else None
+        with self._connect() as conn:
+            conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+            self._upsert(conn, calendar_id, items, until)
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (calendar_id, sync_token, full_sync_at, synced_at, synced_until) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (calendar_id, sync_token, now, now, until)
+            )
+
+    def apply_changes(self, calendar_id, items, sync_token, synced_until=None):
+        """Apply the changed (or cancelled) events of an incremental sync"""
+        now = datetime.datetime.now().isoformat()
+        until = synced_until.isoformat() if synced_until else None
+        with self._connect() as conn:
+            self._upsert(conn, calendar_id, items, until)
+            conn.execute(
+                "UPDATE sync_state SET sync_token = ?, synced_at = ? WHERE calendar_id = ?",
+                (sync_token, now, calendar_id)
+            )
+
+    def _upsert(self, conn, calendar_id, items, until=None):
+        """Store items; cancelled ones and those starting after until are removed"""
+        for item in items:
+            start = None
+            if item.get('status') != 'cancelled' and 'start' in item:
+                start = item['start'].get('dateTime', item['start'].get('date'))
+            if start is None or (until and start[:10] > until):
+                conn.execute(
+                    "DELETE FROM events WHERE calendar_id = ? AND event_id = ?",
+                    (calendar_id, item['id'])
+                )
+                continue
+
+            data = {
+                'start': item['start'],
+                'summary': item.get('summary', ''),
+                'description': item.get('description', '')
+            }
+            conn.execute(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)",
+                (calendar_id, item['id'], start[:10], start, json.dumps(data))
+            )
+
+    def events_between(self, calendar_id, first_date, last_date, limit=20):
+        """Return stored events (in the API's item format) between two dates, inclusive"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT data FROM events WHERE calendar_id = ? AND start_date BETWEEN ? AND ? "
+                "ORDER BY start LIMIT ?",
+                (calendar_id, first_date.isoformat(), last_date.isoformat(), limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def prune(self, before_date):
+        """Forget events that start before the given date"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM events WHERE start_date < ?", (before_date.isoformat(),))
+
+def _list_all_pages(service, http, **params):
+    """Run events().list over all pages, returning (items, nextSyncToken)"""
+    items = []
+    page_token = None
+    while True:
+        result = service.events().list(
+            pageToken=page_token, **params
+        ).execute(http=http)
+        items.extend(result.get('items', []))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return items, result.get('nextSyncToken')
+
+def sync_calendar(service, http, calendar_id, store, last_date):
+    """Bring the stored copy of one calendar up to last_date up to date.
+
+    Uses the stored sync token so only changed events are downloaded. Falls
+    back to a full resync when there is no token, when the token has expired
+    (HTTP 410), when the last full sync is older than FULL_SYNC_HOURS or when
+    it didn't reach last_date. A full sync stores the events from yesterday
+    to SYNC_MARGIN_DAYS after last_date; without that bound, every open-ended
+    recurring event would be expanded into all its future instances.
+    Returns "incremental" or "full".
+    """
+    params = {
+        'calendarId': calendar_id,
+        'singleEvents': True,
+        'maxResults': 250,
+        'timeZone': 'Europe/Copenhagen'
+    }
+
+    sync_token, full_sync_at, synced_until = store.get_sync_state(calendar_id)
+    full_sync_due = (
+        full_sync_at is None or
+        datetime.datetime.now() - full_sync_at > datetime.timedelta(hours=FULL_SYNC_HOURS) or
+        synced_until is None or synced_until < last_date
+    )
+
+    if sync_token and not full_sync_due:
+        try:
+            items, next_token = _list_all_pages(service, http, syncToken=sync_token, **params)
+            store.apply_changes(calendar_id, items, next_token or sync_token, synced_until)
+            return "incremental"
+        except HttpError as e:
+            if e.status_code != 410:
+                raise
+            print(f"Sync token expired for calendar {calendar_id}, doing a full resync")
+
+    # Full sync: yesterday up to the margin. timeMin/timeMax may not be combined
+    # with syncToken, so later incremental syncs report changes outside this
+    # window too; those past the window are dropped by the store.
+    synced_until = last_date + datetime.timedelta(days=SYNC_MARGIN_DAYS)
+    time_min = (datetime.date.today() - datetime.timedelta(days=1)).isoformat() + 'T00:00:00Z'
+    time_max = synced_until.isoformat() + 'T23:59:59Z'
+    items, next_token = _list_all_pages(service, http, timeMin=time_min, timeMax=time_max, **params)
+    store.replace_calendar(calendar_id, items, next_token, synced_until)
+    return "full"
@@ -0,0 +1,44 @@
+"""
+Fun fact and illustration of the day, reused by re-renders later that day
+"""
+import os
+import json
+import threading
+
+DAILY_CONTENT_PATH = os.getenv('DAILY_CONTENT_PATH', 'output/daily_content.json')
+
+_lock = threading.Lock()
+
+def _load():
+    try:
+        with open(DAILY_CONTENT_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Error reading daily content, starting empty: {e}")
+        return {}
+
+def load_daily_content(today):
+    """What was generated for today (fun_fact, illustration), or an empty dict"""
+    with _lock:
+        content = _load()
+    return content if content.get('date') == today.isoformat() else {}
+
+def save_daily_content(today, **values):
+    """Remember generated content for the rest of the day"""
+    with _lock:
+        content = _load()
+        if content.get('date') != today.isoformat():
+            content = {'date': today.isoformat()}
+        content.update(values)
+        try:
+            directory = os.path.dirname(DAILY_CONTENT_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = DAILY_CONTENT_PATH + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(content, f)
+            os.replace(temp_path, DAILY_CONTENT_PATH)
+        except Exception as e:
+            print(f"Error saving daily content: {e}")
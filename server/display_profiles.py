@@ -0,0 +1,197 @@
+"""
+Display profiles: one frame per panel, each with its own size, calendars and days
+
+Profiles are configured through environment variables:
+
+    DISPLAY_PROFILES=kitchen,hallway
+    PROFILE_KITCHEN_WIDTH=800
+    PROFILE_KITCHEN_HEIGHT=480
+    PROFILE_KITCHEN_CALENDARS=Family,Personal   # calendar names or ids, empty = all
+    PROFILE_KITCHEN_DAYS=4
+
+The "default" profile always exists (configurable the same way) and renders
+to the usual output files. Sizes the layout can't serve (see
+main.check_layout) are rejected. Every other profile renders to
+output/profiles/<name>/ and publishes its own frame versions.
+"""
+import os
+import re
+import time
+import datetime
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import main
+from render_pipeline import RenderPipeline
+from frame_store import FRAME_STORE_DIR
+from frame_diff import FRAME_HISTORY_DIR
+from metrics import record_render, snapshot_metrics, metrics_delta, merge_metrics, FAILURES
+
+DEFAULT_PROFILE = "default"
+# Names of the profiles rendered next to the default one
+DISPLAY_PROFILES = os.getenv('DISPLAY_PROFILES', '')
+# Processes rendering profiles in parallel; 0 = one per profile, at most one per CPU
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '0'))
+
+class DisplayProfile:
+    """Panel size, calendar subset and number of days of one display"""
+
+    def __init__(self, name, width=800, height=480, calendars=None, days=main.DAYS_TO_SHOW,
+                 output_dir="output", frames_dir=None, history_dir=None):
+        self.name = name
+        self.width = width
+        self.height = height
+        # Calendar ids or names to show; None shows every calendar
+        self.calendars = calendars
+        self.days = days
+        self.output_dir = output_dir
+        self.frames_dir = frames_dir or os.path.join(output_dir, 'frames')
+        # Earlier frames of this profile, for /calendar.diff
+        self.history_dir = history_dir or os.path.join(output_dir, 'frame_history')
+
+    @property
+    def filename(self):
+        return os.path.join(self.output_dir, 'illustrated_calendar.png')
+
+    @property
+    def bmp_path(self):
+        return os.path.join(self.output_dir, 'illustrated_calendar.bmp')
+
+    def frame_files(self):
+        """Paths of the files written by a render of this profile, by name"""
+        base = os.path.join(self.output_dir, 'illustrated_calendar')
+        return {
+            "bmp": base + '.bmp',
+            "packed": base + '.epd',
+            "compressed": base + '.rle',
+            "indexed": base + '_indexed.bmp',
+        }
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "width": self.width,
+            "height": self.height,
+            "calendars": self.calendars,
+            "days": self.days,
+        }
+
+def _profile_from_env(name, output_dir, frames_dir=None, history_dir=None):
+    prefix = f"PROFILE_{name.upper().replace('-', '_')}_"
+    calendars = [c.strip() for c in os.getenv(prefix + 'CALENDARS', '').split(',') if c.strip()]
+    width = int(os.getenv(prefix + 'WIDTH', '800'))
+    height = int(os.getenv(prefix + 'HEIGHT', '480'))
+    days = max(1, int(os.getenv(prefix + 'DAYS', str(main.DAYS_TO_SHOW))))
+    main.check_layout(width, height, days)
+    return DisplayProfile(
+        name,
+        width=width,
+        height=height,
+        calendars=calendars or None,
+        days=days,
+        output_dir=output_dir,
+        frames_dir=frames_dir,
+        history_dir=history_dir,
+    )
+
+def load_display_profiles():
+    """All configured profiles by name, the default profile first"""
+    profiles = {DEFAULT_PROFILE: _profile_from_env(DEFAULT_PROFILE, "output", FRAME_STORE_DIR, FRAME_HISTORY_DIR)}
+    for name in DISPLAY_PROFILES.split(','):
+        name = name.strip().lower()
+        if not name or name in profiles:
+            continue
+        # Names end up in URLs and paths
+        if not re.fullmatch(r'[a-z0-9_-]+', name):
+            print(f"Ignoring display profile with invalid name: {name}")
+            continue
+        try:
+            profiles[name] = _profile_from_env(name, os.path.join("output", "profiles", name))
+        except ValueError as e:
+            print(f"Ignoring display profile {name}: {e}")
+    return profiles
+
+def _render_profile(results, today, profile):
+    """Worker process: draw one profile's frame from the already fetched data.
+
+    Returns the stage timings and the metrics recorded while drawing (cache
+    lookups, fallbacks, ...), which the server process merges into its own.
+    """
+    before = snapshot_metrics()
+    pipeline = RenderPipeline.from_results(results)
+    main.draw_calendar(pipeline, today, profile.filename, profile.width, profile.height,
+                       profile.days, profile.calendars)
+    return pipeline.timings, metrics_delta(before)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool(profile_count):
+    """The render worker pool, started on first use and kept for later renders"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = RENDER_WORKERS or min(profile_count, os.cpu_count() or 1)
+            # Spawned workers don't inherit the server's threads and locks
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def render_profiles(profiles, reuse_daily_content=False):
+    """Render a frame for every profile and return the names of those that succeeded.
+
+    The calendar events, weather, fun fact and illustration are fetched once
+    (for the most days any profile shows) and shared by all profiles. With a
+    single profile it is drawn in this process while the data is fetched;
+    several profiles are drawn in parallel on the worker pool. Raises if no
+    profile could be rendered. reuse_daily_content is passed on to
+    main.start_render_pipeline.
+    """
+    if len(profiles) == 1:
+        profile = profiles[0]
+        main.generate_illustrated_calendar(profile.filename, profile.width, profile.height,
+                                           profile.days, profile.calendars, reuse_daily_content)
+        return [profile.name]
+
+    render_started = time.monotonic()
+    today = datetime.date.today()
+    pipeline = main.start_render_pipeline(today, max(profile.days for profile in profiles), reuse_daily_content)
+    try:
+        results = pipeline.results()
+    finally:
+        pipeline.shutdown()
+    timings = dict(pipeline.timings)
+
+    pool = _get_pool(len(profiles))
+    futures = {profile.name: pool.submit(_render_profile, results, today, profile) for profile in profiles}
+
+    rendered = []
+    errors = []
+    for name, future in futures.items():
+        try:
+            profile_timings, metrics = future.result()
+            merge_metrics(metrics)
+            timings[f"draw_{name}"] = round(sum(profile_timings.values()), 3)
+            rendered.append(name)
+        except BrokenProcessPool as e:
+            errors.append(f"{name}: {e}")
+            _reset_pool()
+        except Exception as e:
+            print(f"Error rendering display profile {name}: {e}")
+            FAILURES.inc(stage="render")
+            errors.append(f"{name}: {e}")
+
+    context = results["calendar"]
+    context.stage_timings = timings
+    print(f"Render stage timings: {timings}")
+    record_render(context, time.monotonic() - render_started, outcome="success" if not errors else "partial")
+    if not rendered:
+        raise RuntimeError(f"No display profile rendered: {'; '.join(errors)}")
+    return rendered
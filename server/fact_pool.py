@@ -0,0 +1,252 @@
+"""
+Pool of pre-generated fun facts, filled in batches so renders need no LLM call
+"""
+import os
+import json
+import time
+import random
+import threading
+from llm_handler import request_completion, clean_markdown_text, GENERAL_TOPICS
+from metrics import CACHE_LOOKUPS
+
+FACT_POOL_PATH = os.getenv('FACT_POOL_PATH', 'output/fact_pool.json')
+# Generic facts requested per batch, and the level that triggers a top-up
+FACT_POOL_GENERIC_BATCH = int(os.getenv('FACT_POOL_GENERIC_BATCH', '7'))
+FACT_POOL_MIN_GENERIC = int(os.getenv('FACT_POOL_MIN_GENERIC', '3'))
+# Wait after a failed top-up (or a day the LLM left out), doubled per failure
+FACT_POOL_RETRY_MINUTES = float(os.getenv('FACT_POOL_RETRY_MINUTES', '30'))
+FACT_POOL_MAX_RETRY_HOURS = 24
+
+_lock = threading.Lock()
+_top_up_running = False
+
+def _load_pool():
+    """Read the pool from disk. Caller holds _lock."""
+    try:
+        with open(FACT_POOL_PATH) as f:
+            pool = json.load(f)
+    except FileNotFoundError:
+        pool = {}
+    except Exception as e:
+        print(f"Error reading fact pool, starting empty: {e}")
+        pool = {}
+    # dated: date -> {"event": summary, "fact": text} for days with events
+    # generic: unused facts for days without events
+    # served_generic: date -> generic fact already shown that day
+    # failed_days: date -> {"event", "count", "at"} for days a top-up left out
+    # top_up_failure: {"count", "at"} while top-up requests keep failing
+    pool.setdefault('dated', {})
+    pool.setdefault('generic', [])
+    pool.setdefault('served_generic', {})
+    pool.setdefault('failed_days', {})
+    pool.setdefault('top_up_failure', None)
+    return pool
+
+def _save_pool(pool):
+    """Write the pool atomically. Caller holds _lock."""
+    directory = os.path.dirname(FACT_POOL_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = FACT_POOL_PATH + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(pool, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, FACT_POOL_PATH)
+
+def _prune(pool, today):
+    """Forget facts for days that are over. Returns whether anything was removed. Caller holds _lock."""
+    today_iso = today.isoformat()
+    pruned = False
+    for key in ('dated', 'served_generic', 'failed_days'):
+        kept = {date: value for date, value in pool[key].items() if date >= today_iso}
+        pruned = pruned or len(kept) != len(pool[key])
+        pool[key] = kept
+    return pruned
+
+def _record_failure(failure):
+    """The failure entry after one more failed attempt"""
+    return {'count': (failure or {}).get('count', 0) + 1, 'at': time.time()}
+
+def _backing_off(failure):
+    """Whether the retry wait after a recorded failure is still running"""
+    if not failure:
+        return False
+    wait = FACT_POOL_RETRY_MINUTES * 60 * 2 ** (failure['count'] - 1)
+    return time.time() < failure['at'] + min(wait, FACT_POOL_MAX_RETRY_HOURS * 3600)
+
+def _first_events(context):
+    """Map each upcoming date with events to the summary of its first event"""
+    return {
+        date.isoformat(): events[0]['summary']
+        for date, events in sorted(context.calendar_events.items())
+        if events and date >= context.today
+    }
+
+def _missing_days(pool, context):
+    """Upcoming dates whose pooled fact is missing or for another event.
+
+    Days a top-up recently left out for the same event are skipped until
+    their retry wait is over.
+    """
+    missing = {}
+    for date, summary in _first_events(context).items():
+        if pool['dated'].get(date, {}).get('event') == summary:
+            continue
+        failed = pool['failed_days'].get(date)
+        if failed and failed.get('event') == summary and _backing_off(failed):
+            continue
+        missing[date] = summary
+    return missing
+
+def _needs_top_up(pool, context):
+    """Whether a top-up is due. Caller holds _lock."""
+    if _backing_off(pool['top_up_failure']):
+        return False
+    return bool(_missing_days(pool, context)) or len(pool['generic']) < FACT_POOL_MIN_GENERIC
+
+def take_fact(context):
+    """Return today's fun fact from the pool, or None if the pool has none.
+
+    Facts for days with events are matched on the first event's summary.
+    Days without events, or whose fact isn't generated yet, get a generic
+    fact, which is kept for the rest of the day. Starts a background top-up
+    when the pool runs low.
+    """
+    today = context.today.isoformat()
+    todays_events = context.todays_events
+
+    with _lock:
+        pool = _load_pool()
+        changed = _prune(pool, context.today)
+
+        fact = None
+        if todays_events:
+            entry = pool['dated'].get(today)
+            if entry and entry.get('event') == todays_events[0]['summary']:
+                fact = entry['fact']
+        if fact is None:
+            fact = pool['served_generic'].get(today)
+        if fact is None and pool['generic']:
+            fact = pool['generic'].pop(random.randrange(len(pool['generic'])))
+            pool['served_generic'][today] = fact
+            changed = True
+
+        if changed:
+            _save_pool(pool)
+        needs_top_up = _needs_top_up(pool, context)
+
+    CACHE_LOOKUPS.inc(cache="fact_pool", result="hit" if fact else "miss")
+    if needs_top_up:
+        start_top_up(context)
+
+    if fact:
+        print(f"Using pooled fun fact: {fact}")
+    return fact
+
+def _build_batch_prompt(missing_days, generic_count):
+    """One prompt asking for all missing day facts and a batch of generic facts"""
+    day_lines = "\n".join(f"- {date}: '{summary}'" for date, summary in missing_days.items())
+    topics = ", ".join(GENERAL_TOPICS)
+    return (
+        "Du er en fantasifuld historiefortæller for børn. Skriv meget korte, muntre og fantasifulde "
+        "fun facts for børn på maksimalt 1-2 linjer hver. Fakta skal sætte gang i tanker og leg. "
+        "Start direkte med fakta uden indledning som 'Vidste du' eller 'Her er et fun fact'. "
+        "Brug ikke markdown formatting.\n\n"
+        f"Skriv ét fun fact til hver af disse dage, relateret til det sjove eller mærkelige ved opgaven:\n"
+        f"{day_lines if day_lines else '(ingen)'}\n\n"
+        f"Skriv derudover {generic_count} generelle fun facts om emner som: {topics}.\n\n"
+        "Svar kun med JSON i dette format: "
+        '{"days": [{"date": "YYYY-MM-DD", "fact": "..."}], "generic": ["...", "..."]}'
+    )
+
+def _parse_batch(message):
+    """Parse the JSON answer, tolerating code fences around it"""
+    text = message.strip()
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end == -1:
+        raise ValueError("No JSON object in LLM answer")
+    return json.loads(text[start:end + 1])
+
+def _top_up_failed(reason):
+    """Remember a failed top-up so the next one waits"""
+    print(f"Fact pool top-up failed: {reason}")
+    with _lock:
+        pool = _load_pool()
+        pool['top_up_failure'] = _record_failure(pool['top_up_failure'])
+        _save_pool(pool)
+    return False
+
+def top_up(context):
+    """Fill the pool with one LLM request. Returns True if facts were added.
+
+    A failed request, or an answer without any usable fact, makes the next
+    top-up wait (FACT_POOL_RETRY_MINUTES, doubled per failure). Days the
+    answer leaves out wait the same way on their own.
+    """
+    with _lock:
+        pool = _load_pool()
+        if _backing_off(pool['top_up_failure']):
+            return False
+        missing_days = _missing_days(pool, context)
+        generic_count = max(0, FACT_POOL_GENERIC_BATCH - len(pool['generic']))
+
+    if not missing_days and not generic_count:
+        return False
+
+    print(f"Topping up fact pool: {len(missing_days)} days, {generic_count} generic facts")
+    message = request_completion(_build_batch_prompt(missing_days, generic_count), timeout=60)
+    if message is None:
+        return _top_up_failed("no answer from the LLM")
+
+    try:
+        batch = _parse_batch(message)
+        days = {item.get('date'): item.get('fact') for item in batch.get('days', []) if isinstance(item, dict)}
+        generic = [clean_markdown_text(fact) for fact in batch.get('generic', []) if isinstance(fact, str) and fact]
+    except Exception as e:
+        return _top_up_failed(f"could not parse fact batch: {e}")
+
+    added = [date for date in missing_days if isinstance(days.get(date), str) and days[date]]
+    if not added and not generic:
+        return _top_up_failed("no usable facts in the answer")
+
+    with _lock:
+        pool = _load_pool()
+        pool['top_up_failure'] = None
+        for date, summary in missing_days.items():
+            if date in added:
+                pool['dated'][date] = {'event': summary, 'fact': clean_markdown_text(days[date])}
+                pool['failed_days'].pop(date, None)
+            else:
+                failed = pool['failed_days'].get(date)
+                if not failed or failed.get('event') != summary:
+                    failed = None
+                pool['failed_days'][date] = dict(_record_failure(failed), event=summary)
+        pool['generic'].extend(generic)
+        _prune(pool, context.today)
+        _save_pool(pool)
+    return True
+
+def start_top_up(context):
+    """Top up the pool in a background thread unless a top-up is already running"""
+    global _top_up_running
+    with _lock:
+        if _top_up_running:
+            return
+        _top_up_running = True
+
+    def run():
+        global _top_up_running
+        try:
+            top_up(context)
+        except Exception as e:
+            print(f"Error topping up fact pool: {e}")
+        finally:
+            with _lock:
+                _top_up_running = False
+
+    threading.Thread(target=run, daemon=True).start()
+
+def pool_status():
+    """Return how many facts the pool holds"""
+    with _lock:
+        pool = _load_pool()
+    return {'dated': len(pool['dated']), 'generic': len(pool['generic'])}
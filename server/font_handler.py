@@ -2,10 +2,74 @@
 Font handling and Unicode support
 """
 import os
+import json
 import platform
+import threading
+from functools import lru_cache
 from PIL import ImageFont
 
+# Discovered font paths, persisted so restarts skip the path probing and fc-match
+FONT_CACHE_PATH = os.getenv('FONT_CACHE_PATH', 'output/font_cache.json')
+
+_discovery_lock = threading.Lock()
+_discovered_fonts = None
+
 def get_unicode_font():
+    """Get Unicode fonts, discovering them at most once per process.
+    
+    The result is also kept in FONT_CACHE_PATH together with the mtime of each
+    font file and the FONT_REGULAR/FONT_BOLD settings, and reused by later
+    processes while all of those are unchanged.
+    """
+    global _discovered_fonts
+    with _discovery_lock:
+        if _discovered_fonts is None:
+            env = [os.getenv('FONT_REGULAR'), os.getenv('FONT_BOLD')]
+            _discovered_fonts = _load_font_cache(env)
+            if _discovered_fonts is None:
+                _discovered_fonts = _discover_fonts()
+                _save_font_cache(env, _discovered_fonts)
+        return dict(_discovered_fonts)
+
+def _font_mtimes(found_fonts):
+    return {path: os.stat(path).st_mtime_ns for path in found_fonts.values()}
+
+def _load_font_cache(env):
+    """Cached discovery result, or None if missing or out of date"""
+    try:
+        with open(FONT_CACHE_PATH) as f:
+            cache = json.load(f)
+        if cache['env'] != env or _font_mtimes(cache['fonts']) != cache['mtimes']:
+            return None
+        print(f"Using cached font discovery: {cache['fonts']}")
+        return cache['fonts']
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ignoring font cache: {e}")
+        return None
+
+def _save_font_cache(env, found_fonts):
+    # Finding nothing is not cached, so newly installed fonts are picked up
+    if not found_fonts:
+        return
+    try:
+        directory = os.path.dirname(FONT_CACHE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = FONT_CACHE_PATH + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({'env': env, 'fonts': found_fonts, 'mtimes': _font_mtimes(found_fonts)}, f, indent=2)
+        os.replace(temp_path, FONT_CACHE_PATH)
+    except Exception as e:
+        print(f"Error saving font cache: {e}")
+
+@lru_cache(maxsize=64)
+def get_font(path, size):
+    """Load a TrueType font once per (path, size) and reuse it"""
+    return ImageFont.truetype(path, size)
+
+def _discover_fonts():
     """Get Unicode fonts optimized for Docker containers"""
     found_fonts = {}
     
@@ -112,18 +176,18 @@ def load_fonts():
             
             if regular_font_path:
                 # Test font loading with a small size first
-                test_font = ImageFont.truetype(regular_font_path, 12)
+                test_font = get_font(regular_font_path, 12)
                 
                 # If successful, load all font sizes
-                fonts['big'] = ImageFont.truetype(regular_font_path, 48)
-                fonts['title'] = ImageFont.truetype(regular_font_path, 36)
-                fonts['month'] = ImageFont.truetype(bold_font_path if bold_font_path else regular_font_path, 24)
-                fonts['day'] = ImageFont.truetype(regular_font_path, 24)
-                fonts['time'] = ImageFont.truetype(regular_font_path, 14)
-                fonts['event'] = ImageFont.truetype(bold_font_path if bold_font_path else regular_font_path, 14)
-                fonts['description'] = ImageFont.truetype(regular_font_path, 10)
-                fonts['speech'] = ImageFont.truetype(regular_font_path, 12)
-                fonts['weather'] = ImageFont.truetype(regular_font_path, 11)
+                fonts['big'] = get_font(regular_font_path, 48)
+                fonts['title'] = get_font(regular_font_path, 36)
+                fonts['month'] = get_font(bold_font_path if bold_font_path else regular_font_path, 24)
+                fonts['day'] = get_font(regular_font_path, 24)
+                fonts['time'] = get_font(regular_font_path, 14)
+                fonts['event'] = get_font(bold_font_path if bold_font_path else regular_font_path, 14)
+                fonts['description'] = get_font(regular_font_path, 10)
+                fonts['speech'] = get_font(regular_font_path, 12)
+                fonts['weather'] = get_font(regular_font_path, 11)
                 
                 fonts_loaded = True
                 print(f"Successfully loaded fonts: regular={regular_font_path}, bold={bold_font_path}")
@@ -150,15 +214,15 @@ def load_fonts():
                 basic_font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
             
             if basic_font_path and os.path.exists(basic_font_path):
-                fonts['big'] = ImageFont.truetype(basic_font_path, 48)
-                fonts['title'] = ImageFont.truetype(basic_font_path, 36)
-                fonts['month'] = ImageFont.truetype(basic_font_path, 24)
-                fonts['day'] = ImageFont.truetype(basic_font_path, 24)
-                fonts['time'] = ImageFont.truetype(basic_font_path, 14)
-                fonts['event'] = ImageFont.truetype(basic_font_path, 14)
-                fonts['description'] = ImageFont.truetype(basic_font_path, 10)
-                fonts['speech'] = ImageFont.truetype(basic_font_path, 12)
-                fonts['weather'] = ImageFont.truetype(basic_font_path, 11)
+                fonts['big'] = get_font(basic_font_path, 48)
+                fonts['title'] = get_font(basic_font_path, 36)
+                fonts['month'] = get_font(basic_font_path, 24)
+                fonts['day'] = get_font(basic_font_path, 24)
+                fonts['time'] = get_font(basic_font_path, 14)
+                fonts['event'] = get_font(basic_font_path, 14)
+                fonts['description'] = get_font(basic_font_path, 10)
+                fonts['speech'] = get_font(basic_font_path, 12)
+                fonts['weather'] = get_font(basic_font_path, 11)
                 
                 fonts_loaded = True
                 print(f"Successfully loaded basic font: {basic_font_path}")
@@ -0,0 +1,245 @@
+"""
+Partial-refresh diffs between published frames
+
+Diff format (.diff), all integers little-endian:
+
+    magic     4 bytes  b"EPDD"
+    width     uint16
+    height    uint16
+    count     uint16   number of rectangles
+    encoding  uint8    always 1 = PackBits per row
+    reserved  uint8
+    then per rectangle:
+        x, y, w, h     uint16 each, x and w multiples of 8
+        black plane rows, then red plane rows of the rectangle
+
+Rectangle planes use the same bit layout and per-row PackBits compression
+as the .rle frame (see frame_encoder), with w / 8 bytes per row. When the
+frame width is not a multiple of 8, a rectangle at the right edge extends
+past it to the next byte boundary; those pixels are white (0 bits).
+"""
+import os
+import re
+import shutil
+import struct
+import threading
+import numpy as np
+from PIL import Image
+from frame_encoder import BLACK, RED, packbits
+
+# Frames of the default display profile; the others keep theirs in their output directory
+FRAME_HISTORY_DIR = os.getenv('FRAME_HISTORY_DIR', 'output/frame_history')
+# Number of published frames per display profile a device can diff against
+FRAME_HISTORY_SIZE = int(os.getenv('FRAME_HISTORY_SIZE', '8'))
+# Changes are detected per tile; tiles are a multiple of 8 px wide so every
+# rectangle starts on a byte boundary of the packed planes
+FRAME_DIFF_TILE = int(os.getenv('FRAME_DIFF_TILE', '16'))
+# More rectangles than this are merged into fewer, larger ones (a request can
+# ask for fewer; panels without a fast partial refresh want a single one)
+FRAME_DIFF_MAX_RECTS = int(os.getenv('FRAME_DIFF_MAX_RECTS', '8'))
+# Changed regions allowed before pairwise merging; with more, changes are
+# detected on coarser tiles, which keeps merging cheap for scattered changes
+FRAME_DIFF_MAX_REGIONS = 32
+
+DIFF_MAGIC = b"EPDD"
+DIFF_HEADER = struct.Struct("<4sHHHBB")
+DIFF_RECT = struct.Struct("<HHHH")
+
+_lock = threading.Lock()
+# (from hash, to hash, max rects) -> encoded diff, for the last few published frames
+_diff_cache = {}
+_DIFF_CACHE_SIZE = 64
+
+def history_path(frame_hash, history_dir=FRAME_HISTORY_DIR):
+    return os.path.join(history_dir, frame_hash + '.bmp')
+
+def remember_frame(frame_hash, indexed_path, history_dir=FRAME_HISTORY_DIR):
+    """Keep the quantized frame so later frames can be diffed against it"""
+    os.makedirs(history_dir, exist_ok=True)
+    target = history_path(frame_hash, history_dir)
+    if not os.path.exists(target):
+        temp_path = target + '.tmp'
+        shutil.copyfile(indexed_path, temp_path)
+        os.replace(temp_path, target)
+    else:
+        # Touch it so it counts as recent again
+        os.utime(target)
+
+    frames = sorted(
+        (entry for entry in os.scandir(history_dir) if entry.name.endswith('.bmp')),
+        key=lambda entry: entry.stat().st_mtime_ns,
+        reverse=True
+    )
+    for entry in frames[FRAME_HISTORY_SIZE:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+def has_frame(frame_hash, history_dir=FRAME_HISTORY_DIR):
+    # Hashes come from request URLs, so never let one become a path
+    return (bool(re.fullmatch(r'[0-9a-f]{32}', frame_hash or ''))
+            and os.path.exists(history_path(frame_hash, history_dir)))
+
+def load_frame(frame_hash, history_dir=FRAME_HISTORY_DIR):
+    """Palette indices of a remembered frame as a (height, width) array"""
+    with Image.open(history_path(frame_hash, history_dir)) as indexed:
+        return np.asarray(indexed, dtype=np.uint8)
+
+def changed_tiles(old, new, tile=FRAME_DIFF_TILE):
+    """Boolean (rows, cols) grid of the tiles in which any pixel differs"""
+    height, width = new.shape
+    changed = old != new
+    rows, cols = -(-height // tile), -(-width // tile)
+    padded = np.zeros((rows * tile, cols * tile), dtype=bool)
+    padded[:height, :width] = changed
+    return padded.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+def _tile_boxes(tiles):
+    """Bounding boxes (top, left, bottom, right) in tiles of each connected region"""
+    seen = np.zeros_like(tiles)
+    rows, cols = tiles.shape
+    boxes = []
+    for start in zip(*np.nonzero(tiles)):
+        if seen[start]:
+            continue
+        seen[start] = True
+        stack = [start]
+        top, left, bottom, right = start[0], start[1], start[0], start[1]
+        while stack:
+            r, c = stack.pop()
+            top, left = min(top, r), min(left, c)
+            bottom, right = max(bottom, r), max(right, c)
+            for nr in range(max(r - 1, 0), min(r + 2, rows)):
+                for nc in range(max(c - 1, 0), min(c + 2, cols)):
+                    if tiles[nr, nc] and not seen[nr, nc]:
+                        seen[nr, nc] = True
+                        stack.append((nr, nc))
+        boxes.append((top, left, bottom + 1, right + 1))
+    return boxes
+
+def _union(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def _area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def _add_box(boxes, box):
+    """Add box to non-overlapping boxes, absorbing every box it (as it grows) overlaps"""
+    i = 0
+    while i < len(boxes):
+        if _overlaps(box, boxes[i]):
+            box = _union(box, boxes.pop(i))
+            i = 0
+        else:
+            i += 1
+    boxes.append(box)
+
+def merge_boxes(boxes, max_boxes=FRAME_DIFF_MAX_RECTS):
+    """Merge overlapping boxes, then the cheapest pairs until max_boxes remain.
+
+    Quadratic per merged pair, so callers keep the number of boxes small
+    (see FRAME_DIFF_MAX_REGIONS).
+    """
+    merged = []
+    for box in boxes:
+        _add_box(merged, box)
+
+    while len(merged) > max(1, max_boxes):
+        # Merge the pair whose union adds the least unchanged area
+        _, i, j = min(
+            (_area(_union(merged[i], merged[j])) - _area(merged[i]) - _area(merged[j]), i, j)
+            for i in range(len(merged)) for j in range(i + 1, len(merged))
+        )
+        box = _union(merged[i], merged[j])
+        merged = [other for k, other in enumerate(merged) if k != i and k != j]
+        _add_box(merged, box)
+    return merged
+
+def changed_rectangles(old, new, tile=FRAME_DIFF_TILE, max_rects=FRAME_DIFF_MAX_RECTS):
+    """Pixel rectangles (x, y, w, h) covering every difference between two frames.
+
+    x and w are multiples of 8; see the module docstring for the right edge.
+    """
+    height, width = new.shape
+    boxes = _tile_boxes(changed_tiles(old, new, tile))
+    while len(boxes) > FRAME_DIFF_MAX_REGIONS:
+        # Too scattered to merge pairwise: look again with tiles twice as large
+        tile *= 2
+        boxes = _tile_boxes(changed_tiles(old, new, tile))
+
+    padded_width = -(-width // 8) * 8
+    rectangles = []
+    for top, left, bottom, right in merge_boxes(boxes, max_rects):
+        x, y = left * tile, top * tile
+        rectangles.append((x, y, min(right * tile, padded_width) - x, min(bottom * tile, height) - y))
+    return sorted(rectangles, key=lambda rect: (rect[1], rect[0]))
+
+def encode_diff(old, new, rectangles=None):
+    """Build the .diff payload with the new pixels of every changed rectangle"""
+    height, width = new.shape
+    if rectangles is None:
+        rectangles = changed_rectangles(old, new)
+
+    parts = [DIFF_HEADER.pack(DIFF_MAGIC, width, height, len(rectangles), 1, 0)]
+    for x, y, w, h in rectangles:
+        parts.append(DIFF_RECT.pack(x, y, w, h))
+        # Past the right edge of the frame packbits pads with 0 bits
+        region = new[y:y + h, x:x + w]
+        for color in (BLACK, RED):
+            plane = np.packbits(region == color, axis=1)
+            parts.extend(packbits(row.tobytes()) for row in plane)
+    return b"".join(parts)
+
+def frame_diff(from_hash, to_hash, max_rects=FRAME_DIFF_MAX_RECTS, history_dir=FRAME_HISTORY_DIR):
+    """Encoded diff from one remembered frame to another, cached in memory"""
+    max_rects = max(1, min(max_rects, FRAME_DIFF_MAX_RECTS))
+    key = (from_hash, to_hash, max_rects)
+    with _lock:
+        if key in _diff_cache:
+            return _diff_cache[key]
+
+    old, new = load_frame(from_hash, history_dir), load_frame(to_hash, history_dir)
+    if old.shape != new.shape:
+        raise ValueError(f"Frame sizes differ: {old.shape} vs {new.shape}")
+    data = encode_diff(old, new, changed_rectangles(old, new, max_rects=max_rects))
+    _cache_diff(key, data)
+    return data
+
+def _cache_diff(key, data):
+    with _lock:
+        if len(_diff_cache) >= _DIFF_CACHE_SIZE:
+            _diff_cache.pop(next(iter(_diff_cache)))
+        _diff_cache[key] = data
+
+def precompute_diffs(to_hash, history_dir=FRAME_HISTORY_DIR):
+    """Encode the diffs from every frame remembered next to a newly published one.
+
+    Called at publish time, so /calendar.diff requests are answered from the
+    cache, both with the default number of rectangles and as a single one.
+    Frames of another size (from before the panel size changed) are skipped.
+    """
+    if not has_frame(to_hash, history_dir):
+        return 0
+    new = load_frame(to_hash, history_dir)
+    count = 0
+    for entry in os.scandir(history_dir):
+        from_hash = entry.name[:-len('.bmp')]
+        if not entry.name.endswith('.bmp') or from_hash == to_hash or not has_frame(from_hash, history_dir):
+            continue
+        old = None
+        for max_rects in (FRAME_DIFF_MAX_RECTS, 1):
+            key = (from_hash, to_hash, max_rects)
+            with _lock:
+                if key in _diff_cache:
+                    continue
+            if old is None:
+                old = load_frame(from_hash, history_dir)
+            if old.shape != new.shape:
+                break
+            _cache_diff(key, encode_diff(old, new, changed_rectangles(old, new, max_rects=max_rects)))
+            count += 1
+    return count
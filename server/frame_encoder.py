@@ -0,0 +1,184 @@
+"""
+Panel-native frame encoding for the black/white/red e-ink display
+
+Packed frame format (.epd), all integers little-endian:
+
+    magic     4 bytes  b"EPD3"
+    width     uint16
+    height    uint16
+    planes    uint8    always 2
+    encoding  uint8    0 = raw, 1 = PackBits per row
+    reserved  uint16
+    black plane, then red plane
+
+Each plane has one bit per pixel, rows top to bottom, MSB = leftmost pixel,
+rows padded to whole bytes. A set bit means the pixel has that colour; a
+pixel with neither bit set is white. 800x480 gives 48000 bytes per plane.
+
+With encoding 1 (.rle) every plane row is PackBits-compressed on its own, so
+a decoder needs no more than one control byte of state and can write
+straight into its row buffer: control byte n in 0..127 copies the next n+1
+bytes, n in -127..-1 repeats the next byte 1-n times, -128 is skipped.
+"""
+import io
+import os
+import json
+import time
+import struct
+import hashlib
+import numpy as np
+from PIL import Image
+
+# Palette indices used throughout: 0 white, 1 black, 2 red
+PANEL_PALETTE = [(255, 255, 255), (0, 0, 0), (255, 0, 0)]
+WHITE, BLACK, RED = 0, 1, 2
+
+FRAME_MAGIC = b"EPD3"
+FRAME_HEADER = struct.Struct("<4sHHBBH")
+ENCODING_RAW = 0
+ENCODING_PACKBITS = 1
+
+# Floyd-Steinberg dithering before quantizing (otherwise nearest colour only)
+FRAME_DITHER = os.getenv('FRAME_DITHER', 'true').lower() == 'true'
+
+def _palette_image():
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette([channel for color in PANEL_PALETTE for channel in color])
+    return palette_image
+
+def quantize(img, dither=FRAME_DITHER):
+    """Map an image to the panel palette, returning an (height, width) array of indices"""
+    rgb = img.convert('RGB')
+
+    if dither:
+        # Pillow's error diffusion runs in C over the whole frame at once
+        indexed = rgb.quantize(palette=_palette_image(), dither=Image.Dither.FLOYDSTEINBERG)
+        return np.asarray(indexed, dtype=np.uint8)
+
+    # Nearest palette colour for every pixel at once
+    pixels = np.asarray(rgb, dtype=np.int32)
+    palette = np.array(PANEL_PALETTE, dtype=np.int32)
+    distances = ((pixels[:, :, None, :] - palette[None, None, :, :]) ** 2).sum(axis=3)
+    return distances.argmin(axis=2).astype(np.uint8)
+
+def pack_planes(indices):
+    """Pack palette indices into (black plane, red plane) bytes"""
+    black = np.packbits(indices == BLACK, axis=1)
+    red = np.packbits(indices == RED, axis=1)
+    return black.tobytes(), red.tobytes()
+
+def encode_packed_frame(indices, encoding=ENCODING_RAW, planes=None):
+    """Build the .epd frame: header followed by the two planes"""
+    height, width = indices.shape
+    if planes is None:
+        planes = pack_planes(indices)
+    header = FRAME_HEADER.pack(FRAME_MAGIC, width, height, 2, encoding, 0)
+    return header + b"".join(planes)
+
+def packbits(data):
+    """PackBits-compress one row of bytes"""
+    out = bytearray()
+    n = len(data)
+    i = 0
+    literal_start = 0
+
+    def flush_literal(end):
+        start = literal_start
+        while start < end:
+            count = min(128, end - start)
+            out.append(count - 1)
+            out.extend(data[start:start + count])
+            start += count
+
+    while i < n:
+        # Length of the run of identical bytes starting at i
+        run_end = i + 1
+        while run_end < n and run_end - i < 128 and data[run_end] == data[i]:
+            run_end += 1
+
+        if run_end - i >= 2:
+            flush_literal(i)
+            out.append(257 - (run_end - i))
+            out.append(data[i])
+            i = run_end
+            literal_start = i
+        else:
+            i += 1
+
+    flush_literal(n)
+    return bytes(out)
+
+def encode_compressed_frame(indices):
+    """Build the .rle frame: header followed by both planes, PackBits per row"""
+    height, width = indices.shape
+    rows = []
+    for plane in pack_planes(indices):
+        row_bytes = len(plane) // height
+        for y in range(height):
+            row = plane[y * row_bytes:(y + 1) * row_bytes]
+            # Blank rows are by far the most common: one repeat run
+            if row.count(row[0]) == row_bytes and row_bytes <= 128:
+                rows.append(bytes((257 - row_bytes, row[0])))
+            else:
+                rows.append(packbits(row))
+    return encode_packed_frame(indices, ENCODING_PACKBITS, planes=rows)
+
+def encode_indexed_bmp(indices):
+    """8-bit palette BMP with the three panel colours"""
+    height, width = indices.shape
+    indexed = Image.frombytes('P', (width, height), np.ascontiguousarray(indices).tobytes())
+    indexed.putpalette([channel for color in PANEL_PALETTE for channel in color])
+    buffer = io.BytesIO()
+    indexed.save(buffer, 'BMP')
+    return buffer.getvalue()
+
+def file_hash(path):
+    """Content hash of a frame file (first 32 hex digits of its SHA-256)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+def frame_stats_path(bmp_filename):
+    """Path of the JSON file with the encoding stats of a frame"""
+    return os.path.splitext(bmp_filename)[0] + '.json'
+
+def save_frame_variants(img, bmp_filename):
+    """Quantize once and write the panel-native variants next to the BMP.
+
+    Writes <name>.epd (packed planes), <name>.rle (PackBits-compressed
+    planes) and <name>_indexed.bmp, plus <name>.json with the size and
+    encode time of each variant. Returns the stats dict.
+    """
+    base, _ = os.path.splitext(bmp_filename)
+    encoders = {
+        'packed': (base + '.epd', encode_packed_frame),
+        'compressed': (base + '.rle', encode_compressed_frame),
+        'indexed': (base + '_indexed.bmp', encode_indexed_bmp),
+    }
+
+    started = time.monotonic()
+    indices = quantize(img)
+    stats = {
+        'quantize_ms': round((time.monotonic() - started) * 1000, 1),
+        'variants': {}
+    }
+
+    for name, (path, encoder) in encoders.items():
+        started = time.monotonic()
+        data = encoder(indices)
+        encode_ms = round((time.monotonic() - started) * 1000, 1)
+
+        with open(path, 'wb') as f:
+            f.write(data)
+        stats['variants'][name] = {'path': path, 'bytes': len(data), 'encode_ms': encode_ms}
+        print(f"Frame variant '{name}' saved to {path} ({len(data)} bytes, {encode_ms} ms)")
+
+    packed_bytes = stats['variants']['packed']['bytes']
+    compressed_bytes = stats['variants']['compressed']['bytes']
+    stats['compression_ratio'] = round(packed_bytes / compressed_bytes, 2)
+
+    with open(frame_stats_path(bmp_filename), 'w') as f:
+        json.dump(stats, f, indent=2)
+    return stats
@@ -0,0 +1,223 @@
+"""
+Versioned store of published frames, served from memory
+
+Every publish copies the rendered frame files into a new, never modified
+version directory and then swaps the `current` pointer file with
+write-temp-then-rename:
+
+    output/frames/
+        current                      name of the live version
+        20251026T060000123456/
+            manifest.json            files, content hashes, sizes, stats
+            illustrated_calendar.bmp
+            ...
+
+Readers (threads or worker processes) map the files of the live version
+read-only, so the page cache holds one shared copy and a render in progress
+can never hand out a half-written frame.
+"""
+import os
+import re
+import json
+import mmap
+import time
+import shutil
+import threading
+from datetime import datetime
+from frame_encoder import file_hash
+
+FRAME_STORE_DIR = os.getenv('FRAME_STORE_DIR', 'output/frames')
+# Published versions kept on disk; readers still streaming an older version
+# keep their mapping even after its directory is removed
+FRAME_STORE_KEEP = int(os.getenv('FRAME_STORE_KEEP', '3'))
+# Unfinished publishes of other processes older than this are leftovers of a crash
+FRAME_STORE_TEMP_MAX_AGE = 3600
+# Bytes handed to the WSGI server per write
+FRAME_CHUNK_SIZE = 64 * 1024
+
+class PublishedFrame:
+    """One published version with its files mapped read-only into memory"""
+
+    def __init__(self, directory, version):
+        self.version = version
+        path = os.path.join(directory, version)
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.published_at = datetime.fromisoformat(manifest['published_at'])
+        self.stats = manifest.get('stats')
+        # A stand-in published until the first real render is done
+        self.placeholder = manifest.get('placeholder', False)
+        self.files = manifest['files']
+        self._maps = {}
+        for name, entry in self.files.items():
+            with open(os.path.join(path, entry['file']), 'rb') as f:
+                self._maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, name):
+        return name in self._maps
+
+    def etag(self, name):
+        return self.files[name]['hash']
+
+    def size(self, name):
+        return self.files[name]['bytes']
+
+    def data(self, name):
+        """Read-only mapping of a file's content"""
+        return self._maps[name]
+
+    def chunks(self, name, start=0, end=None):
+        """Yield the bytes of a file from start to end in FRAME_CHUNK_SIZE pieces"""
+        data = self._maps[name]
+        end = len(data) if end is None else end
+        for offset in range(start, end, FRAME_CHUNK_SIZE):
+            yield data[offset:min(offset + FRAME_CHUNK_SIZE, end)]
+
+class FrameStore:
+    """Atomically published frame versions and the live one of them"""
+
+    def __init__(self, directory=FRAME_STORE_DIR, keep=FRAME_STORE_KEEP):
+        self.directory = directory
+        self.keep = keep
+        self.pointer_path = os.path.join(directory, 'current')
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._current = None
+        self._signature = None
+        # Older versions opened by get(), by version
+        self._versions = {}
+
+    def current(self):
+        """The live version, or None if nothing was published yet.
+
+        Costs one stat() per call; the pointer is only re-read and the files
+        only re-mapped when another thread or process published a new version.
+        """
+        try:
+            stat = os.stat(self.pointer_path)
+        except FileNotFoundError:
+            return None
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            if signature == self._signature:
+                return self._current
+            current = self._current
+
+        try:
+            with open(self.pointer_path) as f:
+                version = f.read().strip()
+            if current is None or current.version != version:
+                current = PublishedFrame(self.directory, version)
+        except Exception as e:
+            # The version may have been pruned between reading the pointer and
+            # mapping it; keep serving what we have and retry on the next call
+            print(f"Error loading published frame: {e}")
+            return current
+
+        with self._lock:
+            self._current, self._signature = current, signature
+        return current
+
+    def get(self, version):
+        """A published version by name, or None if it is unknown or was pruned.
+
+        Versions never change, so devices can resume a download of one even
+        after a newer version went live.
+        """
+        current = self.current()
+        if current is not None and current.version == version:
+            return current
+        # Version names end up in paths
+        if not re.fullmatch(r'\d{8}T\d{12}', version):
+            return None
+
+        with self._lock:
+            frame = self._versions.get(version)
+        if frame is None:
+            try:
+                frame = PublishedFrame(self.directory, version)
+            except FileNotFoundError:
+                return None
+            with self._lock:
+                self._versions[version] = frame
+                while len(self._versions) > self.keep:
+                    self._versions.pop(next(iter(self._versions)))
+        return frame
+
+    def publish(self, files, stats=None, placeholder=False):
+        """Copy files ({name: path}) into a new version and make it the live one"""
+        with self._publish_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            version = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+            # The pid tells this process's unfinished publishes from those of
+            # other processes sharing the directory
+            temp_dir = os.path.join(self.directory, f"{version}.{os.getpid()}.tmp")
+            os.makedirs(temp_dir)
+
+            manifest = {
+                'version': version,
+                'published_at': datetime.now().isoformat(),
+                'placeholder': placeholder,
+                'files': {},
+                'stats': stats,
+            }
+            for name, source in files.items():
+                filename = os.path.basename(source)
+                target = os.path.join(temp_dir, filename)
+                shutil.copyfile(source, target)
+                manifest['files'][name] = {
+                    'file': filename,
+                    'hash': file_hash(target),
+                    'bytes': os.path.getsize(target),
+                }
+            with open(os.path.join(temp_dir, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=2)
+
+            # The version directory appears complete, then the pointer moves to it
+            os.rename(temp_dir, os.path.join(self.directory, version))
+            temp_pointer = f"{self.pointer_path}.{os.getpid()}.tmp"
+            with open(temp_pointer, 'w') as f:
+                f.write(version)
+            os.replace(temp_pointer, self.pointer_path)
+
+            self._prune(version)
+            print(f"Published frame version {version}")
+            return self.current()
+
+    def _prune(self, live_version):
+        """Remove all but the newest versions and leftovers of failed publishes.
+
+        Another process's temp directory may be a publish in progress, so it
+        is only removed once it is older than FRAME_STORE_TEMP_MAX_AGE.
+        """
+        own_suffix = f".{os.getpid()}.tmp"
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_dir()),
+            key=lambda entry: entry.name,
+            reverse=True
+        )
+        kept = 0
+        for entry in entries:
+            name = entry.name
+            if name.endswith('.tmp'):
+                try:
+                    abandoned = time.time() - entry.stat().st_mtime > FRAME_STORE_TEMP_MAX_AGE
+                except FileNotFoundError:
+                    continue
+                if not name.endswith(own_suffix) and not abandoned:
+                    continue
+            elif name == live_version or kept < self.keep:
+                kept += 1
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+_frame_stores = {}
+_frame_stores_lock = threading.Lock()
+
+def get_frame_store(directory=FRAME_STORE_DIR):
+    """Return the process-wide frame store of a directory (one per display profile)"""
+    with _frame_stores_lock:
+        if directory not in _frame_stores:
+            _frame_stores[directory] = FrameStore(directory)
+        return _frame_stores[directory]
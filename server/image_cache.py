@@ -0,0 +1,143 @@
+"""
+Content-addressed on-disk cache for generated illustrations
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', 'output/image_cache')
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv('IMAGE_CACHE_MAX_ENTRIES', '200'))
+IMAGE_CACHE_MAX_MB = float(os.getenv('IMAGE_CACHE_MAX_MB', '200'))
+
+class ImageCache:
+    """Generated images stored under the hash of (model, prompt).
+
+    The index lives next to the images in index.json and records the size and
+    last use of every entry plus hit/miss counters. When the cache grows past
+    max_entries or max_bytes the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_entries=IMAGE_CACHE_MAX_ENTRIES,
+                 max_bytes=int(IMAGE_CACHE_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+        self._index = None
+
+    @staticmethod
+    def key(prompt, model):
+        return hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _load_index(self):
+        """Load the index on first use. Caller holds the lock."""
+        if self._index is None:
+            try:
+                with open(self.index_path) as f:
+                    self._index = json.load(f)
+            except FileNotFoundError:
+                self._index = {}
+            except Exception as e:
+                print(f"Error reading image cache index, starting empty: {e}")
+                self._index = {}
+            self._index.setdefault('entries', {})
+            self._index.setdefault('hits', 0)
+            self._index.setdefault('misses', 0)
+        return self._index
+
+    def _save_index(self):
+        """Write the index atomically. Caller holds the lock."""
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(temp_path, self.index_path)
+
+    def lookup(self, prompt, models):
+        """Return the cached image path for the first model that has one.
+
+        Counts one hit or one miss per lookup.
+        """
+        with self._lock:
+            index = self._load_index()
+            for model in models:
+                entry = index['entries'].get(self.key(prompt, model))
+                if not entry:
+                    continue
+                path = os.path.join(self.directory, entry['file'])
+                if not os.path.exists(path):
+                    del index['entries'][self.key(prompt, model)]
+                    continue
+                entry['last_used'] = time.time()
+                index['hits'] += 1
+                self._save_index()
+                return path
+
+            index['misses'] += 1
+            self._save_index()
+            return None
+
+    def store(self, prompt, model, content, extension=".png"):
+        """Store image bytes for (prompt, model) and return the cached path"""
+        key = self.key(prompt, model)
+        filename = key + extension
+        path = os.path.join(self.directory, filename)
+
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, path)
+
+            index = self._load_index()
+            index['entries'][key] = {
+                'file': filename,
+                'model': model,
+                'size': len(content),
+                'last_used': time.time()
+            }
+            self._evict()
+            self._save_index()
+        return path
+
+    def _evict(self):
+        """Drop least recently used entries until within limits. Caller holds the lock."""
+        entries = self._index['entries']
+        total_bytes = sum(entry['size'] for entry in entries.values())
+
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if len(entries) <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            entry = entries.pop(key)
+            total_bytes -= entry['size']
+            try:
+                os.remove(os.path.join(self.directory, entry['file']))
+            except FileNotFoundError:
+                pass
+            print(f"Evicted cached image {entry['file']}")
+
+    def stats(self):
+        """Return entry count, total size and hit/miss counters"""
+        with self._lock:
+            index = self._load_index()
+            return {
+                'entries': len(index['entries']),
+                'bytes': sum(entry['size'] for entry in index['entries'].values()),
+                'hits': index['hits'],
+                'misses': index['misses']
+            }
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+def get_image_cache():
+    """Return the process-wide image cache"""
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = ImageCache()
+        return _image_cache
@@ -5,18 +5,24 @@ import os
 import requests
 import random
 import datetime
-from calendar_api import fetch_calendar_events
 from llm_handler import llm
+from render_context import RenderContext
+from image_cache import get_image_cache
+from metrics import IMAGE_REQUEST_SECONDS, CACHE_LOOKUPS, FALLBACKS, FAILURES
 
-def draw_calendar_animal_imagerouter():
+# ImageRouter image generation endpoint
+IMAGEROUTER_API_URL = os.getenv('IMAGEROUTER_API_URL', 'https://api.imagerouter.io/v1/openai/images/generations')
+# Shown when no illustration could be generated
+FALLBACK_ILLUSTRATION = "assets/dog.png"
+
+def draw_calendar_animal_imagerouter(context=None):
     """Create a PNG based on calendar events using ImageRouter.io API"""
     try:
-        # Fetch today's events
-        calendar_events = fetch_calendar_events()
-        today = datetime.date.today()
+        if context is None:
+            context = RenderContext.fetch()
         
         # Get events for today
-        todays_events = calendar_events.get(today, [])
+        todays_events = context.todays_events
         if not todays_events:
                 
             animal = random.choice(["cat", "dog", "rabbit", "penguin", "owl", "fox"])
@@ -51,13 +57,17 @@ def draw_calendar_animal_imagerouter():
         
     except Exception as e:
         print(f"Error in draw_calendar_animal_imagerouter: {e}")
-        return "assets/dog.png"
+        FALLBACKS.inc(kind="illustration")
+        return FALLBACK_ILLUSTRATION
 
-def draw_llm_animal_imagerouter():
+def draw_llm_animal_imagerouter(context=None):
     """Create a PNG based on the daily LLM-generated fact using ImageRouter.io"""
     try:
-        # Get the daily fact from LLM
-        daily_fact = llm()
+        # Reuse the fact already generated for this render if there is one
+        if context is not None and context.fun_fact:
+            daily_fact = context.fun_fact
+        else:
+            daily_fact = llm(context)
         
         # Analyze the content of the fact to create better prompts
         fact_lower = daily_fact.lower()
@@ -106,12 +116,17 @@ def draw_llm_animal_imagerouter():
         
     except Exception as e:
         print(f"Error in draw_llm_animal_imagerouter: {e}")
-        return "assets/dog.png"
+        FALLBACKS.inc(kind="illustration")
+        return FALLBACK_ILLUSTRATION
 
 def generate_image_with_imagerouter(prompt, filename):
-    """Generic function to generate images using ImageRouter.io"""
+    """Generic function to generate images using ImageRouter.io
+    
+    Images are cached by prompt and model, so a prompt that was generated
+    before is served from disk without any request to ImageRouter.
+    """
     # ImageRouter.io API configuration
-    url = "https://api.imagerouter.io/v1/openai/images/generations"
+    url = IMAGEROUTER_API_URL
     
     # Try primary model first, then fallback
     models = [
@@ -119,6 +134,17 @@ def generate_image_with_imagerouter(prompt, filename):
             "HiDream-ai/HiDream-I1-Dev"
     ]
     
+    cache = get_image_cache()
+    try:
+        cached_path = cache.lookup(prompt, models)
+        CACHE_LOOKUPS.inc(cache="image", result="hit" if cached_path else "miss")
+        if cached_path:
+            print(f"Using cached image for {filename}: {cached_path}")
+            return cached_path
+    except Exception as e:
+        print(f"Error reading image cache: {e}")
+        cache = None
+    
     for model in models:
         try:
             print(f"Trying model: {model} for {filename}")
@@ -133,8 +159,11 @@ def generate_image_with_imagerouter(prompt, filename):
                 "Content-Type": "application/json"
             }
             
-            response = requests.post(url, json=payload, headers=headers)
-            result = response.json()
+            with IMAGE_REQUEST_SECONDS.time(model=model, step="generate", outcome="error") as labels:
+                response = requests.post(url, json=payload, headers=headers)
+                result = response.json()
+                if response.status_code == 200:
+                    labels['outcome'] = "success"
             
             if response.status_code == 200 and 'data' in result and len(result['data']) > 0:
                 # Get the image URL from the response
@@ -142,9 +171,24 @@ def generate_image_with_imagerouter(prompt, filename):
                 print(f"Generated image URL: {image_url}")
                 
                 # Download and save the image
-                image_response = requests.get(image_url)
+                with IMAGE_REQUEST_SECONDS.time(model=model, step="download", outcome="error") as labels:
+                    image_response = requests.get(image_url)
+                    if image_response.status_code == 200:
+                        labels['outcome'] = "success"
                 
                 if image_response.status_code == 200:
+                    # Store the image in the cache
+                    if cache is not None:
+                        try:
+                            extension = os.path.splitext(image_url.split('?')[0])[1].lower()
+                            if extension not in ('.png', '.jpg', '.jpeg', '.webp'):
+                                extension = '.png'
+                            full_path = cache.store(prompt, model, image_response.content, extension)
+                            print(f"Image cached as: {full_path}")
+                            return full_path
+                        except Exception as e:
+                            print(f"Error writing image cache: {e}")
+                    
                     # Create output directory if it doesn't exist
                     os.makedirs("output", exist_ok=True)
                     
@@ -168,21 +212,24 @@ def generate_image_with_imagerouter(prompt, filename):
     
     # If all models fail, return fallback
     print(f"All ImageRouter models failed for {filename}, using fallback image")
-    return "assets/dog.png"
+    FAILURES.inc(stage="image")
+    FALLBACKS.inc(kind="illustration")
+    return FALLBACK_ILLUSTRATION
 
-def draw_dynamic_animal(mode="auto"):
+def draw_dynamic_animal(mode="auto", context=None):
     """
     Create a PNG based on calendar events or LLM content using ImageRouter.io
     mode: "events", "llm", or "auto" (chooses based on day of week)
+    context: optional RenderContext shared with the rest of the render
     """
     if mode == "auto":
         # Alternate based on day of week or other logic
-        today = datetime.date.today()
+        today = context.today if context is not None else datetime.date.today()
         mode = "events" if today.weekday() % 2 == 0 else "llm"
     
     if mode == "events":
-        return draw_calendar_animal_imagerouter()
+        return draw_calendar_animal_imagerouter(context)
     elif mode == "llm":
-        return draw_llm_animal_imagerouter()
+        return draw_llm_animal_imagerouter(context)
     else:
         raise ValueError("Mode must be 'events', 'llm', or 'auto'")
\ No newline at end of file
@@ -4,8 +4,11 @@ LLM integration for generating fun facts
 import os
 import requests
 import random
-import datetime
-from calendar_api import fetch_calendar_events
+from render_context import RenderContext
+from metrics import LLM_REQUEST_SECONDS, FALLBACKS, FAILURES
+
+# OpenRouter chat completions endpoint
+OPENROUTER_API_URL = os.getenv('OPENROUTER_API_URL', 'https://openrouter.ai/api/v1/chat/completions')
 
 def clean_markdown_text(text):
     """Remove markdown formatting from text"""
@@ -17,18 +20,93 @@ def clean_markdown_text(text):
     text = text.replace('_', '')
     return text.strip()
 
-def llm() -> str:
-    """Generate a fun fact using OpenRouter API with direct HTTP requests"""
+# Topics for fun facts on days without events
+GENERAL_TOPICS = ["et mærkeligt dyr", "en sjov ting fra rummet", "en hemmelighed om vand", "en rekord om legetøj"]
+
+def request_completion(prompt, timeout=30):
+    """Send a prompt to OpenRouter, trying each model in turn.
+
+    Returns the raw message text, or None if no API key is set or all models fail.
+    """
+    # Check if API key exists
+    api_key = os.getenv('OPENROUTER_API_KEY')
+    if not api_key:
+        print("Warning: OPENROUTER_API_KEY not found")
+        return None
+    
+    # Use direct HTTP requests to avoid OpenAI client version issues
+    url = OPENROUTER_API_URL
+    
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "http://localhost:8000",
+        "X-Title": "Calendar Generator",
+    }
+    
+    # Try different models
+    models_to_try = [
+        "google/gemma-3-27b-it:free",
+        "meta-llama/llama-3.2-3b-instruct:free",
+        "microsoft/phi-3-mini-128k-instruct:free"
+    ]
+    
+    for model in models_to_try:
+        with LLM_REQUEST_SECONDS.time(model=model, outcome="error") as labels:
+            message = _request_model(url, headers, model, prompt, timeout)
+            if message is not None:
+                labels['outcome'] = "success"
+                return message
+    
+    # All models failed
+    print("All LLM models failed")
+    FAILURES.inc(stage="llm")
+    return None
+
+def _request_model(url, headers, model, prompt, timeout):
+    """One OpenRouter attempt with one model; returns the message text or None"""
     try:
-        # Fetch today's events
-        calendar_events = fetch_calendar_events()
-        today = datetime.date.today()
+        print(f"Trying LLM model: {model}")
+        
+        data = {
+            "model": model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        }
+        
+        response = requests.post(url, headers=headers, json=data, timeout=timeout)
+        
+        if response.status_code == 200:
+            result = response.json()
+            message = result['choices'][0]['message']['content']
+            print(f"LLM success with {model}")
+            return message
+        else:
+            print(f"Model {model} failed: {response.status_code} - {response.text}")
+            return None
+            
+    except Exception as model_error:
+        print(f"Model {model} error: {model_error}")
+        return None
+
+def llm(context=None) -> str:
+    """Generate a fun fact using OpenRouter API with direct HTTP requests.
+
+    context: RenderContext with the already fetched events. When omitted the
+    events are fetched here, as before.
+    """
+    try:
+        if context is None:
+            context = RenderContext.fetch()
         
         # Get events for today
-        todays_events = calendar_events.get(today, [])
+        todays_events = context.todays_events
         if not todays_events:
-            general_topics = ["et mærkeligt dyr", "en sjov ting fra rummet", "en hemmelighed om vand", "en rekord om legetøj"]
-            random_topic = random.choice(general_topics)
+            random_topic = random.choice(GENERAL_TOPICS)
 
             prompt = (
                 f"Du er en fantasifuld historiefortæller for børn. Fortæl kun et meget kort, muntert og fantasifuldt fun fact for børn på maksimalt 1-2 linjer om **{random_topic}**. "
@@ -46,66 +124,21 @@ def llm() -> str:
             "Start direkte med fakta uden indledning som 'Vidste du' eller 'Her er et fun fact'. "
             "Brug ikke markdown formatting."
         )
-        # Check if API key exists
-        api_key = os.getenv('OPENROUTER_API_KEY')
-        if not api_key:
-            print("Warning: OPENROUTER_API_KEY not found")
-            return get_fallback_fun_fact()
-        
-        # Use direct HTTP requests to avoid OpenAI client version issues
-        url = "https://openrouter.ai/api/v1/chat/completions"
         
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "http://localhost:8000",
-            "X-Title": "Calendar Generator",
-        }
-        
-        # Try different models
-        models_to_try = [
-            "google/gemma-3-27b-it:free",
-            "meta-llama/llama-3.2-3b-instruct:free",
-            "microsoft/phi-3-mini-128k-instruct:free"
-        ]
-        
-        for model in models_to_try:
-            try:
-                print(f"Trying LLM model: {model}")
-                
-                data = {
-                    "model": model,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ]
-                }
-                
-                response = requests.post(url, headers=headers, json=data, timeout=30)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    message = result['choices'][0]['message']['content']
-                    # Clean markdown formatting
-                    cleaned_message = clean_markdown_text(message)
-                    print(f"LLM success with {model}: {cleaned_message}")
-                    return cleaned_message
-                else:
-                    print(f"Model {model} failed: {response.status_code} - {response.text}")
-                    continue
-                    
-            except Exception as model_error:
-                print(f"Model {model} error: {model_error}")
-                continue
+        message = request_completion(prompt)
+        if message is None:
+            print("Using fallback fun fact")
+            FALLBACKS.inc(kind="fun_fact")
+            return get_fallback_fun_fact()
         
-        # All models failed
-        print("All LLM models failed, using fallback")
-        return get_fallback_fun_fact()
+        # Clean markdown formatting
+        cleaned_message = clean_markdown_text(message)
+        print(f"LLM fun fact: {cleaned_message}")
+        return cleaned_message
         
     except Exception as e:
         print(f"Error in LLM generation: {e}")
+        FALLBACKS.inc(kind="fun_fact")
         return get_fallback_fun_fact()
 
 def get_fallback_fun_fact() -> str:
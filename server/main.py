@@ -8,119 +8,229 @@ import datetime
 import os
 import random # Added for dynamic image generation
 import subprocess
+import time
 
 # Import our modular components
-from calendar_api import fetch_calendar_events
-from llm_handler import llm, clean_markdown_text
-from image_generator import draw_dynamic_animal
-from weather_handler import fetch_weather_forecast, create_weather_icon
+from render_context import RenderContext
+from llm_handler import get_fallback_fun_fact, clean_markdown_text
+from fact_pool import take_fact
+from image_generator import draw_dynamic_animal, FALLBACK_ILLUSTRATION
+from weather_handler import fetch_weather_forecast, paste_weather_icon
 from font_handler import load_fonts
+from render_pipeline import RenderPipeline
+from frame_encoder import save_frame_variants
+from text_layout import TextLayout, measurer, layout_paragraph
+from static_layer import get_static_layers
+from metrics import record_render, FALLBACKS, FAILURES
+from daily_content import load_daily_content, save_daily_content
 
-def generate_illustrated_calendar(filename="output/illustrated_calendar.png", width=800, height=480): 
-    """Generates an illustrated calendar image with Danish day names and LLM speech bubble."""
-    
-    # Create output directory if it doesn't exist
-    os.makedirs("output", exist_ok=True)
-    
-    # First, fetch calendar events
+# Danish day and month names
+DANISH_DAYS = {
+    0: "Mandag", 
+    1: "Tirsdag",
+    2: "Onsdag",
+    3: "Torsdag",
+    4: "Fredag",
+    5: "Lørdag",
+    6: "Søndag"
+}
+
+DANISH_MONTHS = {
+    1: "Januar",
+    2: "Februar",
+    3: "Marts",
+    4: "April",
+    5: "Maj",
+    6: "Juni",
+    7: "Juli",
+    8: "August",
+    9: "September",
+    10: "Oktober",
+    11: "November",
+    12: "December"
+}
+
+# Frame layout: red separator line, day columns
+RED_LINE_Y = 60
+DAYS_TO_SHOW = 4
+BASE_X_OFFSET = 150
+# The speech bubble and illustration are placed this far above the bottom edge
+BUBBLE_BOTTOM_OFFSET = 230
+BUBBLE_WIDTH = 350
+# Smallest panel the layout can serve: a column fits the abbreviated day name
+# and the weather values, and two event rows fit above the speech bubble
+MIN_COLUMN_WIDTH = 100
+MIN_PANEL_HEIGHT = RED_LINE_Y + 55 + 2 * 22 + BUBBLE_BOTTOM_OFFSET
+
+# Bump when draw_static_layer() changes, so stored layers are redrawn
+STATIC_LAYER_VERSION = 3
+
+def column_width(width, days):
+    """Width of one day column (160 px for four days on an 800 px panel)"""
+    return (width - BASE_X_OFFSET - 10) // days
+
+def check_layout(width, height, days):
+    """Raise ValueError if the frame layout can't be drawn at this size"""
+    if days < 1 or column_width(width, days) < MIN_COLUMN_WIDTH:
+        raise ValueError(f"{width} px is too narrow for {days} day columns "
+                         f"(at least {MIN_COLUMN_WIDTH} px each)")
+    if height < MIN_PANEL_HEIGHT:
+        raise ValueError(f"{height} px is too low, the layout needs at least {MIN_PANEL_HEIGHT} px")
+
+def _fetch_render_context(today, days=DAYS_TO_SHOW):
+    """Pipeline stage: fetch the calendar events once for the whole render"""
     try:
-        calendar_events = fetch_calendar_events()
-        print(f"Fetched calendar events: {calendar_events}")
+        context = RenderContext.fetch(today, days)
+        print(f"Fetched calendar events: {context.calendar_events}")
     except Exception as e:
         print(f"Error fetching calendar events: {e}")
-        calendar_events = {}
-    
-    # Fetch weather forecast
+        context = RenderContext(today=today)
+    return context
+
+def _fetch_weather(days=DAYS_TO_SHOW):
+    """Pipeline stage: fetch the weather forecast"""
     try:
-        weather_forecast = fetch_weather_forecast()
+        weather_forecast = fetch_weather_forecast(days)
         print(f"Fetched weather forecast: {weather_forecast}")
     except Exception as e:
         print(f"Error fetching weather forecast: {e}")
         weather_forecast = None
+    if not weather_forecast:
+        FALLBACKS.inc(kind="weather")
+    return weather_forecast
+
+def _generate_fun_fact(calendar, reuse_daily_content=False):
+    """Pipeline stage: get the fun fact for the speech bubble"""
+    if reuse_daily_content:
+        joke_response = load_daily_content(calendar.today).get('fun_fact')
+        if joke_response:
+            calendar.fun_fact = joke_response
+            return joke_response
+    try:
+        # Served from the pre-generated pool, never from an LLM request of
+        # its own; while the pool is empty a static fact stands in, and is
+        # not kept for the day so the next render looks in the pool again
+        joke_response = take_fact(calendar)
+        if joke_response:
+            joke_response = clean_markdown_text(joke_response)
+            save_daily_content(calendar.today, fun_fact=joke_response)
+        else:
+            FALLBACKS.inc(kind="fun_fact")
+            joke_response = get_fallback_fun_fact()
+        calendar.fun_fact = joke_response
+    except Exception as e:
+        joke_response = f"Could not get fun fact: {str(e)}"
+    return joke_response
+
+def _generate_illustration(calendar, reuse_daily_content=False):
+    """Pipeline stage: generate the illustration and return its path"""
+    if reuse_daily_content:
+        path = load_daily_content(calendar.today).get('illustration')
+        if path and os.path.exists(path):
+            return path
+    path = draw_dynamic_animal("events", calendar)
+    if path != FALLBACK_ILLUSTRATION:
+        save_daily_content(calendar.today, illustration=path)
+    return path
+
+def layout_event(column_left, top, cell_width, time, title, fonts):
+    """Lay out an event (time and up to two title lines) in a day column.
+    
+    The returned layout's height is the vertical space the event takes,
+    including the gap to the next event.
+    """
+    time_measurer = measurer(fonts['time'])
+    event_measurer = measurer(fonts['event'])
+    layout = TextLayout()
+    
+    column_right = column_left + cell_width - 15  # Leave margin for column separator
+    max_column_width = column_right - column_left
+    
+    # The time goes in front of the first title line
+    time_width = 0
+    if time.strip():
+        time_width = time_measurer.width(time + " ")
+        if time_width > max_column_width:
+            time_width = max_column_width
+            truncated_time = time_measurer.truncate(time, max_column_width, "... ")
+            layout.add(column_left, top, truncated_time + "... ", fonts['time'])
+        else:
+            layout.add(column_left, top, time + " ", fonts['time'])
     
-    # Initialize image canvas
-    img = Image.new('RGB', (width, height), color='white')
-    draw = ImageDraw.Draw(img)
+    # Width left for the title; if too narrow the title starts on the next line
+    available_width = max_column_width - time_width - 5  # Small padding
+    if available_width < 50:
+        time_width = 0
+        available_width = max_column_width - 5
     
-    # Load fonts
-    fonts = load_fonts()
+    lines = event_measurer.wrap(title, available_width, max_words=6, long_word_suffix="...")
     
-    # Define Danish day and month names
-    danish_days = {
-        0: "Mandag", 
-        1: "Tirsdag",
-        2: "Onsdag",
-        3: "Torsdag",
-        4: "Fredag",
-        5: "Lørdag",
-        6: "Søndag"
-    }
-    
-    danish_months = {
-        1: "Januar",
-        2: "Februar",
-        3: "Marts",
-        4: "April",
-        5: "Maj",
-        6: "Juni",
-        7: "Juli",
-        8: "August",
-        9: "September",
-        10: "Oktober",
-        11: "November",
-        12: "December"
-    }
-    
-    # Get Today's Date
-    today = datetime.date.today()
+    # Draw at most two title lines, each strictly within the column
+    current_y = top
+    for i, line in enumerate(lines[:2]):
+        if i == 0 and time_width > 0:
+            # First line on same line as time
+            text_x = column_left + time_width
+        else:
+            text_x = column_left
+            if i > 0:
+                current_y += 16  # Move to next line
+        
+        if text_x + event_measurer.width(line) > column_right:
+            truncated_line = event_measurer.truncate_words(line, column_right - text_x, "...", min_chars=3)
+            line = truncated_line + ("..." if len(truncated_line) < len(line) else "")
+        
+        layout.add(text_x, current_y, line, fonts['event'])
+    
+    # Add truncation indicator if text was cut off (positioned within column)
+    if len(lines) > 2:
+        indicator_x = min(column_right - 15, text_x + event_measurer.width(line) + 5)
+        layout.add(indicator_x, current_y, "...", fonts['event'], fill="gray")
+    
+    lines_drawn = min(len(lines), 2)
+    layout.height = 16 + (lines_drawn - 1) * 16 + 6  # Consistent spacing
+    return layout
+
+def draw_static_layer(today, width, height, fonts, days=DAYS_TO_SHOW):
+    """Draw the parts of the frame that only change with the date.
+    
+    That is the month header, the red separator line, the day names, the
+    empty weather boxes and the column dividers.
+    """
+    cell_width = column_width(width, days)
+    img = Image.new('RGB', (width, height), color='white')
+    draw = ImageDraw.Draw(img)
     
     # Add current month to top left corner
-    month_name = danish_months.get(today.month, str(today.month)).upper()
+    month_name = DANISH_MONTHS.get(today.month, str(today.month)).upper()
     month_x = 20
     month_y = 20
     draw.text((month_x, month_y), month_name, font=fonts['month'], fill="black")
     
     # --- Red Top Line (Separator) ---
     red_color = (255, 0, 0)
-    red_line_y = 60
-    draw.line([(10, red_line_y), (width - 10, red_line_y)], fill=red_color, width=3)
-    
-    # Get Today's Date and Calculate Following Days
-    days_to_show = 4
-    dates = [today + datetime.timedelta(days=i) for i in range(days_to_show)]
-    
-    base_x_offset = 150
-    y_offset = red_line_y - 35
-    cell_width = 160
+    draw.line([(10, RED_LINE_Y), (width - 10, RED_LINE_Y)], fill=red_color, width=3)
     
     # Draw Dates and Days of the Week - Horizontal
-    for i, date in enumerate(dates):
+    y_offset = RED_LINE_Y - 35
+    for i in range(days):
+        date = today + datetime.timedelta(days=i)
         # Get weekday as integer (0-6, where 0 is Monday)
         weekday = date.weekday()
-        day_name = danish_days.get(weekday, str(weekday))
+        day_name = DANISH_DAYS.get(weekday, str(weekday))
         day_text = f"{day_name} {date.day}."
-        draw.text((base_x_offset + i * cell_width, y_offset), day_text, font=fonts['day'], fill="black")
+        if measurer(fonts['day']).width(day_text) > cell_width - 10:
+            # Narrow columns: "Tor 28." instead of running into the next day
+            day_text = f"{day_name[:3]} {date.day}."
+        draw.text((BASE_X_OFFSET + i * cell_width, y_offset), day_text, font=fonts['day'], fill="black")
     
-    # Add weather forecasts under the red line
-    weather_y = red_line_y + 10
+    # Grey boxes under the red line (the weather values are drawn per render)
+    weather_y = RED_LINE_Y + 10
     weather_box_color = (240, 240, 240)  # Light grey
     weather_box_outline = (180, 180, 180)  # Darker grey for outline
     
-    # Define fallback weather data in case API fails
-    fallback_codes = [2, 3, 61, 1]  # Example weather codes (partly cloudy, cloudy, rain, sun)
-    fallback_temps = [
-        {"min_temp": 2, "max_temp": 11},
-        {"min_temp": 5, "max_temp": 9},
-        {"min_temp": 4, "max_temp": 12},
-        {"min_temp": 3, "max_temp": 10}
-    ]
-    
-    # Draw weather boxes and icons
-    weather_data = weather_forecast if weather_forecast else fallback_temps
-    weather_codes = [d['weather_code'] for d in weather_forecast] if weather_forecast else fallback_codes
-    
-    for i in range(days_to_show):
-        x_pos = base_x_offset + i * cell_width
+    for i in range(days):
+        x_pos = BASE_X_OFFSET + i * cell_width
         
         # Draw grey box around weather info
         weather_box_width = cell_width - 20
@@ -132,150 +242,178 @@ def generate_illustrated_calendar(filename="output/illustrated_calendar.png", wi
             outline=weather_box_outline,
             width=1
         )
-        
-        # Determine data source
-        current_data = weather_data[i]
-        current_code = weather_codes[i]
-        
-        # Draw custom weather icon
-        create_weather_icon(draw, x_pos, weather_y, current_code, size=18)
-        
-        # Draw temperature range
-        temp_text = f"{current_data['min_temp']}° - {current_data['max_temp']}°"
-        draw.text((x_pos + 24, weather_y + 6), temp_text, font=fonts['weather'], fill="black")
-
-    
-    # Event Entries - Create a list to track vertical positions for each day column
-    y_offset_bottoms = [red_line_y + 55] * days_to_show  # Start below the weather info
     
     # Calculate the middle point for divider lines
-    divider_line_length = (height - red_line_y - 150) // 2
+    divider_line_length = (height - RED_LINE_Y - 150) // 2
     
     # Draw shortened vertical dividers between days
-    for i in range(1, days_to_show):
-        draw.line([(base_x_offset + i * cell_width - 10, red_line_y + 10),
-                   (base_x_offset + i * cell_width - 10, red_line_y + 10 + divider_line_length)],
+    for i in range(1, days):
+        draw.line([(BASE_X_OFFSET + i * cell_width - 10, RED_LINE_Y + 10),
+                   (BASE_X_OFFSET + i * cell_width - 10, RED_LINE_Y + 10 + divider_line_length)],
                   fill="lightgray", width=1)
     
-    def draw_event(date_index, time, event_title, calendar_symbol="●"):
-        """Modified draw_event function to include calendar symbols"""
-        x_pos = base_x_offset + date_index * cell_width
-        
-        # Skip if we're running out of vertical space
-        if y_offset_bottoms[date_index] > height - 150:
-            return
-        
-        # Calculate strict column boundaries
-        column_left = x_pos
-        column_right = x_pos + cell_width - 15  # Leave margin for column separator
-        max_column_width = column_right - column_left
-        
-        # Prepend the calendar symbol to the event title
-        symbolized_title = f"{calendar_symbol} {event_title}"
-        
-        # Calculate the combined text with better spacing
-        time_width = 0
-        if time.strip():  # Only calculate width if there's actually a time
-            time_width = draw.textlength(time + " ", font=fonts['time'])
+    return img
+
+def static_frame(today, width, height, fonts, days=DAYS_TO_SHOW):
+    """A fresh copy of today's static layer, drawn only on the first call of the day"""
+    font_name = os.path.splitext(os.path.basename(getattr(fonts['day'], 'path', 'default')))[0]
+    layer_key = f"{today.isoformat()}_{width}x{height}_{days}d_v{STATIC_LAYER_VERSION}_{font_name}"
+    return get_static_layers().get(layer_key, lambda: draw_static_layer(today, width, height, fonts, days))
+
+def render_placeholder(filename="output/placeholder.png", width=800, height=480,
+                       message="Kalenderen opdateres..."):
+    """Render a cheap stand-in frame: today's static layer and a message.
+    
+    Needs no network, so it can be served right after startup while the
+    real render is still running. Writes the same variants as a render and
+    returns the path of each, keyed like the encoding stats.
+    """
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    today = datetime.date.today()
+    fonts = load_fonts()
+    img = static_frame(today, width, height, fonts)
+    draw = ImageDraw.Draw(img)
+    
+    message_width = measurer(fonts['day']).width(message)
+    draw.text(((width - message_width) // 2, (RED_LINE_Y + height) // 2), message, font=fonts['day'], fill="black")
+    
+    bmp_filename = filename.replace('.png', '.bmp')
+    img.save(bmp_filename, 'BMP')
+    stats = save_frame_variants(img, bmp_filename)
+    print(f"Placeholder frame saved to {bmp_filename}")
+    
+    paths = {name: variant['path'] for name, variant in stats['variants'].items()}
+    paths['bmp'] = bmp_filename
+    return paths
+
+def start_render_pipeline(today, days=DAYS_TO_SHOW, reuse_daily_content=False):
+    """Start fetching everything a render needs, for the next days, in the background.
+    
+    With reuse_daily_content the fun fact and illustration already generated
+    today are used again, so re-renders for new events or weather cost no
+    LLM or image generation quota.
+    """
+    # Only the fun fact and the illustration depend on the calendar events;
+    # everything else is independent.
+    pipeline = RenderPipeline()
+    pipeline.add_stage("calendar", lambda: _fetch_render_context(today, days))
+    pipeline.add_stage("weather", lambda: _fetch_weather(days))
+    pipeline.add_stage("fun_fact", lambda calendar: _generate_fun_fact(calendar, reuse_daily_content),
+                       depends_on=["calendar"])
+    pipeline.add_stage("illustration", lambda calendar: _generate_illustration(calendar, reuse_daily_content),
+                       depends_on=["calendar"])
+    return pipeline.start()
+
+def generate_illustrated_calendar(filename="output/illustrated_calendar.png", width=800, height=480,
+                                  days=DAYS_TO_SHOW, calendars=None, reuse_daily_content=False):
+    """Generates an illustrated calendar image with Danish day names and LLM speech bubble.
+    
+    calendars limits the events shown to those calendars (ids or names).
+    Returns the RenderContext of the render, including its stage timings.
+    """
+    
+    # Create output directory if it doesn't exist
+    os.makedirs("output", exist_ok=True)
+    
+    render_started = time.monotonic()
+    
+    # Pin today's date so all stages agree on it
+    today = datetime.date.today()
+    
+    # Start the network stages in the background and draw while they run
+    pipeline = start_render_pipeline(today, days, reuse_daily_content)
+    context = draw_calendar(pipeline, today, filename, width, height, days, calendars)
+    
+    pipeline.shutdown()
+    context.stage_timings = dict(pipeline.timings)
+    print(f"Render stage timings: {context.stage_timings}")
+    record_render(context, time.monotonic() - render_started)
+    return context
+
+def draw_calendar(pipeline, today, filename, width=800, height=480, days=DAYS_TO_SHOW, calendars=None):
+    """Draw, save and encode one frame from the results of a render pipeline.
+    
+    Waits for each pipeline stage only when its result is drawn. Returns the
+    calendar RenderContext (with every calendar's events).
+    """
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    cell_width = column_width(width, days)
+    
+    # Load fonts
+    with pipeline.timed("fonts"):
+        fonts = load_fonts()
+    
+    # --- Static layer: drawn once per day and size, then reused ---
+    with pipeline.timed("static_frame"):
+        img = static_frame(today, width, height, fonts, days)
+    draw = ImageDraw.Draw(img)
+    
+    dates = [today + datetime.timedelta(days=i) for i in range(days)]
+    weather_y = RED_LINE_Y + 10
+    
+    # Define fallback weather data in case API fails
+    fallback_codes = [2, 3, 61, 1]  # Example weather codes (partly cloudy, cloudy, rain, sun)
+    fallback_temps = [
+        {"min_temp": 2, "max_temp": 11},
+        {"min_temp": 5, "max_temp": 9},
+        {"min_temp": 4, "max_temp": 12},
+        {"min_temp": 3, "max_temp": 10}
+    ]
+    
+    # Event Entries - Create a list to track vertical positions for each day column
+    y_offset_bottoms = [RED_LINE_Y + 55] * days  # Start below the weather info
+    
+    # --- Weather values (waits for the weather stage) ---
+    weather_forecast = pipeline.result("weather")
+    weather_data = weather_forecast if weather_forecast else fallback_temps
+    weather_codes = [d['weather_code'] for d in weather_forecast] if weather_forecast else fallback_codes
+    
+    with pipeline.timed("layout"):
+        for i in range(days):
+            x_pos = BASE_X_OFFSET + i * cell_width
             
-            # Ensure time fits within column
-            if time_width > max_column_width:
-                time_width = max_column_width
-                # Truncate time if too long
-                truncated_time = time
-                while draw.textlength(truncated_time + "... ", font=fonts['time']) > max_column_width and len(truncated_time) > 0:
-                    truncated_time = truncated_time[:-1]
-                draw.text((column_left, y_offset_bottoms[date_index]), truncated_time + "... ", font=fonts['time'], fill="black")
+            # Determine data source (the fallback repeats for panels showing more days)
+            if i < len(weather_data):
+                current_data, current_code = weather_data[i], weather_codes[i]
             else:
-                draw.text((column_left, y_offset_bottoms[date_index]), time + " ", font=fonts['time'], fill="black")
-        
-        # Calculate available width for event text (strictly within column)
-        available_width = max_column_width - time_width - 5  # Small padding
-        if available_width < 50:  # If too narrow, put event text on next line
-            time_width = 0
-            available_width = max_column_width - 5
-        
-        # Wrap symbolized event title with strict width limits
-        words = symbolized_title.split()
-        lines = []
-        current_line = []
-        
-        for word in words:
-            # Test if adding this word would exceed column width
-            test_line = ' '.join(current_line + [word])
-            text_width = draw.textlength(test_line, font=fonts['event'])
+                current_data = fallback_temps[i % len(fallback_temps)]
+                current_code = fallback_codes[i % len(fallback_codes)]
             
-            if text_width <= available_width and len(current_line) < 6:  # Max 6 words per line
-                current_line.append(word)
-            else:
-                if current_line:
-                    lines.append(' '.join(current_line))
-                    current_line = [word]
-                else:
-                    # Single word is too long, truncate it
-                    truncated_word = word
-                    while draw.textlength(truncated_word + "...", font=fonts['event']) > available_width and len(truncated_word) > 3:
-                        truncated_word = truncated_word[:-1]
-                    lines.append(truncated_word + "..." if len(truncated_word) < len(word) else word)
-        
-        if current_line:
-            lines.append(' '.join(current_line))
+            # Paste the pre-rendered weather icon
+            paste_weather_icon(img, x_pos, weather_y, current_code, size=18)
+            
+            # Draw temperature range
+            temp_text = f"{current_data['min_temp']}° - {current_data['max_temp']}°"
+            draw.text((x_pos + 24, weather_y + 6), temp_text, font=fonts['weather'], fill="black")
         
-        # Draw event title lines with strict positioning
-        current_y = y_offset_bottoms[date_index]
+    # --- Events (waits for the calendar stage) ---
+    context = pipeline.result("calendar")
+    calendar_events = context.for_calendars(calendars).calendar_events
+    
+    def draw_event(date_index, time, event_title, calendar_symbol="●"):
+        """Lay out one event in its day column and draw it"""
+        # Skip if we're running out of vertical space
+        if y_offset_bottoms[date_index] > height - 150:
+            return
         
-        for i, line in enumerate(lines[:2]):  # Limit to 2 lines max
-            # Calculate text position
-            if i == 0 and time_width > 0:
-                # First line on same line as time
-                text_x = column_left + time_width
+        x_pos = BASE_X_OFFSET + date_index * cell_width
+        layout = layout_event(x_pos, y_offset_bottoms[date_index], cell_width, time,
+                              f"{calendar_symbol} {event_title}", fonts)
+        layout.draw(draw)
+        y_offset_bottoms[date_index] += layout.height
+    
+    with pipeline.timed("layout"):
+        # Display calendar events with symbols
+        for i, date in enumerate(dates):
+            if date in calendar_events and calendar_events[date]:
+                for event in calendar_events[date][:3]:  # Limit to 3 events per day
+                    draw_event(i, event['time'], event['summary'], event.get('calendar_symbol', '●'))
             else:
-                # Subsequent lines start at column left
-                text_x = column_left
-                if i > 0:
-                    current_y += 16  # Move to next line
-            
-            # Double-check that text doesn't exceed column boundary
-            text_width = draw.textlength(line, font=fonts['event'])
-            if text_x + text_width > column_right:
-                # Truncate line to fit within column
-                truncated_line = line
-                while text_x + draw.textlength(truncated_line + "...", font=fonts['event']) > column_right and len(truncated_line) > 3:
-                    words_in_line = truncated_line.split()
-                    if len(words_in_line) > 1:
-                        truncated_line = ' '.join(words_in_line[:-1])
-                    else:
-                        truncated_line = truncated_line[:-1]
-                line = truncated_line + ("..." if len(truncated_line) < len(line) else "")
-            
-            draw.text((text_x, current_y), line, font=fonts['event'], fill="black")
+                # If no events, show a placeholder
+                draw_event(i, "", "", "") # Empty circle for no events
         
-        # Add truncation indicator if text was cut off (positioned within column)
-        if len(lines) > 2:
-            indicator_x = min(column_right - 15, text_x + draw.textlength(line, font=fonts['event']) + 5)
-            draw.text((indicator_x, current_y), "...", font=fonts['event'], fill="gray")
-        
-        # Update y position for next event with better spacing
-        lines_drawn = min(len(lines), 2)
-        spacing = 16 + (lines_drawn - 1) * 16 + 6  # Consistent spacing
-        y_offset_bottoms[date_index] += spacing
-    
-    # Display calendar events with symbols
-    for i, date in enumerate(dates):
-        if date in calendar_events and calendar_events[date]:
-            for event in calendar_events[date][:3]:  # Limit to 3 events per day
-                draw_event(i, event['time'], event['summary'], event.get('calendar_symbol', '●'))
-        else:
-            # If no events, show a placeholder
-            draw_event(i, "", "", "") # Empty circle for no events
-    
-    # Get LLM response and clean markdown
-    try:
-        joke_response = llm()
-        # Clean any markdown formatting
-        joke_response = clean_markdown_text(joke_response)
-    except Exception as e:
-        joke_response = f"Could not get fun fact: {str(e)}"
+    # Get the LLM response (already cleaned of markdown by the stage)
+    joke_response = pipeline.result("fun_fact")
     
     # --- NEW LOGIC FOR PLACING ILLUSTRATION AND SPEECH BUBBLE ---
     
@@ -284,52 +422,29 @@ def generate_illustrated_calendar(filename="output/illustrated_calendar.png", wi
     bubble_outline = (180, 180, 180)  # Darker grey
     
     # 1. SPEECH BUBBLE PARAMETERS (Starts under the event columns)
-    # Fixed Y position to start the bubble below the event section
-    bubble_y = 250 
+    # Y position measured from the panel bottom, to start the bubble below the event section
+    bubble_y = height - BUBBLE_BOTTOM_OFFSET  # 250 on a 480 px panel
     bubble_x = 20
-    bubble_width = 350
+    bubble_width = min(BUBBLE_WIDTH, width - 2 * bubble_x)
     bubble_radius = 15
 
-    # Function to wrap text for the speech bubble
-    def wrap_text(text, font, max_width):
-        words = text.split()
-        lines = []
-        current_line = []
+    with pipeline.timed("layout"):
+        # Wrap the text once; the bubble is sized to it and then drawn from it
+        wrapped_joke = measurer(fonts['speech']).wrap(joke_response, bubble_width - 40)  # Account for padding
+        needed_height = len(wrapped_joke) * 16 + 40  # Line height + padding
         
-        for word in words:
-            test_line = ' '.join(current_line + [word])
-            text_width = draw.textlength(test_line, font=font)
-            if text_width <= max_width:
-                current_line.append(word)
-            else:
-                if current_line:
-                    lines.append(' '.join(current_line))
-                    current_line = [word]
-                else:
-                    # Word is too long, split it
-                    lines.append(word)
+        # Adjust bubble height if needed (minimum 80, maximum 160)
+        bubble_height = max(80, min(160, needed_height))
         
-        if current_line:
-            lines.append(' '.join(current_line))
+        # 2. DRAW SPEECH BUBBLE
+        draw.rounded_rectangle(
+            [(bubble_x, bubble_y), (bubble_x + bubble_width, bubble_y + bubble_height)],
+            radius=bubble_radius,
+            fill=bubble_fill,
+            outline=bubble_outline,
+            width=2
+        )
         
-        return lines
-    
-    # Calculate optimal speech bubble size based on content
-    temp_wrapped = wrap_text(joke_response, fonts['speech'], bubble_width - 40)  # Account for padding
-    needed_height = len(temp_wrapped) * 16 + 40  # Line height + padding
-    
-    # Adjust bubble height if needed (minimum 80, maximum 160)
-    bubble_height = max(80, min(160, needed_height))
-    
-    # 2. DRAW SPEECH BUBBLE
-    draw.rounded_rectangle(
-        [(bubble_x, bubble_y), (bubble_x + bubble_width, bubble_y + bubble_height)],
-        radius=bubble_radius,
-        fill=bubble_fill,
-        outline=bubble_outline,
-        width=2
-    )
-    
     # 3. ILLUSTRATION PARAMETERS (Placed immediately below the speech bubble)
     illustration_width = 150 # Reduced size for fitting
     illustration_height = 150 # Reduced size for fitting
@@ -337,62 +452,57 @@ def generate_illustrated_calendar(filename="output/illustrated_calendar.png", wi
     illustration_y = bubble_y + bubble_height + 10 # Starts 10px below the speech bubble
     
     # 4. GENERATE AND PLACE ILLUSTRATION
-    animal_image_path = draw_dynamic_animal("events")
-    try:
-        illustration = Image.open(animal_image_path)
-        illustration = illustration.resize((illustration_width, illustration_height))
+    animal_image_path = pipeline.result("illustration")
+    with pipeline.timed("layout"):
+        try:
+            illustration = Image.open(animal_image_path)
+            illustration = illustration.resize((illustration_width, illustration_height))
+            
+            # Convert to RGB to remove any alpha channel
+            if illustration.mode != 'RGB':
+                illustration = illustration.convert('RGB')
+            
+            # Paste illustration on the calculated spot
+            img.paste(illustration, (illustration_x, illustration_y))
+        except FileNotFoundError:
+            draw.text((illustration_x, illustration_y), "Illustration not found", font=fonts['description'], fill="red")
+        except Exception as e:
+            draw.text((illustration_x, illustration_y), f"Error loading image: {e}", font=fonts['description'], fill="red")
         
-        # Convert to RGB to remove any alpha channel
-        if illustration.mode != 'RGB':
-            illustration = illustration.convert('RGB')
+        # 5. ADD SPEECH TRIANGLE POINTER - pointing towards the illustration's top
+        pointer_x = illustration_x + illustration_width // 2 # Center of the illustration
+        draw.polygon(
+            [(pointer_x - 20, bubble_y + bubble_height),
+             (pointer_x, bubble_y + bubble_height + 10), # Points 10px down
+             (pointer_x + 20, bubble_y + bubble_height)],
+            fill=bubble_fill,
+            outline=bubble_outline
+        )
         
-        # Paste illustration on the calculated spot
-        img.paste(illustration, (illustration_x, illustration_y))
-    except FileNotFoundError:
-        draw.text((illustration_x, illustration_y), "Illustration not found", font=fonts['description'], fill="red")
-    except Exception as e:
-        draw.text((illustration_x, illustration_y), f"Error loading image: {e}", font=fonts['description'], fill="red")
-    
-    # 5. ADD SPEECH TRIANGLE POINTER - pointing towards the illustration's top
-    pointer_x = illustration_x + illustration_width // 2 # Center of the illustration
-    draw.polygon(
-        [(pointer_x - 20, bubble_y + bubble_height),
-         (pointer_x, bubble_y + bubble_height + 10), # Points 10px down
-         (pointer_x + 20, bubble_y + bubble_height)],
-        fill=bubble_fill,
-        outline=bubble_outline
-    )
-    
-    # 6. DRAW WRAPPED TEXT IN THE SPEECH BUBBLE
-    wrapped_joke = wrap_text(joke_response, fonts['speech'], bubble_width - 40)
-    line_y = bubble_y + 15  # Start with padding from top
-    line_height = 16  # Consistent line height
-    
-    max_lines = (bubble_height - 30) // line_height  # Calculate max lines that fit
-    
-    for i, line in enumerate(wrapped_joke):
-        if i >= max_lines - 1 and i < len(wrapped_joke) - 1:
-            # If this is the last line we can fit and there are more lines, add ellipsis
-            truncated_line = line
-            while draw.textlength(truncated_line + "...", font=fonts['speech']) > bubble_width - 40 and len(truncated_line) > 0:
-                words = truncated_line.split()
-                if len(words) > 1:
-                    truncated_line = ' '.join(words[:-1])
-                else:
-                    truncated_line = truncated_line[:-1]
-            draw.text((bubble_x + 20, line_y), truncated_line + "...", font=fonts['speech'], fill="black")
-            break
-        elif i < max_lines:
-            draw.text((bubble_x + 20, line_y), line, font=fonts['speech'], fill="black")
-            line_y += line_height
-        else:
-            break
+        # 6. DRAW WRAPPED TEXT IN THE SPEECH BUBBLE
+        line_height = 16  # Consistent line height
+        max_lines = (bubble_height - 30) // line_height  # Calculate max lines that fit
+        layout_paragraph(
+            wrapped_joke, fonts['speech'], bubble_x + 20, bubble_y + 15,  # Padding from top
+            bubble_width - 40, line_height, max_lines
+        ).draw(draw)
 
     # Save with PNGdec-compatible format
     bmp_filename = filename.replace('.png', '.bmp')
-    img.save(bmp_filename, 'BMP')
+    with pipeline.timed("save"):
+        img.save(bmp_filename, 'BMP')
     print(f"Illustrated calendar saved to {bmp_filename}")
     
+    # Panel-native variants: quantized once here instead of on every device page pass
+    with pipeline.timed("encode"):
+        try:
+            save_frame_variants(img, bmp_filename)
+        except Exception as e:
+            print(f"Error encoding frame variants: {e}")
+            FAILURES.inc(stage="encode")
+    
+    return context
+    
 
 if __name__ == "__main__":
     generate_illustrated_calendar()
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+Render metrics: duration histograms and counters in Prometheus text format
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+# Histogram bucket bounds in seconds, from drawing steps to slow API calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_metrics = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with _lock:
+            return self._values.get(key, 0)
+
+    def _snapshot(self):
+        return dict(self._values)
+
+    def _delta(self, before):
+        return {key: value - before.get(key, 0) for key, value in self._values.items()
+                if value != before.get(key, 0)}
+
+    def _merge(self, delta):
+        for key, value in delta.items():
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """Distribution of durations per label combination"""
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with _lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block; labels may be changed inside it"""
+        started = time.monotonic()
+        try:
+            yield labels
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def _snapshot(self):
+        return {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+
+    def _delta(self, before):
+        delta = {}
+        for key, (counts, total, count) in self._values.items():
+            old_counts, old_total, old_count = before.get(key, ([0] * len(self.buckets), 0.0, 0))
+            if count != old_count:
+                delta[key] = ([new - old for new, old in zip(counts, old_counts)], total - old_total, count - old_count)
+        return delta
+
+    def _merge(self, delta):
+        for key, (counts, total, count) in delta.items():
+            old_counts, old_total, old_count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            self._values[key] = ([old + new for old, new in zip(old_counts, counts)], old_total + total, old_count + count)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = (("le", _format_value(float(bound))),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    with _lock:
+        metrics = list(_metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def snapshot_metrics():
+    """Current values of all metrics, to compute a delta from later"""
+    with _lock:
+        return {metric.name: metric._snapshot() for metric in _metrics}
+
+def metrics_delta(before):
+    """What changed since snapshot_metrics() returned before (picklable)"""
+    with _lock:
+        return {metric.name: metric._delta(before.get(metric.name, {})) for metric in _metrics}
+
+def merge_metrics(delta):
+    """Add a delta from another process (a render worker) to this process's metrics"""
+    with _lock:
+        for metric in _metrics:
+            if delta.get(metric.name):
+                metric._merge(delta[metric.name])
+
+# --- Render metrics ---
+
+RENDER_SECONDS = Histogram(
+    'calendar_render_seconds', 'Duration of a full calendar render', ['outcome'])
+RENDER_STAGE_SECONDS = Histogram(
+    'calendar_render_stage_seconds', 'Duration of each render stage', ['stage'])
+CALENDAR_FETCH_SECONDS = Histogram(
+    'calendar_fetch_seconds', 'Duration of fetching one calendar', ['calendar', 'mode'])
+WEATHER_REQUEST_SECONDS = Histogram(
+    'calendar_weather_request_seconds', 'Duration of Open-Meteo requests', ['outcome'])
+LLM_REQUEST_SECONDS = Histogram(
+    'calendar_llm_request_seconds', 'Duration of each OpenRouter model attempt', ['model', 'outcome'])
+IMAGE_REQUEST_SECONDS = Histogram(
+    'calendar_image_request_seconds', 'Duration of ImageRouter generation and image download',
+    ['model', 'step', 'outcome'])
+
+CACHE_LOOKUPS = Counter(
+    'calendar_cache_lookups_total', 'Cache lookups by cache and result (hit, stale, miss)', ['cache', 'result'])
+FALLBACKS = Counter(
+    'calendar_fallbacks_total', 'Renders that used fallback content instead of fresh data', ['kind'])
+FAILURES = Counter(
+    'calendar_failures_total', 'Failed requests and render steps', ['stage'])
+
+_last_render = None
+
+def record_render(context, seconds, outcome="success"):
+    """Record the stage timings of a finished render and keep it as the last render"""
+    global _last_render
+    RENDER_SECONDS.observe(seconds, outcome=outcome)
+    for stage, stage_seconds in context.stage_timings.items():
+        RENDER_STAGE_SECONDS.observe(stage_seconds, stage=stage)
+    for timing in context.calendar_timings.values():
+        CALENDAR_FETCH_SECONDS.observe(timing['seconds'], calendar=timing['name'], mode=timing['mode'])
+        if timing.get('error'):
+            FAILURES.inc(stage="calendar")
+        if timing['mode'] == "stale":
+            FALLBACKS.inc(kind="calendar_stale")
+
+    with _lock:
+        _last_render = {
+            'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seconds': round(seconds, 3),
+            'outcome': outcome,
+            'stages': dict(context.stage_timings),
+            'calendars': {
+                timing['name']: {key: timing[key] for key in ('seconds', 'events', 'mode', 'error')}
+                for timing in context.calendar_timings.values()
+            },
+        }
+
+def last_render():
+    """Summary of the last finished render, or None"""
+    with _lock:
+        return dict(_last_render) if _last_render else None
@@ -0,0 +1,240 @@
+"""
+Per-source refresh scheduler: re-render only when a source has new data
+
+Every source is checked on its own schedule (an interval, or once a day at
+a fixed time). A check returns a fingerprint of the source's current data;
+a render is triggered only when a fingerprint differs from the one stored
+for the last successful render. Last runs and fingerprints are persisted,
+so runs missed while the server was down are caught up on startup.
+"""
+import os
+import json
+import time
+import hashlib
+import datetime
+import threading
+from render_context import RenderContext
+from weather_handler import refresh_weather_forecast
+
+SCHEDULER_STATE_PATH = os.getenv('SCHEDULER_STATE_PATH', 'output/scheduler_state.json')
+REFRESH_CALENDAR_MINUTES = float(os.getenv('REFRESH_CALENDAR_MINUTES', '10'))
+REFRESH_WEATHER_MINUTES = float(os.getenv('REFRESH_WEATHER_MINUTES', '180'))
+# Local time of the daily render with a new fun fact and illustration
+REFRESH_DAILY_AT = os.getenv('REFRESH_DAILY_AT', '00:00')
+# Longest the scheduler sleeps between looking for due sources
+SCHEDULER_TICK_SECONDS = 60
+# Sources whose render failed are checked again after this, even daily ones
+REFRESH_RETRY_MINUTES = float(os.getenv('REFRESH_RETRY_MINUTES', '15'))
+# Seconds a planned render needs until its frame is published
+UPDATE_GRACE_SECONDS = int(os.getenv('UPDATE_GRACE_SECONDS', '300'))
+# Devices wake this many minutes before an event starts, to show last-minute changes
+UPDATE_EVENT_LEAD_MINUTES = float(os.getenv('UPDATE_EVENT_LEAD_MINUTES', '15'))
+# Longest sleep suggested to devices, so unplanned calendar changes still show up
+UPDATE_MAX_SLEEP_MINUTES = float(os.getenv('UPDATE_MAX_SLEEP_MINUTES', '180'))
+# Shortest sleep suggested to devices
+UPDATE_MIN_SLEEP_SECONDS = 60
+
+# Events seen by the last calendar check
+_checked_context = None
+
+def fingerprint(data):
+    """Stable hash of JSON-like data"""
+    encoded = json.dumps(data, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:16]
+
+def calendar_fingerprint(days):
+    """Fingerprint of the events of the next days; None if a calendar failed"""
+    global _checked_context
+    context = RenderContext.fetch(days=days)
+    _checked_context = context
+    if not context.calendar_events or any(timing.get('error') for timing in context.calendar_timings.values()):
+        return None
+    return fingerprint({date.isoformat(): events for date, events in context.calendar_events.items()})
+
+def weather_fingerprint(days):
+    """Fingerprint of a freshly requested forecast; None if the request failed"""
+    forecast = refresh_weather_forecast(days)
+    return fingerprint(forecast) if forecast else None
+
+def day_fingerprint():
+    """Changes once a day, so the daily source always has news"""
+    return datetime.date.today().isoformat()
+
+def upcoming_event_starts(now, calendars=None):
+    """Start times of today's timed events after now, from the last calendar check.
+
+    calendars limits the events to those calendars (ids or names).
+    """
+    context = _checked_context
+    if context is None:
+        return []
+    starts = []
+    for event in context.for_calendars(calendars).events_for(now.date()):
+        try:
+            start = datetime.datetime.combine(now.date(), datetime.time.fromisoformat(event['time']))
+        except ValueError:
+            # "All day"
+            continue
+        if start > now:
+            starts.append(start)
+    return starts
+
+class RefreshSource:
+    """A data source checked every interval seconds or daily at a "HH:MM" time"""
+
+    def __init__(self, name, check, interval=None, daily_at=None):
+        self.name = name
+        self.check = check
+        self.interval = interval
+        self.daily_at = datetime.time.fromisoformat(daily_at) if daily_at else None
+
+    def next_run(self, last_run):
+        """Epoch time the source is due after a run at last_run (None = never ran)"""
+        if last_run is None:
+            return time.time()
+        if self.interval is not None:
+            return last_run + self.interval
+        last = datetime.datetime.fromtimestamp(last_run)
+        due = datetime.datetime.combine(last.date(), self.daily_at)
+        if due <= last:
+            due += datetime.timedelta(days=1)
+        return due.timestamp()
+
+class RefreshScheduler:
+    """Checks due sources and asks for a render when any of them changed.
+
+    render(reasons) is called with the names of the changed sources and must
+    return True once the render succeeded; only then are the new fingerprints
+    stored. After a failed render the changed sources are checked again
+    within REFRESH_RETRY_MINUTES, so a daily source doesn't wait for the
+    next day.
+    """
+
+    def __init__(self, sources, render, state_path=SCHEDULER_STATE_PATH):
+        self.sources = {source.name: source for source in sources}
+        self.render = render
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"Error reading scheduler state, starting fresh: {e}")
+            return {}
+
+    def _save_state(self):
+        """Write the state atomically. Caller holds the lock."""
+        try:
+            directory = os.path.dirname(self.state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = self.state_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(self._state, f, indent=2)
+            os.replace(temp_path, self.state_path)
+        except Exception as e:
+            print(f"Error saving scheduler state: {e}")
+
+    def next_runs(self):
+        """Epoch time each source is due next, by name"""
+        with self._lock:
+            next_runs = {}
+            for name, source in self.sources.items():
+                entry = self._state.get(name, {})
+                due = source.next_run(entry.get('last_run'))
+                if entry.get('retry_at') is not None:
+                    due = min(due, entry['retry_at'])
+                next_runs[name] = due
+            return next_runs
+
+    def next_run_at(self):
+        """Epoch time of the next source check"""
+        return min(self.next_runs().values())
+
+    def next_update_at(self, calendars=None):
+        """When a device should look for a new frame next.
+
+        The earliest of: the next planned (daily) render plus the time it
+        takes, the midnight rollover, and shortly before the next of today's
+        events starts; never further away than UPDATE_MAX_SLEEP_MINUTES.
+        Interval checks are not included, since most of them find nothing new.
+        """
+        now = datetime.datetime.now()
+        grace = datetime.timedelta(seconds=UPDATE_GRACE_SECONDS)
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+        candidates = [midnight + grace, now + datetime.timedelta(minutes=UPDATE_MAX_SLEEP_MINUTES)]
+        for name, due in self.next_runs().items():
+            if self.sources[name].daily_at is not None:
+                candidates.append(datetime.datetime.fromtimestamp(due) + grace)
+        lead = datetime.timedelta(minutes=UPDATE_EVENT_LEAD_MINUTES)
+        candidates.extend(start - lead for start in upcoming_event_starts(now, calendars) if start - lead > now)
+        return max(min(candidates), now + datetime.timedelta(seconds=UPDATE_MIN_SLEEP_SECONDS))
+
+    def run_due(self):
+        """Check every due source and render if any changed. Returns the changed names."""
+        next_runs = self.next_runs()
+        now = time.time()
+        checked = {}
+        for name, due in next_runs.items():
+            if due > now:
+                continue
+            try:
+                checked[name] = self.sources[name].check()
+            except Exception as e:
+                print(f"Error checking {name} for changes: {e}")
+                checked[name] = None
+
+        with self._lock:
+            changed = []
+            for name, new_fingerprint in checked.items():
+                entry = self._state.setdefault(name, {})
+                entry['last_run'] = now
+                entry.pop('retry_at', None)
+                if new_fingerprint is None:
+                    continue
+                if entry.get('fingerprint') is None:
+                    # First check ever: nothing to compare with yet
+                    entry['fingerprint'] = new_fingerprint
+                elif entry['fingerprint'] != new_fingerprint:
+                    changed.append(name)
+            self._save_state()
+
+        if changed:
+            print(f"New data from {', '.join(changed)}, re-rendering")
+            rendered = self.render(changed)
+            with self._lock:
+                for name in changed:
+                    if rendered:
+                        self._state[name]['fingerprint'] = checked[name]
+                    else:
+                        self._state[name]['retry_at'] = time.time() + REFRESH_RETRY_MINUTES * 60
+                self._save_state()
+        return changed
+
+    def run(self):
+        """Run until stop(); sleeps until the next source is due"""
+        print(f"Refresh scheduler started with sources: {', '.join(self.sources)}")
+        while not self._stop.is_set():
+            try:
+                self.run_due()
+            except Exception as e:
+                print(f"Error in refresh scheduler: {e}")
+            wait = min(SCHEDULER_TICK_SECONDS, max(1, self.next_run_at() - time.time()))
+            self._stop.wait(wait)
+
+    def stop(self):
+        self._stop.set()
+
+def default_sources(days):
+    """Calendar, weather and the daily fun fact and illustration, as configured"""
+    return [
+        RefreshSource("calendar", lambda: calendar_fingerprint(days), interval=REFRESH_CALENDAR_MINUTES * 60),
+        RefreshSource("weather", lambda: weather_fingerprint(days), interval=REFRESH_WEATHER_MINUTES * 60),
+        RefreshSource("illustration", day_fingerprint, daily_at=REFRESH_DAILY_AT),
+    ]
@@ -0,0 +1,53 @@
+"""
+Per-render snapshot of the data shared by all render stages
+"""
+import datetime
+from calendar_api import fetch_calendar_events_with_timings
+
+class RenderContext:
+    """Calendar events fetched once per render and shared by the LLM, illustration and layout code"""
+
+    def __init__(self, calendar_events=None, today=None):
+        self.today = today or datetime.date.today()
+        self.calendar_events = calendar_events if calendar_events is not None else {}
+        # Per-calendar fetch timings, as returned by the calendar API
+        self.calendar_timings = {}
+        # Filled in by the LLM stage so the illustration can reuse it
+        self.fun_fact = None
+        # Duration of each render stage, filled in by the render pipeline
+        self.stage_timings = {}
+
+    @classmethod
+    def fetch(cls, today=None, days=4):
+        """Fetch the calendar events of the next days once and wrap them in a new context"""
+        today = today or datetime.date.today()
+        calendar_events, timings = fetch_calendar_events_with_timings(days)
+        context = cls(calendar_events=calendar_events, today=today)
+        context.calendar_timings = timings
+        return context
+
+    def events_for(self, date):
+        """Return the events for a given date (empty list if none)"""
+        return self.calendar_events.get(date, [])
+
+    @property
+    def todays_events(self):
+        return self.events_for(self.today)
+
+    def for_calendars(self, calendars):
+        """A copy holding only the events of the given calendars (ids or names).
+
+        None keeps every calendar.
+        """
+        if calendars is None:
+            return self
+        wanted = {calendar.lower() for calendar in calendars}
+        context = RenderContext(today=self.today, calendar_events={
+            date: [event for event in events
+                   if event.get('calendar_id', '').lower() in wanted
+                   or event.get('calendar_name', '').lower() in wanted]
+            for date, events in self.calendar_events.items()
+        })
+        context.calendar_timings = self.calendar_timings
+        context.fun_fact = self.fun_fact
+        return context
@@ -0,0 +1,126 @@
+"""
+Single-flight render jobs: one render at a time, later triggers join it
+"""
+import os
+import time
+import uuid
+import threading
+from datetime import datetime
+
+# Minimum seconds between the starts of two manually triggered renders, to
+# protect the LLM and image generation quotas
+RENDER_MIN_INTERVAL = int(os.getenv('RENDER_MIN_INTERVAL', '120'))
+# Finished jobs remembered for /jobs/<id>
+RENDER_JOB_HISTORY = 20
+
+class RenderJob:
+    """One render run and everyone who asked for it"""
+
+    def __init__(self, trigger, options=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.triggers = [trigger]
+        # Keyword arguments for the render function
+        self.options = options or {}
+        self.status = "queued"
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the job finished; returns whether it did"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "triggers": list(self.triggers),
+            "options": dict(self.options),
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "result": self.result,
+            "error": self.error,
+        }
+
+class RenderQueue:
+    """Runs render() in a background thread, never more than one at a time.
+
+    submit() while a job is queued or running joins that job instead of
+    starting a duplicate render. Non-forced submits are rate limited to one
+    new render per min_interval seconds.
+    """
+
+    def __init__(self, render, min_interval=RENDER_MIN_INTERVAL):
+        self.render = render
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active = None
+        self._last_started = None
+
+    def submit(self, trigger, force=False, **options):
+        """Start or join a render; options are passed to render().
+
+        Returns (job, state) with state "started", "joined" or
+        "rate_limited"; a rate limited submit returns the last job. A joined
+        job keeps the options it was started with.
+        """
+        with self._lock:
+            if self._active is not None:
+                self._active.triggers.append(trigger)
+                return self._active, "joined"
+
+            if not force and self._last_started is not None and self.retry_after() > 0:
+                return self._last_job(), "rate_limited"
+
+            job = RenderJob(trigger, options)
+            self._jobs[job.id] = job
+            while len(self._jobs) > RENDER_JOB_HISTORY:
+                self._jobs.pop(next(iter(self._jobs)))
+            self._active = job
+            self._last_started = time.monotonic()
+
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return job, "started"
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = datetime.now()
+        print(f"Render job {job.id} started ({', '.join(job.triggers)})")
+        try:
+            job.result = self.render(**job.options)
+            job.status = "succeeded"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = datetime.now()
+            print(f"Render job {job.id} {job.status}")
+            with self._lock:
+                self._active = None
+            job._done.set()
+
+    def retry_after(self):
+        """Seconds until a non-forced submit may start a new render"""
+        if self._last_started is None:
+            return 0
+        return max(0, int(self.min_interval - (time.monotonic() - self._last_started) + 0.999))
+
+    def _last_job(self):
+        return next(reversed(self._jobs.values()), None)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self):
+        with self._lock:
+            return self._active
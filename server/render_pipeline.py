@@ -0,0 +1,91 @@
+"""
+Concurrent render pipeline: runs independent render stages in parallel
+"""
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class RenderPipeline:
+    """Dependency graph of render stages executed on a thread pool.
+
+    Each stage is a function that receives the results of the stages it
+    depends on as keyword arguments. A stage starts as soon as everything it
+    depends on has finished, so independent network stages overlap while the
+    caller keeps drawing. Per-stage durations are collected in `timings`.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._futures = {}
+        self._executor = None
+        self.timings = {}
+
+    @classmethod
+    def from_results(cls, results):
+        """A pipeline whose stages already ran elsewhere, e.g. in another process"""
+        pipeline = cls()
+        for name, value in results.items():
+            future = Future()
+            future.set_result(value)
+            pipeline._futures[name] = future
+        return pipeline
+
+    def results(self):
+        """Wait for every stage and return their results by name"""
+        return {name: future.result() for name, future in self._futures.items()}
+
+    def add_stage(self, name, func, depends_on=()):
+        """Register a stage. Dependencies must be registered before it."""
+        for dependency in depends_on:
+            if dependency not in self._stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'")
+        self._stages[name] = (func, tuple(depends_on))
+
+    def start(self):
+        """Start all stages in the background"""
+        # One thread per stage, so stages waiting on a dependency never starve
+        # the stage they wait for
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, len(self._stages)), thread_name_prefix="render"
+        )
+        for name in self._stages:
+            self._futures[name] = self._executor.submit(self._run_stage, name)
+        return self
+
+    def _run_stage(self, name):
+        func, depends_on = self._stages[name]
+        kwargs = {dependency: self._futures[dependency].result() for dependency in depends_on}
+
+        started = time.monotonic()
+        try:
+            return func(**kwargs)
+        finally:
+            self.timings[name] = round(time.monotonic() - started, 3)
+
+    def result(self, name):
+        """Wait for a stage and return its result (re-raises its exception)"""
+        return self._futures[name].result()
+
+    @contextmanager
+    def timed(self, name):
+        """Time work done by the caller itself, e.g. drawing, as a stage.
+        
+        Timing the same name again adds to it, so work split over several
+        places can be reported as one stage.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.timings[name] = round(self.timings.get(name, 0) + elapsed, 3)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
@@ -0,0 +1,87 @@
+"""
+Cache for the static layer of the frame (the chrome that only changes daily)
+"""
+import os
+import threading
+from PIL import Image
+from metrics import CACHE_LOOKUPS
+
+STATIC_LAYER_DIR = os.getenv('STATIC_LAYER_DIR', 'output/static_layer')
+
+class StaticLayerCache:
+    """Rendered base layers kept in memory and as PNG files on disk.
+
+    Layers are keyed by a string that starts with their date (ISO format),
+    so layers of earlier days can be dropped once a new day's layer exists.
+    """
+
+    def __init__(self, directory=STATIC_LAYER_DIR):
+        self.directory = directory
+        self._layers = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.png')
+
+    def get(self, key, render):
+        """Return a copy of the layer for key, rendering it with render() if needed"""
+        with self._lock:
+            layer = self._layers.get(key)
+            result = "hit"
+            if layer is None:
+                layer = self._load(key)
+                result = "disk"
+            if layer is None:
+                layer = render()
+                self._save(key, layer)
+                result = "miss"
+            CACHE_LOOKUPS.inc(cache="static_layer", result=result)
+            if key not in self._layers:
+                self._prune(key)
+                self._layers[key] = layer
+        # Callers draw the dynamic layers on top, so never hand out the cached one
+        return layer.copy()
+
+    def _load(self, key):
+        try:
+            with Image.open(self._path(key)) as stored:
+                layer = stored.convert('RGB')
+            print(f"Using stored static layer {key}")
+            return layer
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading static layer {key}: {e}")
+            return None
+
+    def _save(self, key, layer):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = self._path(key) + '.tmp'
+            layer.save(temp_path, 'PNG', compress_level=1)
+            os.replace(temp_path, self._path(key))
+        except Exception as e:
+            print(f"Error saving static layer {key}: {e}")
+
+    def _prune(self, key):
+        """Forget layers of days before the one in key. Caller holds the lock."""
+        date = key[:10]
+        for old_key in [k for k in self._layers if k[:10] < date]:
+            del self._layers[old_key]
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.png') and entry.name[:10] < date:
+                    os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+_static_layers = None
+_static_layers_lock = threading.Lock()
+
+def get_static_layers():
+    """Return the process-wide static layer cache"""
+    global _static_layers
+    with _static_layers_lock:
+        if _static_layers is None:
+            _static_layers = StaticLayerCache()
+        return _static_layers
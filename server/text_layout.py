@@ -0,0 +1,129 @@
+"""
+Text measurement and layout with cached advance widths
+"""
+import threading
+
+# Measured strings kept per font before the cache is cleared
+MEASURE_CACHE_SIZE = 4096
+
+class TextMeasurer:
+    """Advance widths of strings in one font, measured once and cached.
+
+    Lines are measured as the sum of their cached word widths, so wrapping
+    is linear in the number of words and truncation needs only a binary
+    search over prefix lengths.
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self._widths = {}
+
+    def width(self, text):
+        width = self._widths.get(text)
+        if width is None:
+            if len(self._widths) >= MEASURE_CACHE_SIZE:
+                self._widths.clear()
+            width = self._widths[text] = self.font.getlength(text)
+        return width
+
+    def truncate(self, text, max_width, suffix="", min_chars=0):
+        """Longest prefix of text (at least min_chars long) that fits with suffix"""
+        if self.width(text + suffix) <= max_width:
+            return text
+        low, high = min_chars, len(text) - 1
+        # Find the largest prefix length that fits
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.width(text[:middle] + suffix) <= max_width:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:max(low, min_chars)]
+
+    def truncate_words(self, text, max_width, suffix="", min_chars=0):
+        """Drop whole words from the end until text fits with suffix, then characters"""
+        words = text.split()
+        if not words:
+            return text
+        space = self.width(" ")
+        widths = [self.width(word) for word in words]
+        suffix_width = self.width(suffix)
+
+        line_width = sum(widths) + space * (len(words) - 1)
+        count = len(words)
+        while count > 1 and line_width + suffix_width > max_width:
+            count -= 1
+            line_width -= widths[count] + space
+        if count > 1 or line_width + suffix_width <= max_width:
+            return ' '.join(words[:count]) if count < len(words) else text
+        return self.truncate(words[0], max_width, suffix, min_chars)
+
+    def wrap(self, text, max_width, max_words=None, long_word_suffix=None, min_chars=3):
+        """Greedily wrap text into lines no wider than max_width.
+
+        A word that is too long for an empty line gets a line of its own,
+        truncated with long_word_suffix if one is given.
+        """
+        space = self.width(" ")
+        lines = []
+        current_line = []
+        line_width = 0
+
+        for word in text.split():
+            word_width = self.width(word)
+            test_width = line_width + space + word_width if current_line else word_width
+            fits_words = max_words is None or len(current_line) < max_words
+
+            if test_width <= max_width and fits_words:
+                current_line.append(word)
+                line_width = test_width
+            elif current_line:
+                lines.append(' '.join(current_line))
+                current_line = [word]
+                line_width = word_width
+            elif long_word_suffix is not None:
+                truncated = self.truncate(word, max_width, long_word_suffix, min_chars)
+                lines.append(truncated + long_word_suffix if len(truncated) < len(word) else word)
+            else:
+                lines.append(word)
+
+        if current_line:
+            lines.append(' '.join(current_line))
+        return lines
+
+class TextLayout:
+    """Positioned lines of text, laid out once and drawn once"""
+
+    def __init__(self):
+        self.lines = []
+        self.height = 0
+
+    def add(self, x, y, text, font, fill="black"):
+        self.lines.append((x, y, text, font, fill))
+
+    def draw(self, draw):
+        for x, y, text, font, fill in self.lines:
+            draw.text((x, y), text, font=font, fill=fill)
+
+def layout_paragraph(lines, font, x, y, max_width, line_height, max_lines, fill="black"):
+    """Stack wrapped lines, ending with "..." on the last line if they don't all fit"""
+    text_measurer = measurer(font)
+    layout = TextLayout()
+    for i, line in enumerate(lines[:max(max_lines, 0)]):
+        if i == max_lines - 1 and i < len(lines) - 1:
+            truncated = text_measurer.truncate_words(line, max_width, "...")
+            layout.add(x, y + i * line_height, truncated + "...", font, fill)
+        else:
+            layout.add(x, y + i * line_height, line, font, fill)
+    layout.height = len(layout.lines) * line_height
+    return layout
+
+_measurers = {}
+_measurers_lock = threading.Lock()
+
+def measurer(font):
+    """Return the shared measurer of a font"""
+    with _measurers_lock:
+        if font not in _measurers:
+            _measurers[font] = TextMeasurer(font)
+        return _measurers[font]
@@ -1,22 +1,62 @@
 """
 Weather handling and icon generation
 """
+import os
+import json
+import time
+import datetime
+import threading
 import requests
 import math
+import numpy as np
+from PIL import Image, ImageDraw
+from frame_encoder import PANEL_PALETTE
+from metrics import WEATHER_REQUEST_SECONDS, CACHE_LOOKUPS, FAILURES
 
-def fetch_weather_forecast(days=4):
-    """Fetch weather forecast for the next few days."""
+# Open-Meteo forecast endpoint
+WEATHER_API_URL = os.getenv('WEATHER_API_URL', 'https://api.open-meteo.com/v1/forecast')
+
+# Default location (Copenhagen)
+WEATHER_LATITUDE = float(os.getenv('WEATHER_LATITUDE', '55.68'))
+WEATHER_LONGITUDE = float(os.getenv('WEATHER_LONGITUDE', '12.57'))
+
+# Forecast cache: fresh for WEATHER_CACHE_TTL seconds, after that it is still
+# served while a background refresh runs
+WEATHER_CACHE_PATH = os.getenv('WEATHER_CACHE_PATH', 'output/weather_cache.json')
+WEATHER_CACHE_TTL = float(os.getenv('WEATHER_CACHE_TTL', str(3 * 3600)))
+WEATHER_REQUEST_TIMEOUT = float(os.getenv('WEATHER_REQUEST_TIMEOUT', '5'))
+
+# Snap weather icon colours to the panel's black/white/red instead of leaving
+# them to the frame's dithering
+WEATHER_ICON_PANEL_PALETTE = os.getenv('WEATHER_ICON_PANEL_PALETTE', 'false').lower() == 'true'
+
+_cache_lock = threading.Lock()
+_cache = None
+_refreshing = set()
+
+def _request_weather_forecast(days, latitude, longitude):
+    """Fetch the daily forecast from Open-Meteo, starting today."""
+    with WEATHER_REQUEST_SECONDS.time(outcome="error") as labels:
+        forecast = _request_open_meteo(days, latitude, longitude)
+        if forecast:
+            labels['outcome'] = "success"
+        else:
+            FAILURES.inc(stage="weather")
+        return forecast
+
+def _request_open_meteo(days, latitude, longitude):
     try:
         # Using Open-Meteo free weather API which doesn't require authentication
         response = requests.get(
-            "https://api.open-meteo.com/v1/forecast",
+            WEATHER_API_URL,
             params={
-                "latitude": 55.68,  # Copenhagen latitude
-                "longitude": 12.57,  # Copenhagen longitude
+                "latitude": latitude,
+                "longitude": longitude,
                 "daily": "temperature_2m_max,temperature_2m_min,weathercode",
                 "timezone": "Europe/Copenhagen",
                 "forecast_days": days
-            }
+            },
+            timeout=WEATHER_REQUEST_TIMEOUT
         )
         
         if response.status_code == 200:
@@ -29,6 +69,7 @@ def fetch_weather_forecast(days=4):
                 max_temp = round(data['daily']['temperature_2m_max'][i])
                 
                 forecast.append({
+                    'date': data['daily']['time'][i],
                     'weather_code': weather_code,
                     'min_temp': min_temp,
                     'max_temp': max_temp
@@ -43,6 +84,98 @@ def fetch_weather_forecast(days=4):
         print(f"Error fetching weather: {e}")
         return None
 
+def _load_cache():
+    """Load the persisted cache on first use. Caller holds _cache_lock."""
+    global _cache
+    if _cache is None:
+        try:
+            with open(WEATHER_CACHE_PATH) as f:
+                _cache = json.load(f)
+        except FileNotFoundError:
+            _cache = {}
+        except Exception as e:
+            print(f"Error reading weather cache, starting empty: {e}")
+            _cache = {}
+    return _cache
+
+def _save_cache():
+    """Write the cache to disk atomically. Caller holds _cache_lock."""
+    try:
+        directory = os.path.dirname(WEATHER_CACHE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = WEATHER_CACHE_PATH + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(_cache, f)
+        os.replace(temp_path, WEATHER_CACHE_PATH)
+    except Exception as e:
+        print(f"Error writing weather cache: {e}")
+
+def _refresh_forecast(key, days, latitude, longitude):
+    """Fetch a new forecast into the cache. Returns it, or None on failure."""
+    # One extra day keeps a cached forecast usable after midnight
+    forecast = _request_weather_forecast(days + 1, latitude, longitude)
+    with _cache_lock:
+        _refreshing.discard(key)
+        if forecast:
+            _load_cache()[key] = {'fetched_at': time.time(), 'forecast': forecast}
+            _save_cache()
+    return forecast
+
+def _refresh_in_background(key, days, latitude, longitude):
+    """Start a background refresh unless one is already running. Caller holds _cache_lock."""
+    if key in _refreshing:
+        return
+    _refreshing.add(key)
+    threading.Thread(
+        target=_refresh_forecast, args=(key, days, latitude, longitude), daemon=True
+    ).start()
+
+def _days_from_today(forecast, days):
+    """Drop days that are already over; None if fewer than `days` remain."""
+    today = datetime.date.today().isoformat()
+    remaining = [day for day in forecast if day.get('date', today) >= today]
+    return remaining[:days] if len(remaining) >= days else None
+
+def fetch_weather_forecast(days=4, latitude=WEATHER_LATITUDE, longitude=WEATHER_LONGITUDE):
+    """Fetch weather forecast for the next few days.
+
+    Served from a cache keyed by location and days that is persisted to
+    WEATHER_CACHE_PATH. A fresh entry is returned directly. A stale entry is
+    returned as well, while a background refresh fetches a new one. Only a
+    missing or unusable entry waits for Open-Meteo, with a strict timeout.
+    """
+    key = f"{latitude:.2f},{longitude:.2f},{days}"
+    
+    with _cache_lock:
+        entry = _load_cache().get(key)
+        if entry:
+            forecast = _days_from_today(entry['forecast'], days)
+            if forecast:
+                if time.time() - entry['fetched_at'] > WEATHER_CACHE_TTL:
+                    print("Serving stale weather forecast while refreshing in the background")
+                    CACHE_LOOKUPS.inc(cache="weather", result="stale")
+                    _refresh_in_background(key, days, latitude, longitude)
+                else:
+                    CACHE_LOOKUPS.inc(cache="weather", result="hit")
+                return forecast
+        _refreshing.add(key)
+    
+    CACHE_LOOKUPS.inc(cache="weather", result="miss")
+    forecast = _refresh_forecast(key, days, latitude, longitude)
+    return forecast[:days] if forecast else None
+
+def refresh_weather_forecast(days=4, latitude=WEATHER_LATITUDE, longitude=WEATHER_LONGITUDE):
+    """Request a new forecast now, bypassing the cache, and store it in the cache.
+
+    Returns the forecast, or None if the request failed (the cache is kept).
+    """
+    key = f"{latitude:.2f},{longitude:.2f},{days}"
+    with _cache_lock:
+        _refreshing.add(key)
+    forecast = _refresh_forecast(key, days, latitude, longitude)
+    return _days_from_today(forecast, days) if forecast else None
+
 def create_weather_icon(draw, x, y, weather_code, size=30):
     """Draw a custom weather icon based on the weather code."""
     # Define colors
@@ -243,4 +376,91 @@ def create_weather_icon(draw, x, y, weather_code, size=30):
     # Unknown or not specified
     else:
         # Draw a question mark
-        draw.text((center_x - radius * 0.5, center_y - radius * 0.5), "?", fill=(0, 0, 0))
\ No newline at end of file
+        draw.text((center_x - radius * 0.5, center_y - radius * 0.5), "?", fill=(0, 0, 0))
+
+# One representative weather code per icon shape, in create_weather_icon's order
+ICON_GROUPS = {
+    'clear': 0,
+    'partly_cloudy': 2,
+    'overcast': 3,
+    'fog': 45,
+    'rain': 61,
+    'snow': 71,
+    'thunderstorm': 95,
+    'rain_showers': 80,
+    'snow_showers': 85,
+    'unknown': -1,
+}
+
+def icon_group(weather_code):
+    """Name of the icon shape create_weather_icon draws for a weather code"""
+    if weather_code in [0, 1]:
+        return 'clear'
+    if weather_code == 2:
+        return 'partly_cloudy'
+    if weather_code == 3:
+        return 'overcast'
+    if weather_code in [45, 48]:
+        return 'fog'
+    if weather_code in range(51, 68):
+        return 'rain'
+    if weather_code in range(71, 78):
+        return 'snow'
+    if weather_code in range(95, 100):
+        return 'thunderstorm'
+    if weather_code in range(80, 83):
+        return 'rain_showers'
+    if weather_code in range(83, 87):
+        return 'snow_showers'
+    return 'unknown'
+
+class WeatherIconAtlas:
+    """Weather icons pre-rendered once per (icon group, size, palette).
+
+    Every sprite is an RGBA image with a margin of half the icon size, since
+    sun rays reach past the icon box, and is pasted with its own alpha as
+    the mask. Sprites are drawn at a fixed origin, so float rounding can put a
+    few edge pixels (e.g. sun ray tips) one pixel off from drawing the icon
+    directly at another position. With a palette every colour is snapped to the nearest palette
+    colour, so the pasted icon needs no later colour conversion.
+    """
+
+    def __init__(self):
+        self._sprites = {}
+        self._lock = threading.Lock()
+
+    def sprite(self, weather_code, size, palette=None):
+        """Return (sprite, margin) for a weather code, rendering its group lazily"""
+        key = (icon_group(weather_code), size, tuple(palette) if palette else None)
+        with self._lock:
+            if key not in self._sprites:
+                self._sprites[key] = self._render(*key)
+            return self._sprites[key]
+
+    @staticmethod
+    def _render(group, size, palette):
+        margin = size // 2
+        sprite = Image.new('RGBA', (size + 2 * margin, size + 2 * margin), (0, 0, 0, 0))
+        create_weather_icon(ImageDraw.Draw(sprite), margin, margin, ICON_GROUPS[group], size)
+
+        if palette:
+            # Nearest palette colour for every pixel, keeping the alpha
+            pixels = np.asarray(sprite, dtype=np.int32)
+            colors = np.array(palette, dtype=np.int32)
+            distances = ((pixels[:, :, None, :3] - colors[None, None, :, :]) ** 2).sum(axis=3)
+            snapped = np.dstack([colors[distances.argmin(axis=2)], pixels[:, :, 3]]).astype(np.uint8)
+            sprite = Image.fromarray(snapped, 'RGBA')
+        return sprite, margin
+
+_icon_atlas = WeatherIconAtlas()
+
+def paste_weather_icon(img, x, y, weather_code, size=30, palette=None):
+    """Paste the pre-rendered icon for a weather code at (x, y).
+
+    Draws the same icon as create_weather_icon(draw, x, y, weather_code, size).
+    Pass a list of RGB colours as palette to get the icon in those colours.
+    """
+    if palette is None and WEATHER_ICON_PANEL_PALETTE:
+        palette = PANEL_PALETTE
+    sprite, margin = _icon_atlas.sprite(weather_code, size, palette)
+    img.paste(sprite, (x - margin, y - margin), sprite)
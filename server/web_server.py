@@ -1,20 +1,29 @@
 #!/usr/bin/env python3
 """
 Web server to serve calendar images for ESP32 eink display
-Automatically regenerates calendar at midnight
+Re-renders whenever the calendar or weather changes, and daily at midnight
 """
 
 import os
-import schedule
+import json
 import time
 import threading
-from datetime import datetime
-from flask import Flask, send_file, jsonify, request
+from datetime import datetime, date, timedelta
+from flask import Flask, jsonify, request
+from werkzeug.exceptions import HTTPException
 import logging
 
 # Import our modular components
-from main import generate_illustrated_calendar
+from main import render_placeholder
 from llm_handler import llm
+from image_cache import get_image_cache
+from frame_encoder import frame_stats_path
+from frame_diff import remember_frame, has_frame, frame_diff, precompute_diffs, FRAME_DIFF_MAX_RECTS
+from frame_store import get_frame_store
+from render_jobs import RenderQueue
+from refresh_scheduler import RefreshScheduler, default_sources
+from display_profiles import load_display_profiles, render_profiles, DEFAULT_PROFILE
+from metrics import render_metrics, last_render, RENDER_SECONDS, FAILURES
 
 # Configure logging
 logging.basicConfig(
@@ -27,120 +36,422 @@ app = Flask(__name__)
 
 # Configuration - CHANGED TO BMP
 CALENDAR_IMAGE_PATH = "output/illustrated_calendar.bmp"
+# Panel-native variants written next to the BMP by the render
+CALENDAR_PACKED_PATH = "output/illustrated_calendar.epd"
+CALENDAR_INDEXED_PATH = "output/illustrated_calendar_indexed.bmp"
+CALENDAR_COMPRESSED_PATH = "output/illustrated_calendar.rle"
 STATIC_DIR = "output"
 HOST = "0.0.0.0"
 PORT = 8000
+# Request threads of the WSGI server
+WEB_THREADS = int(os.getenv('WEB_THREADS', '8'))
+# Seconds devices are asked to wait while only a placeholder is available
+RENDER_RETRY_AFTER = int(os.getenv('RENDER_RETRY_AFTER', '60'))
+# Only serve the frames published by another (rendering) server process
+# sharing output/, e.g. extra gunicorn workers; never render here
+SERVE_ONLY = os.getenv('SERVE_ONLY', 'false').lower() == 'true'
+
+# Display profiles by name; the default one renders to the paths above
+PROFILES = load_display_profiles()
 
 # Ensure output directory exists
 os.makedirs(STATIC_DIR, exist_ok=True)
 
-def generate_new_calendar():
-    """Generate a new calendar image"""
+def frame_store(profile=DEFAULT_PROFILE):
+    return get_frame_store(PROFILES[profile].frames_dir)
+
+def publish_calendar(profile=DEFAULT_PROFILE):
+    """Publish the files of a profile's last render as its new live frame version"""
+    display = PROFILES[profile]
+    files = {name: path for name, path in display.frame_files().items() if os.path.exists(path)}
+    frame = frame_store(profile).publish(files, stats=load_frame_stats(display.bmp_path))
     try:
-        logger.info("Starting calendar generation...")
-        generate_illustrated_calendar(filename=CALENDAR_IMAGE_PATH)
-        logger.info(f"Calendar generated successfully: {CALENDAR_IMAGE_PATH}")
-        return True
+        # Devices showing an earlier frame can fetch just the changed
+        # rectangles; the diffs are ready before they ask
+        if 'indexed' in files:
+            remember_frame(frame.etag('bmp'), files['indexed'], display.history_dir)
+            precompute_diffs(frame.etag('bmp'), display.history_dir)
+    except Exception as e:
+        logger.error(f"Error preparing frame diffs: {e}")
+    return frame
+
+def generate_new_calendar(reuse_daily_content=False):
+    """Generate and publish new frames for all profiles, returning their frame versions.
+    
+    Runs on the render queue's worker thread; call render_queue.submit()
+    instead of calling this directly. With reuse_daily_content the fun fact
+    and illustration already generated today are kept.
+    """
+    started = time.monotonic()
+    try:
+        logger.info(f"Starting calendar generation for profiles: {', '.join(PROFILES)}")
+        versions = {}
+        for profile in render_profiles(list(PROFILES.values()), reuse_daily_content):
+            versions[profile] = publish_calendar(profile).version
+        logger.info(f"Calendar generated successfully: {versions}")
+        return versions
     except Exception as e:
         logger.error(f"Error generating calendar: {e}")
-        return False
+        RENDER_SECONDS.observe(time.monotonic() - started, outcome="error")
+        FAILURES.inc(stage="render")
+        raise
+
+# All renders go through this queue, so concurrent triggers share one render
+render_queue = RenderQueue(generate_new_calendar)
 
-def scheduled_calendar_generation():
-    """Function to run scheduled calendar generation"""
-    logger.info("Midnight calendar generation triggered")
-    success = generate_new_calendar()
-    if success:
+def scheduled_calendar_generation(changed):
+    """Re-render for the sources the refresh scheduler saw change; returns success"""
+    trigger = f"schedule: {', '.join(changed)} changed"
+    reuse_daily_content = "illustration" not in changed
+    job, state = render_queue.submit(trigger, force=True, reuse_daily_content=reuse_daily_content)
+    if state == "joined":
+        # The running render may have fetched its data before the change
+        job.wait()
+        job, state = render_queue.submit(trigger, force=True, reuse_daily_content=True)
+    job.wait()
+    if job.status == "succeeded":
         logger.info("Scheduled calendar generation completed successfully")
     else:
         logger.error("Scheduled calendar generation failed")
+    return job.status == "succeeded"
+
+refresh_scheduler = RefreshScheduler(
+    default_sources(max(profile.days for profile in PROFILES.values())),
+    scheduled_calendar_generation
+)
+
+def current_frame(profile=DEFAULT_PROFILE):
+    """The live published frame of a profile, or None if nothing was published yet.
+    
+    Never waits for a render. Without a real frame a render is started in
+    the background (or joined, subject to the refresh rate limit), unless
+    this process only serves (SERVE_ONLY).
+    """
+    frame = frame_store(profile).current()
+    if (frame is None or frame.placeholder) and not SERVE_ONLY:
+        job, state = render_queue.submit("missing frame", reuse_daily_content=True)
+        if state == "started":
+            logger.warning("Calendar image not found, generating new one in the background...")
+    return frame
+
+def send_frame(name, mimetype, download_name, profile=DEFAULT_PROFILE, version=None):
+    """Serve one file of the live frame version with ESP32-friendly headers.
+    
+    The bytes come straight from the memory-mapped published version, so
+    a render publishing a new version never blocks or tears a download.
+    Every response carries the content hash as a strong ETag. Conditional
+    requests (If-None-Match / If-Modified-Since) for an unchanged frame get
+    304 Not Modified, and HEAD returns only the headers. Range requests get
+    206 Partial Content, so an interrupted download can be resumed; with
+    If-Range a resume against a frame that changed meanwhile gets the whole
+    new frame instead.
+    
+    With version, that published version is served instead of the live one.
+    It never changes, so it can be cached forever and always resumed.
+    """
+    try:
+        if version is not None:
+            frame = frame_store(profile).get(version)
+            if frame is None:
+                return "Frame version not available", 404
+        else:
+            frame = current_frame(profile)
+        if frame is None:
+            response = app.response_class("Calendar image is being generated", status=503)
+            response.headers['Retry-After'] = str(RENDER_RETRY_AFTER)
+            return response
+        if name not in frame:
+            return "Calendar image not available", 404
+        
+        size = frame.size(name)
+        response = app.response_class(frame.chunks(name), mimetype=mimetype, direct_passthrough=True)
+        response.content_length = size
+        response.set_etag(frame.etag(name))
+        response.last_modified = frame.published_at
+        response.headers['Content-Disposition'] = f'inline; filename={download_name}'
+        if version is not None:
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            # Clients may keep the frame but must revalidate it every time
+            response.headers['Cache-Control'] = 'no-cache'
+        if frame.placeholder:
+            # Tell the device when the real frame is likely to be there
+            response.headers['Retry-After'] = str(RENDER_RETRY_AFTER)
+        
+        response = response.make_conditional(request, accept_ranges=True, complete_length=size)
+        if response.status_code == 206:
+            # Stream just the range from the mapping instead of skipping through the file
+            response.response = frame.chunks(name, response.content_range.start, response.content_range.stop)
+        return response
+    
+    except HTTPException:
+        # 416 Range Not Satisfiable
+        raise
+    except Exception as e:
+        logger.error(f"Error serving calendar: {e}")
+        return f"Error serving calendar: {str(e)}", 500
 
 @app.route('/calendar.png')  # Keep URL same for ESP32 compatibility
 def serve_calendar():
     """Serve the current calendar image (BMP format)"""
+    return send_frame('bmp', 'image/bmp', 'calendar.bmp')
+
+@app.route('/calendar.epd')
+def serve_calendar_packed():
+    """Serve the quantized frame as packed black and red bit planes"""
+    return send_frame('packed', 'application/octet-stream', 'calendar.epd')
+
+@app.route('/calendar.rle')
+def serve_calendar_compressed():
+    """Serve the packed bit planes PackBits-compressed per row"""
+    return send_frame('compressed', 'application/octet-stream', 'calendar.rle')
+
+@app.route('/calendar_indexed.bmp')
+def serve_calendar_indexed():
+    """Serve the quantized frame as an 8-bit palette BMP"""
+    return send_frame('indexed', 'image/bmp', 'calendar_indexed.bmp')
+
+@app.route('/calendar.diff')
+def serve_calendar_diff(profile=DEFAULT_PROFILE):
+    """Serve only the rectangles that changed since the frame ?from=<frame_hash>.
+    
+    ?rects=<n> asks for at most n rectangles (1 = their bounding box). 304 if the device already shows the current frame, 404 if the old frame
+    is no longer known or belongs to another panel size (the device should
+    then fetch the full frame).
+    """
+    from_hash = request.args.get('from', '')
+    max_rects = request.args.get('rects', FRAME_DIFF_MAX_RECTS, type=int)
+    history_dir = PROFILES[profile].history_dir
     try:
-        if not os.path.exists(CALENDAR_IMAGE_PATH):
-            logger.warning("Calendar image not found, generating new one...")
-            generate_new_calendar()
+        frame = frame_store(profile).current()
+        if frame is None:
+            return "Calendar image not available", 404
         
-        if os.path.exists(CALENDAR_IMAGE_PATH):
-            # Add headers for ESP32 compatibility - CHANGED MIMETYPE TO BMP
-            response = send_file(
-                CALENDAR_IMAGE_PATH, 
-                mimetype='image/bmp',  # Changed from image/png to image/bmp
-                as_attachment=False,
-                download_name='calendar.bmp'  # Changed from .png to .bmp
-            )
-            # Add cache control headers
-            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
-            return response
+        current_hash = frame.etag('bmp')
+        if from_hash == current_hash:
+            response = app.response_class(status=304)
+        elif not has_frame(from_hash, history_dir) or not has_frame(current_hash, history_dir):
+            return jsonify({"error": "unknown base frame", "frame_hash": current_hash}), 404
         else:
-            return "Calendar image not available", 404
-            
+            try:
+                data = frame_diff(from_hash, current_hash, max_rects, history_dir)
+            except ValueError:
+                return jsonify({"error": "base frame has another size", "frame_hash": current_hash}), 404
+            response = app.response_class(data, mimetype='application/octet-stream')
+        
+        response.set_etag(current_hash)
+        response.headers['X-Frame-Hash'] = current_hash
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+        
     except Exception as e:
-        logger.error(f"Error serving calendar: {e}")
-        return f"Error serving calendar: {str(e)}", 500
+        logger.error(f"Error serving frame diff: {e}")
+        return f"Error serving frame diff: {str(e)}", 500
+
+# Frame URLs and the published files behind them
+FRAME_URLS = {
+    "/calendar.png": "bmp",
+    "/calendar.epd": "packed",
+    "/calendar.rle": "compressed",
+    "/calendar_indexed.bmp": "indexed",
+}
 
 @app.route('/calendar')
 def serve_calendar_alt():
     """Alternative endpoint for calendar image"""
     return serve_calendar()
 
+def load_frame_stats(bmp_path=CALENDAR_IMAGE_PATH):
+    """Encoding stats written by the last render, or None"""
+    try:
+        with open(frame_stats_path(bmp_path)) as f:
+            return json.load(f)
+    except Exception:
+        return None
+
 @app.route('/status')
 def status():
     """Status endpoint for health checks"""
-    calendar_exists = os.path.exists(CALENDAR_IMAGE_PATH)
+    frame = frame_store().current()
+    active_job = render_queue.active()
     file_age = None
     
-    if calendar_exists:
-        file_stat = os.stat(CALENDAR_IMAGE_PATH)
-        file_age = time.time() - file_stat.st_mtime
+    if frame:
+        file_age = (datetime.now() - frame.published_at).total_seconds()
     
     return jsonify({
         "status": "running",
-        "calendar_exists": calendar_exists,
+        "calendar_exists": frame is not None,
+        "placeholder": frame.placeholder if frame else None,
         "calendar_path": CALENDAR_IMAGE_PATH,
+        "frame_version": frame.version if frame else None,
         "file_age_seconds": file_age,
-        "last_modified": datetime.fromtimestamp(os.stat(CALENDAR_IMAGE_PATH).st_mtime).isoformat() if calendar_exists else None,
+        "last_modified": frame.published_at.isoformat() if frame else None,
+        "image_cache": get_image_cache().stats(),
+        "frame_encoding": frame.stats if frame else None,
+        "last_render": last_render(),
+        "profiles": {name: frame_version(name) for name in PROFILES},
+        "render_job": active_job.to_dict() if active_job else None,
+        "next_source_checks": {
+            name: datetime.fromtimestamp(due).isoformat()
+            for name, due in refresh_scheduler.next_runs().items()
+        },
         "server_time": datetime.now().isoformat()
     })
 
+@app.route('/metrics')
+def metrics():
+    """Render timings, cache hits, fallbacks and failures in Prometheus text format"""
+    return app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/refresh')
 def refresh_calendar():
-    """Manually trigger calendar refresh"""
+    """Manually trigger calendar refresh.
+    
+    Returns 202 with a job id right away (joining a render already in
+    progress), 429 with Retry-After if the last render started too recently,
+    or 503 if this process only serves frames.
+    """
     client_ip = request.remote_addr
     logger.info(f"Manual refresh requested from {client_ip}")
     
-    success = generate_new_calendar()
+    if SERVE_ONLY:
+        response = jsonify({
+            "status": "serve_only",
+            "message": "This server only serves frames; refresh on the rendering server",
+            "timestamp": datetime.now().isoformat()
+        })
+        response.status_code = 503
+        return response
     
-    if success:
-        return jsonify({
-            "status": "success",
-            "message": "Calendar refreshed successfully",
+    job, state = render_queue.submit(f"refresh from {client_ip}")
+    
+    if state == "rate_limited":
+        retry_after = render_queue.retry_after()
+        response = jsonify({
+            "status": "rate_limited",
+            "message": f"A render started less than {render_queue.min_interval} seconds ago",
+            "retry_after": retry_after,
+            "last_job": job.to_dict() if job else None,
             "timestamp": datetime.now().isoformat()
         })
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+    
+    response = jsonify({
+        "status": state,
+        "message": "Joined the render in progress" if state == "joined" else "Calendar refresh started",
+        "job_id": job.id,
+        "job_url": f"/jobs/{job.id}",
+        "timestamp": datetime.now().isoformat()
+    })
+    response.status_code = 202
+    response.headers['Location'] = f"/jobs/{job.id}"
+    return response
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status of a render job started by /refresh"""
+    job = render_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job", "job_id": job_id}), 404
+    return jsonify(job.to_dict())
+
+def frame_version(profile):
+    frame = frame_store(profile).current()
+    return frame.version if frame else None
+
+def frame_info(profile=DEFAULT_PROFILE, url_prefix=""):
+    """The /info response of a profile, with frame URLs under url_prefix"""
+    frame = current_frame(profile)
+    available = frame is not None and not frame.placeholder
+    
+    # Devices sleep until the next frame can differ from this one; while a
+    # render is on its way they only wait for it to finish
+    if available and render_queue.active() is None:
+        next_update_at = refresh_scheduler.next_update_at(PROFILES[profile].calendars)
     else:
-        return jsonify({
-            "status": "error",
-            "message": "Failed to refresh calendar",
-            "timestamp": datetime.now().isoformat()
-        }), 500
+        next_update_at = datetime.now() + timedelta(seconds=RENDER_RETRY_AFTER)
+    sleep_seconds = max(0, int((next_update_at - datetime.now()).total_seconds()))
+    
+    # Devices compare frame_hash with the last frame they showed and skip
+    # the download when it is unchanged
+    etags = {}
+    # The same files under URLs that never change, for resumable downloads.
+    # Keys and URLs are relative to the profile, like the device's server URL.
+    frame_urls = {}
+    for url, name in FRAME_URLS.items():
+        if frame and name in frame:
+            etags[url] = frame.etag(name)
+            frame_urls[url] = f"/frames/{frame.version}{url}"
+    
+    response = jsonify({
+        "calendar_available": available,
+        "calendar_url": url_prefix + "/calendar.png",  # URL stays same for ESP32
+        "last_update": frame.published_at.isoformat() if available else None,
+        "frame_hash": frame.etag("bmp") if frame else None,
+        "etags": etags,
+        "frame_version": frame.version if frame else None,
+        "frame_urls": frame_urls,
+        "retry_after": None if available else RENDER_RETRY_AFTER,
+        "next_update_at": next_update_at.isoformat(timespec='seconds'),
+        "sleep_seconds": sleep_seconds
+    })
+    if not available:
+        response.headers['Retry-After'] = str(RENDER_RETRY_AFTER)
+    return response
 
 @app.route('/info')
 def info():
     """ESP32-friendly endpoint with basic info"""
-    calendar_exists = os.path.exists(CALENDAR_IMAGE_PATH)
+    return frame_info()
+
+@app.route('/profiles')
+def list_profiles():
+    """The configured display profiles and their live frame versions"""
     return jsonify({
-        "calendar_available": calendar_exists,
-        "calendar_url": "/calendar.png",  # URL stays same for ESP32
-        "last_update": datetime.fromtimestamp(os.stat(CALENDAR_IMAGE_PATH).st_mtime).isoformat() if calendar_exists else None
+        name: dict(profile.to_dict(), url=f"/profiles/{name}/calendar.png", frame_version=frame_version(name))
+        for name, profile in PROFILES.items()
     })
 
+@app.route('/profiles/<profile>/info')
+def profile_info(profile):
+    """/info for one display profile"""
+    if profile not in PROFILES:
+        return jsonify({"error": "unknown profile", "profile": profile}), 404
+    return frame_info(profile, f"/profiles/{profile}")
+
+def send_frame_url(frame_url, profile=DEFAULT_PROFILE, version=None):
+    """send_frame() for a frame URL such as calendar.rle"""
+    name = FRAME_URLS.get('/' + frame_url)
+    if profile not in PROFILES or name is None:
+        return "Unknown profile or frame", 404
+    mimetype = 'image/bmp' if frame_url.endswith(('.png', '.bmp')) else 'application/octet-stream'
+    download_name = 'calendar.bmp' if frame_url == 'calendar.png' else frame_url
+    return send_frame(name, mimetype, download_name, profile, version)
+
+@app.route('/profiles/<profile>/<path:frame_url>')
+def serve_profile_frame(profile, frame_url):
+    """Serve a frame file or diff of one display profile, e.g. /profiles/kitchen/calendar.rle"""
+    if profile in PROFILES and frame_url == 'calendar.diff':
+        return serve_calendar_diff(profile)
+    return send_frame_url(frame_url, profile)
+
+@app.route('/frames/<version>/<frame_url>')
+def serve_frame_version(version, frame_url):
+    """Serve a file of one published frame version, e.g. /frames/20251026T060000123456/calendar.rle"""
+    return send_frame_url(frame_url, version=version)
+
+@app.route('/profiles/<profile>/frames/<version>/<frame_url>')
+def serve_profile_frame_version(profile, version, frame_url):
+    """Serve a file of one published frame version of a display profile"""
+    return send_frame_url(frame_url, profile, version)
+
 @app.route('/')
 def index():
     """Simple index page"""
-    calendar_exists = os.path.exists(CALENDAR_IMAGE_PATH)
+    calendar_exists = frame_store().current() is not None
     
     html = f"""
     <!DOCTYPE html>
@@ -160,9 +471,16 @@ def index():
         <h2>Endpoints:</h2>
         <ul>
             <li><a href="/calendar.png">/calendar.png</a> - Calendar image (BMP format for ESP32)</li>
+            <li><a href="/calendar.epd">/calendar.epd</a> - Quantized frame as packed black/red bit planes</li>
+            <li><a href="/calendar.rle">/calendar.rle</a> - Packed bit planes, PackBits-compressed per row</li>
+            <li><a href="/calendar_indexed.bmp">/calendar_indexed.bmp</a> - Quantized frame as palette BMP</li>
+            <li>/calendar.diff?from=&lt;frame_hash&gt; - Only the rectangles changed since an earlier frame</li>
             <li><a href="/status">/status</a> - Server status (JSON)</li>
-            <li><a href="/refresh">/refresh</a> - Manual refresh</li>
+            <li><a href="/metrics">/metrics</a> - Render metrics (Prometheus)</li>
+            <li><a href="/refresh">/refresh</a> - Manual refresh (starts a render job)</li>
+            <li>/jobs/&lt;job_id&gt; - Status of a render job</li>
             <li><a href="/info">/info</a> - ESP32-friendly info</li>
+            <li><a href="/profiles">/profiles</a> - Display profiles; each is served at /profiles/&lt;name&gt;/calendar.png, .epd, .rle, _indexed.bmp and /info</li>
             <li><a href="/debug/llm">/debug/llm</a> - Test LLM function</li>
             <li><a href="/debug/env">/debug/env</a> - Check environment variables</li>
         </ul>
@@ -227,40 +545,60 @@ def debug_env():
         "timestamp": datetime.now().isoformat()
     })
 
-def run_scheduler():
-    """Run the scheduler in a separate thread"""
-    logger.info("Starting scheduler thread...")
+def initialize_calendar():
+    """Make sure there is a frame to serve, then render in the background if needed.
     
-    # Schedule calendar generation at midnight
-    schedule.every().day.at("00:00").do(scheduled_calendar_generation)
+    Never waits for a render: the last published frame or the last render on
+    disk is served as is, and without either a placeholder is published.
+    """
+    store = frame_store()
+    frame = store.current()
     
-    # For testing - you can uncomment this to generate every minute
-    # schedule.every(1).minutes.do(scheduled_calendar_generation)
+    if frame is None and os.path.exists(CALENDAR_IMAGE_PATH):
+        logger.info("Publishing the last calendar render found on disk")
+        frame = publish_calendar()
+        rendered_on = datetime.fromtimestamp(os.stat(CALENDAR_IMAGE_PATH).st_mtime).date()
+    elif frame is not None:
+        rendered_on = frame.published_at.date()
     
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Check every minute
-
-def initialize_calendar():
-    """Generate initial calendar if it doesn't exist"""
-    if not os.path.exists(CALENDAR_IMAGE_PATH):
-        logger.info("No existing calendar found, generating initial calendar...")
-        generate_new_calendar()
+    if frame is None:
+        logger.info("No existing calendar found, publishing a placeholder...")
+        try:
+            store.publish(render_placeholder(), placeholder=True)
+        except Exception as e:
+            logger.error(f"Error rendering placeholder: {e}")
+    
+    missing_profile = any(frame_store(name).current() is None for name in PROFILES if name != DEFAULT_PROFILE)
+    if frame is None or frame.placeholder or rendered_on < date.today() or missing_profile:
+        logger.info("Generating calendar in the background...")
+        render_queue.submit("startup", force=True, reuse_daily_content=True)
     else:
         logger.info("Existing calendar found, using current version")
 
+def serve():
+    """Serve the app with waitress, or Flask's threaded server without it"""
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        logger.warning("waitress is not installed, using Flask's threaded development server")
+        app.run(host=HOST, port=PORT, debug=False, threaded=True)
+        return
+    waitress_serve(app, host=HOST, port=PORT, threads=WEB_THREADS)
+
 if __name__ == "__main__":
     logger.info("Starting Calendar Server...")
     
-    # Generate initial calendar
-    initialize_calendar()
-    
-    # Start scheduler in background thread
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
+    if SERVE_ONLY:
+        logger.info("Serving published frames only, renders happen elsewhere")
+    else:
+        # Publish a frame to serve and start the initial render without delaying startup
+        threading.Thread(target=initialize_calendar, daemon=True).start()
+        
+        # Check the calendar, weather and daily content for changes in the background
+        threading.Thread(target=refresh_scheduler.run, daemon=True).start()
     
     logger.info(f"Calendar server starting on http://{HOST}:{PORT}")
     logger.info(f"ESP32 can fetch calendar from: http://your-server-ip:{PORT}/calendar.png")
     
-    # Start Flask server
-    app.run(host=HOST, port=PORT, debug=False)
\ No newline at end of file
+    # Start the WSGI server
+    serve()
\ No newline at end of file